@@ -1,14 +1,23 @@
 from __future__ import division, unicode_literals
 
+import errno
 import os
 import hashlib
 import logging
+import multiprocessing
 
 from collections import defaultdict
+from multiprocessing.pool import ThreadPool
 
 from .bencode import bencode, bdecode
+from .filetable import TorrentFileTable
 from .humanize import humanize_bytes
-from .utils import is_unsplitable, get_root_of_unsplitable
+from .metrics import NullMetrics
+from .pieces import get_piece_map
+from .profiler import NullProfiler
+from .scheduler import NullScheduler
+from .utils import is_unsplitable, get_root_of_unsplitable, reflink, ReflinkNotSupportedException
+from .verify import verify_file, verify_files
 
 logger = logging.getLogger('autotorrent')
 
@@ -28,6 +37,8 @@ COLOR_MISSING_FILES = Color.RED
 COLOR_ALREADY_SEEDING = Color.BLUE
 COLOR_FOLDER_EXIST_NOT_SEEDING = Color.YELLOW
 COLOR_FAILED_TO_ADD_TO_CLIENT = Color.PINK
+COLOR_DUPLICATE = Color.CYAN
+COLOR_ERROR = Color.RED
 
 class Status:
     OK = 0
@@ -35,6 +46,8 @@ class Status:
     ALREADY_SEEDING = 2
     FOLDER_EXIST_NOT_SEEDING = 3
     FAILED_TO_ADD_TO_CLIENT = 4
+    DUPLICATE = 5
+    ERROR = 6
 
 status_messages = {
   Status.OK: '%sOK%s' % (COLOR_OK, Color.ENDC),
@@ -42,8 +55,22 @@ status_messages = {
   Status.ALREADY_SEEDING: '%sSeeded%s' % (COLOR_ALREADY_SEEDING, Color.ENDC),
   Status.FOLDER_EXIST_NOT_SEEDING: '%sExists%s' % (COLOR_FOLDER_EXIST_NOT_SEEDING, Color.ENDC),
   Status.FAILED_TO_ADD_TO_CLIENT: '%sFailed%s' % (COLOR_FAILED_TO_ADD_TO_CLIENT, Color.ENDC),
+  Status.DUPLICATE: '%sDuplicate%s' % (COLOR_DUPLICATE, Color.ENDC),
+  Status.ERROR: '%sError%s' % (COLOR_ERROR, Color.ENDC),
 }
 
+status_names = {
+  Status.OK: 'ok',
+  Status.MISSING_FILES: 'missing_files',
+  Status.ALREADY_SEEDING: 'already_seeding',
+  Status.FOLDER_EXIST_NOT_SEEDING: 'folder_exist_not_seeding',
+  Status.FAILED_TO_ADD_TO_CLIENT: 'failed_to_add_to_client',
+  Status.DUPLICATE: 'duplicate',
+  Status.ERROR: 'error',
+}
+
+LINK_TYPES = ['soft', 'hard', 'reflink']
+
 class UnknownLinkTypeException(Exception):
     pass
 
@@ -51,7 +78,8 @@ class IllegalPathException(Exception):
     pass
 
 class AutoTorrent(object):
-    def __init__(self, db, client, store_path, add_limit_size, add_limit_percent, delete_torrents, link_type='soft'):
+    def __init__(self, db, client, store_path, add_limit_size, add_limit_percent, delete_torrents, link_type='soft',
+                 verify_pieces=0, verify_processes=1, link_workers=1, profiler=None, metrics=None, add_scheduler=None):
         self.db = db
         self.client = client
         self.store_path = store_path
@@ -59,7 +87,14 @@ class AutoTorrent(object):
         self.add_limit_percent = add_limit_percent
         self.delete_torrents = delete_torrents
         self.link_type = link_type
+        self.verify_pieces = verify_pieces
+        self.verify_processes = verify_processes
+        self.link_workers = link_workers
+        self.profiler = profiler or NullProfiler()
+        self.metrics = metrics or NullMetrics()
+        self.add_scheduler = add_scheduler or NullScheduler()
         self.torrents_seeded = set()
+        self.verify_pool = None
 
     def is_legal_path(self, path):
         for p in path:
@@ -71,7 +106,22 @@ class AutoTorrent(object):
         """
         Fetches a list of currently-seeded info hashes
         """
-        self.torrents_seeded = set(x.lower() for x in self.client.get_torrents())
+        self.torrents_seeded = set(x.lower() for x in self.call_client('get_torrents'))
+    
+    def call_client(self, method, *args):
+        """
+        Calls a method on the client and counts it in the metrics.
+        """
+        self.metrics.inc('autotorrent_client_requests', method=method)
+        try:
+            result = getattr(self.client, method)(*args)
+        except Exception:
+            self.metrics.inc('autotorrent_client_errors', method=method)
+            raise
+        
+        if result is False:
+            self.metrics.inc('autotorrent_client_errors', method=method)
+        return result
 
     def get_info_hash(self, torrent):
         """
@@ -90,28 +140,31 @@ class AutoTorrent(object):
         logger.info('Found name %r for torrent' % torrent_name)
         
         if self.db.exact_mode:
-            prefix = 'd' if b'files' in torrent[b'info'] else 'f'
+            if b'files' in torrent[b'info']:
+                prefix = 'd'
+                size = sum(f[b'length'] for f in torrent[b'info'][b'files'])
+                count = len(torrent[b'info'][b'files'])
+            else:
+                prefix = 'f'
+                size = torrent[b'info'][b'length']
+                count = 1
             
-            paths = self.db.find_exact_file_path(prefix, torrent_name)
+            paths = self.db.find_exact_candidates(prefix, torrent_name, size, count)
             if paths:
                 for path in paths:
                     logger.debug('Checking exact path %r' % path)
                     if prefix == 'f':
-                        logger.info('Did an exact match to a file')
-                        size = os.path.getsize(path)
-                        if torrent[b'info'][b'length'] != size:
+                        if not os.path.isfile(path) or os.path.getsize(path) != size:
                             continue
+                        logger.info('Did an exact match to a file')
                         
+                        result = TorrentFileTable()
+                        result.append([torrent_name], size, path, True)
                         return {'mode': 'exact',
                                 'source_path': os.path.dirname(path),
-                                'files': [{
-                                    'actual_path': path,
-                                    'length': size,
-                                    'path': [torrent_name],
-                                    'completed': True,
-                                }]}
+                                'files': result}
                     else:
-                        result = []
+                        result = TorrentFileTable()
                         for f in torrent[b'info'][b'files']:
                             orig_path = [x.decode('utf-8') for x in f[b'path']]
                             p = os.path.join(path, *orig_path)
@@ -125,150 +178,383 @@ class AutoTorrent(object):
                                 logger.debug('File %r did not match, this is not exact (got size %s, expected %s)' % (p, size, f[b'length']))
                                 break
                             
-                            result.append({
-                                'actual_path': p,
-                                'length': f[b'length'],
-                                'path': orig_path,
-                                'completed': True,
-                            })
+                            result.append(orig_path, f[b'length'], p, True)
                         else:
                             logger.info('Did an exact match to a path')
                             return {'mode': 'exact',
                                     'source_path': path,
                                     'files': result}
         
-        result = []
+        result = TorrentFileTable()
+        unsplitable_files = set()
         if b'files' in torrent[b'info']: # multifile torrent
-            files_sorted = {}
-            files = {}
-            if b'files' in torrent[b'info']:
+            requests = []
+            path_files = defaultdict(list)
+            for i, f in enumerate(torrent[b'info'][b'files']):
+                orig_path = [x.decode('utf-8') for x in f[b'path']]
+                if not self.is_legal_path(orig_path):
+                    raise IllegalPathException('That is a dangerous torrent path %r, bailing' % orig_path)
                 
-                i = 0
-                path_files = defaultdict(list)
-                for f in torrent[b'info'][b'files']:
-                    orig_path = [x.decode('utf-8') for x in f[b'path']]
-                    if not self.is_legal_path(orig_path):
-                        raise IllegalPathException('That is a dangerous torrent path %r, bailing' % orig_path)
-                    
-                    path = [torrent_name] + orig_path
-                    name = path.pop()
-                    
-                    path_files[os.path.join(*path)].append({
-                        'path': orig_path,
-                        'length': f[b'length'],
-                    })
+                path_files[(torrent_name, ) + tuple(orig_path[:-1])].append(i)
+                result.append(orig_path, f[b'length'])
+                requests.append((orig_path[-1], f[b'length']))
+            
+            unsplitable_paths = set()
+            for path, files in path_files.items():
+                if is_unsplitable(requests[i][0] for i in files):
+                    unsplitable_files.update(files)
+                    name = get_root_of_unsplitable(path)
+                    if not name:
+                        continue
                     
-                    files_sorted['/'.join(orig_path)] = i
-                    i += 1
+                    while path[-1] != name:
+                        path = path[:-1]
+                    unsplitable_paths.add(path)
             
-            if self.db.unsplitable_mode:
-                unsplitable_paths = set()
+            if unsplitable_paths:
                 for path, files in path_files.items():
-                    if is_unsplitable(f['path'][-1] for f in files):
-                        path = path.split(os.sep)
-                        name = get_root_of_unsplitable(path)
-                        if not name:
-                            continue
-                        
-                        while path[-1] != name:
-                            path.pop()
-                        unsplitable_paths.add(os.path.join(*path))
+                    while path and path not in unsplitable_paths:
+                        path = path[:-1]
+                    
+                    if path:
+                        unsplitable_files.update(files)
+                        if self.db.unsplitable_mode:
+                            name = path[-1]
+                            for i in files:
+                                requests[i] = (name, result.paths[i].split('/'), result.lengths[i])
             
-            for path, files in path_files.items():
-                if self.db.unsplitable_mode:
-                    path = path.split(os.sep)
-                    while path and os.path.join(*path) not in unsplitable_paths:
-                        path.pop()
-                else:
-                    path = None
-                
-                if path:
-                    name = path[-1]
-                    for f in files:
-                        actual_path = self.db.find_unsplitable_file_path(name, f['path'], f['length'])
-                        f['actual_path'] = actual_path
-                        f['completed'] = actual_path is not None
-                    result += files
-                else:
-                    for f in files:
-                        actual_path = self.db.find_file_path(f['path'][-1], f['length'])
-                        f['actual_path'] = actual_path
-                        f['completed'] = actual_path is not None
-                    result += files
-            # resort the torrent to fit original ordering
-            result = sorted(result, key=lambda x:files_sorted['/'.join(x['path'])])
+            for i, actual_path in enumerate(self.db.find_many(requests)):
+                result.set_actual_path(i, actual_path)
             
         else: # singlefile torrent
             length = torrent[b'info'][b'length']
             actual_path = self.db.find_file_path(torrent_name, length)
             
-            result.append({
-                'actual_path': actual_path,
-                'length': length,
-                'path': [torrent_name],
-                'completed': actual_path is not None,
-            })
+            result.append([torrent_name], length, actual_path, actual_path is not None)
+        
+        if self.db.fuzzy_mode or self.db.size_mode:
+            used_paths = set(p for p in result.actual_paths if p)
+            for i, completed in enumerate(result.completed):
+                if completed or i in unsplitable_files: # all volumes of a release have the same size
+                    continue
+                
+                actual_path = None
+                if self.db.fuzzy_mode:
+                    actual_path = self.find_fuzzy_match(torrent, result, i, used_paths)
+                if not actual_path and self.db.size_mode:
+                    actual_path = self.find_size_match(torrent, result, i, used_paths)
+                
+                if actual_path:
+                    result.set_actual_path(i, actual_path)
+                    used_paths.add(actual_path)
+        
         return {'mode': 'link', 'files': result}
+    
+    def find_fuzzy_match(self, torrent, files, index, used_paths):
+        """
+        Looks for a file with the same size as the file at index in a torrent and a similar name,
+        the best ranked candidate still on disk with a matching piece is used.
+        """
+        name = files.paths[index].rsplit('/', 1)[-1]
+        length = files.lengths[index]
+        if length < self.db.fuzzy_mode_min_size:
+            return None
+        
+        for path in self.db.find_fuzzy_file_paths(name, length):
+            if path in used_paths:
+                continue
+            
+            if not os.path.isfile(path) or os.path.getsize(path) != length:
+                logger.debug('Fuzzy match %r changed on disk' % path)
+                continue
+            
+            with self.profiler.phase('verify'):
+                verified = verify_file(torrent, files, index, path)
+            if not verified:
+                logger.info('Fuzzy match %r for %r has other data' % (path, name))
+                continue
+            
+            logger.info('Found %r for %r using fuzzy matching' % (path, name))
+            return path
+        
+        return None
+    
+    def find_size_match(self, torrent, files, index, used_paths):
+        """
+        Looks for a file with the same size as the file at index in a torrent but another name.
+        The candidate must have the same extension and the same size on disk, and a piece
+        of the file is hashed to check it has the same data.
+        """
+        name = files.paths[index].rsplit('/', 1)[-1]
+        length = files.lengths[index]
+        if length < self.db.size_mode_min_size:
+            return None
+        
+        extension = os.path.splitext(name)[1].lower()
+        for path in self.db.find_size_file_paths(length):
+            if path in used_paths:
+                continue
+            
+            if os.path.splitext(path)[1].lower() != extension:
+                logger.debug('Size match %r has wrong extension for %r' % (path, name))
+                continue
+            
+            if not os.path.isfile(path) or os.path.getsize(path) != length:
+                logger.debug('Size match %r changed on disk' % path)
+                continue
+            
+            with self.profiler.phase('verify'):
+                verified = verify_file(torrent, files, index, path)
+            if not verified:
+                logger.info('Size match %r for %r has other data' % (path, name))
+                continue
+            
+            logger.info('Found %r for %r using size' % (path, name))
+            return path
+        
+        return None
 
+    def match_torrent(self, torrent):
+        """
+        Finds the physical location of files in the torrent,
+        pieces are verified if verify_pieces is set.
+        """
+        with self.profiler.phase('match'):
+            files = self.index_torrent(torrent)
+        
+        if self.verify_pieces:
+            with self.profiler.phase('verify'):
+                failed_pieces = verify_files(torrent, files['files'], self.verify_pieces, self.verify_processes, pool=self.verify_pool)
+            if failed_pieces:
+                logger.warning('%s pieces did not match the found files, marking them as missing' % len(failed_pieces))
+        
+        return files
+    
     def parse_torrent(self, torrent):
         """
         Parses the torrent and finds the physical location of files
         in the torrent
         """
-        files = self.index_torrent(torrent)
-
-        found_size, missing_size = 0, 0
-        for f in files['files']:
-            if f['completed']:
-                found_size += f['length']
-            else:
-                missing_size += f['length']
+        files = self.match_torrent(torrent)
+        found_size, missing_size = files['files'].sizes()
 
         return found_size, missing_size, files
 
     def link_files(self, destination_path, files):
         """
         Links the files to the destination_path if they are found.
+        
+        All folders are created first, then the links are made using link_workers threads.
+        If any link fails, everything created is removed again and the error is raised.
         """
-        if not os.path.isdir(destination_path):
-            os.makedirs(destination_path)
+        if self.link_type not in LINK_TYPES:
+            raise UnknownLinkTypeException('%r is not a known link type' % self.link_type)
         
+        links = []
+        folders = set()
         for f in files:
             if f['completed']:
-                destination = os.path.join(destination_path, *f['path'])
-                
-                file_path = os.path.dirname(destination)
-                if not os.path.isdir(file_path):
-                    logger.debug('Folder %r does not exist, creating' % file_path)
-                    os.makedirs(file_path)
-    
-                logger.debug('Making %s link from %r to %r' % (self.link_type, f['actual_path'], destination))
-                
-                if self.link_type == 'soft':
-                    os.symlink(f['actual_path'], destination)
-                elif self.link_type == 'hard':
-                    os.link(f['actual_path'], destination)
+                path = f['path']
+                links.append((f['actual_path'], os.path.join(destination_path, *path)))
+                for i in range(1, len(path)):
+                    folders.add(os.path.join(destination_path, *path[:i]))
+        
+        created_folders = []
+        created_links = []
+        try:
+            if not os.path.isdir(destination_path):
+                os.makedirs(destination_path)
+                created_folders.append(destination_path)
+            
+            for folder in sorted(folders): # parents sort before their children
+                try:
+                    os.mkdir(folder)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
                 else:
-                    raise UnknownLinkTypeException('%r is not a known link type' % self.link_type)
+                    logger.debug('Created folder %r' % folder)
+                    created_folders.append(folder)
+            
+            if self.link_workers > 1 and len(links) > 1:
+                pool = ThreadPool(min(self.link_workers, len(links)))
+                try:
+                    errors = pool.map(self._try_make_link, links)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                errors = [self._try_make_link(link) for link in links]
+            
+            created_links = [destination for (source, destination), error in zip(links, errors) if error is None]
+            errors = [error for error in errors if error is not None]
+            if errors:
+                logger.error('Failed to make %s of %s links, first error: %r' % (len(errors), len(links), errors[0]))
+                raise errors[0]
+        except BaseException:
+            self._remove_links(created_links, created_folders)
+            raise
+    
+    def _try_make_link(self, link):
+        """
+        Makes a link, returns the error if it fails.
+        """
+        source, destination = link
+        try:
+            self.make_link(source, destination)
+        except (IOError, OSError) as e:
+            return e
+        return None
+    
+    def make_link(self, source, destination):
+        """
+        Makes a link from source to destination using the configured link type.
+        """
+        logger.debug('Making %s link from %r to %r' % (self.link_type, source, destination))
+        
+        if self.link_type == 'soft':
+            os.symlink(source, destination)
+        elif self.link_type == 'hard':
+            os.link(source, destination)
+        elif self.link_type == 'reflink':
+            try:
+                reflink(source, destination)
+            except ReflinkNotSupportedException as e:
+                logger.debug('Reflink not possible, trying hard link instead: %s' % e)
+                try:
+                    os.link(source, destination)
+                except OSError as e:
+                    if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                        raise
+                    logger.debug('Hard link not possible, making soft link instead: %s' % e)
+                    os.symlink(source, destination)
+        else:
+            raise UnknownLinkTypeException('%r is not a known link type' % self.link_type)
+    
+    def _remove_links(self, links, folders):
+        """
+        Removes links and folders created by link_files.
+        """
+        logger.info('Removing %s links and %s folders' % (len(links), len(folders)))
+        for link in links:
+            try:
+                os.remove(link)
+            except OSError:
+                logger.warning('Unable to remove link %r' % link)
+        
+        for folder in reversed(folders):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                logger.warning('Unable to remove folder %r' % folder)
+    
+    def handle_torrentfiles(self, paths):
+        """
+        Handles torrent files in order, a torrent found in several files is only
+        handled the first time it is found.
+        
+        Yields the path and status of every file. A file that cannot be read or
+        handled is reported with Status.ERROR and the next file is handled.
+        
+        The pieces of all torrents are verified with the same pool of processes.
+        """
+        if self.verify_pieces and self.verify_processes > 1:
+            self.verify_pool = multiprocessing.Pool(self.verify_processes)
+        
+        try:
+            for item in self._handle_torrentfiles(paths):
+                yield item
+        finally:
+            if self.verify_pool is not None:
+                self.verify_pool.close()
+                self.verify_pool.join()
+                self.verify_pool = None
+    
+    def _handle_torrentfiles(self, paths):
+        handled = set()
+        for path in paths:
+            try:
+                status = self._handle_torrentfile_once(path, handled)
+            except Exception as e:
+                logger.warning('Failed to handle %s: %r' % (path, e), exc_info=True)
+                self.print_status(Status.ERROR, path, 'Failed to handle torrent file: %s' % e)
+                self.metrics.inc('autotorrent_torrents', status=status_names[Status.ERROR])
+                status = Status.ERROR
+            yield path, status
     
-    def handle_torrentfile(self, path):
+    def _handle_torrentfile_once(self, path, handled):
+        """
+        Handles a torrent file unless its info hash is in handled.
+        
+        The info hash is only added to handled if the torrent file did not fail,
+        so other copies of a failed torrent are tried.
+        """
+        with self.profiler.phase('decode'):
+            torrent = self.open_torrentfile(path)
+        
+        with self.profiler.phase('hash'):
+            info_hash = self.get_info_hash(torrent)
+        
+        if info_hash in handled:
+            self.print_status(Status.DUPLICATE, path, 'Already handled in another torrent file')
+            if self.delete_torrents:
+                logger.info('Removing torrent %r' % path)
+                os.remove(path)
+            self.metrics.inc('autotorrent_torrents', status=status_names[Status.DUPLICATE])
+            return Status.DUPLICATE
+        
+        status = self.handle_torrentfile(path, torrent, info_hash)
+        if status not in (Status.ERROR, Status.FAILED_TO_ADD_TO_CLIENT):
+            handled.add(info_hash)
+        return status
+    
+    def handle_torrentfile(self, path, torrent=None, info_hash=None):
         """
         Checks a torrentfile for files to seed, groups them by found / not found.
         The result will also include the total size of missing / not missing files.
+        
+        torrent and info_hash can be given if the torrent file is already decoded.
         """
+        status = self._handle_torrentfile(path, torrent, info_hash)
+        self.metrics.inc('autotorrent_torrents', status=status_names[status])
+        return status
+    
+    def _handle_torrentfile(self, path, torrent=None, info_hash=None):
         logger.info('Handling file %s' % path)
 
-        torrent = self.open_torrentfile(path)
-
-        if self.check_torrent_in_client(torrent):
+        profiler = self.profiler
+        if torrent is None:
+            with profiler.phase('decode'):
+                torrent = self.open_torrentfile(path)
+        
+        if info_hash is None:
+            with profiler.phase('hash'):
+                info_hash = self.get_info_hash(torrent)
+        
+        with profiler.phase('seeded check'):
+            is_seeded = self.check_torrent_in_client(torrent, info_hash)
+        
+        if is_seeded:
             self.print_status(Status.ALREADY_SEEDING, path, 'Already seeded')
             if self.delete_torrents:
                 logger.info('Removing torrent %r' % path)
                 os.remove(path)
             return Status.ALREADY_SEEDING
 
-        found_size, missing_size, files = self.parse_torrent(torrent)
-        missing_percent = (missing_size / (found_size + missing_size)) * 100
+        files = self.match_torrent(torrent)
+        
+        with profiler.phase('pieces'):
+            piece_map = get_piece_map(torrent, files['files'])
+            availability = piece_map.availability()
+            missing_size = availability.download_size # found files sharing a piece with a missing file are downloaded too
+        
+        if not availability.is_complete:
+            logger.info('Torrent is missing %s of %s pieces, %s must be downloaded' % (availability.missing_pieces, piece_map.piece_count,
+                                                                                    humanize_bytes(missing_size)))
+        
+        self.metrics.inc('autotorrent_found_bytes', piece_map.total_length - missing_size)
+        self.metrics.inc('autotorrent_missing_bytes', missing_size)
+        missing_percent = (missing_size / piece_map.total_length) * 100
         found_percent = 100 - missing_percent
         
         if missing_size and missing_percent > self.add_limit_percent or missing_size > self.add_limit_size:
@@ -285,7 +571,8 @@ class AutoTorrent(object):
                 self.print_status(Status.FOLDER_EXIST_NOT_SEEDING, path, 'The folder exist, but is not seeded by torrentclient')
                 return Status.FOLDER_EXIST_NOT_SEEDING
     
-            self.link_files(destination_path, files['files'])
+            with profiler.phase('link'):
+                self.link_files(destination_path, files['files'])
         elif files['mode'] == 'exact':
             logger.info('Preparing torrent using exact mode')
             destination_path = files['source_path']
@@ -294,18 +581,27 @@ class AutoTorrent(object):
             logger.info('Removing torrent %r' % path)
             os.remove(path)
         
-        if self.client.add_torrent(torrent, destination_path, files['files']):
+        if self.add_scheduler.enabled:
+            with profiler.phase('client wait'):
+                waited = self.add_scheduler.wait()
+            self.metrics.inc('autotorrent_client_wait_seconds', round(waited, 3))
+        
+        with profiler.phase('client add'):
+            added = self.call_client('add_torrent', torrent, destination_path, files['files'])
+        
+        if added:
             self.print_status(Status.OK, path, 'Torrent added successfully')
             return Status.OK
         else:
             self.print_status(Status.FAILED_TO_ADD_TO_CLIENT, path, 'Failed to send torrent to client')
             return Status.FAILED_TO_ADD_TO_CLIENT
     
-    def check_torrent_in_client(self, torrent):
+    def check_torrent_in_client(self, torrent, info_hash=None):
         """
         Checks if a torrent is currently seeded
         """
-        info_hash = self.get_info_hash(torrent)
+        if info_hash is None:
+            info_hash = self.get_info_hash(torrent)
         return info_hash in self.torrents_seeded
 
     def open_torrentfile(self, path):
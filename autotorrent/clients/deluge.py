@@ -9,11 +9,24 @@ from deluge_client import DelugeRPCClient
 
 from ..bencode import bencode
 from ..humanize import humanize_bytes
+from .rpcstats import RPCStats
 
 logger = logging.getLogger(__name__)
 
 class UnableToLoginException(Exception):
     pass
+
+def decode_utf8(value):
+    """
+    Decodes the bytes in a Deluge RPC result, including dict keys and lists.
+    """
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    elif isinstance(value, dict):
+        return dict((decode_utf8(k), decode_utf8(v)) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        return [decode_utf8(v) for v in value]
+    return value
     
 class DelugeClient(object):
     def __init__(self, host, port, username, password):
@@ -27,6 +40,7 @@ class DelugeClient(object):
         self.port = port
         self.username = username
         self.password = password
+        self.rpc_stats = RPCStats()
         self.rpcclient = DelugeRPCClient(self.host, self.port, self.username, self.password)
     
     def _login(self):
@@ -34,14 +48,24 @@ class DelugeClient(object):
         Logs into deluge
         """
         if not self.rpcclient.connected:
-            self.rpcclient.connect()
+            with self.rpc_stats.call('daemon.login'):
+                self.rpcclient.connect()
+    
+    def _call(self, method, *args):
+        """
+        Calls Deluge RPC and records the call in rpc_stats.
+        """
+        with self.rpc_stats.call(method, args) as call:
+            result = self.rpcclient.call(method, *args)
+            call.set_response(result)
+        return result
     
     def test_connection(self):
         """
         Tests the Deluge RPC connection, returns message if found.
         """
         self._login()
-        return 'Free space: %s' % humanize_bytes(self.rpcclient.call('core.get_free_space'))
+        return 'Free space: %s' % humanize_bytes(self._call('core.get_free_space'))
     
     def get_torrents(self):
         """
@@ -49,9 +73,36 @@ class DelugeClient(object):
         """
         logger.info('Getting a list of torrent hashes')
         self._login()
-        result = self.rpcclient.call('core.get_torrents_status', {}, ['name'])
+        result = self._call('core.get_torrents_status', {}, ['name'])
         return set(x.lower() for x in result.keys())
     
+    def ping(self):
+        """
+        Makes a call that is cheap for the client, used to time how fast it answers.
+        """
+        self._login()
+        return self._call('daemon.info')
+    
+    def get_checking_count(self):
+        """
+        Returns the number of torrents being checked.
+        """
+        self._login()
+        return len(self._call('core.get_torrents_status', {'state': 'Checking'}, ['state']))
+    
+    def get_file_lists(self):
+        """
+        Returns the complete files of every torrent in the client as tuples
+        of the path of the torrent and a list of (path, size).
+        """
+        logger.info('Getting the files of all torrents')
+        self._login()
+        result = decode_utf8(self._call('core.get_torrents_status', {}, ['name', 'save_path', 'files', 'file_progress']))
+        for torrent in result.values():
+            yield (os.path.join(torrent['save_path'], torrent['name']),
+                   [(os.path.join(torrent['save_path'], f['path']), f['size']) for f, progress in zip(torrent['files'], torrent['file_progress'])
+                    if progress == 1])
+    
     def add_torrent(self, torrent, destination_path, files, fast_resume=True):
         """
         Add a new torrent to Deluge.
@@ -74,7 +125,7 @@ class DelugeClient(object):
             mapped_files[i] = os.path.join(basename, *f['path'])
         
         self._login()
-        result = self.rpcclient.call('core.add_torrent_file', 'torrent.torrent', encoded_torrent, {
+        result = self._call('core.add_torrent_file', 'torrent.torrent', encoded_torrent, {
                                                                 'download_location': os.path.dirname(destination_path),
                                                                 'mapped_files': mapped_files})
         
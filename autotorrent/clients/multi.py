@@ -0,0 +1,151 @@
+from __future__ import division
+
+import hashlib
+import logging
+
+from multiprocessing.pool import ThreadPool
+
+from ..bencode import bencode
+from .rpcstats import RPCStats
+
+logger = logging.getLogger(__name__)
+
+class UnknownRoutingPolicyException(Exception):
+    pass
+
+def fewest_torrents(instances):
+    """
+    Routes new torrents to the client seeding the fewest torrents.
+    """
+    return min(instances, key=lambda instance: len(instance.torrents))
+
+def lowest_latency(instances):
+    """
+    Routes new torrents to the client with the lowest mean RPC latency measured so far.
+    """
+    return min(instances, key=lambda instance: instance.mean_latency())
+
+ROUTING_POLICIES = {
+    'fewest_torrents': fewest_torrents,
+    'lowest_latency': lowest_latency,
+}
+
+class ClientInstance(object):
+    """
+    A client and the torrents it seeds.
+    """
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self.torrents = set()
+    
+    def mean_latency(self):
+        methods = self.client.rpc_stats.methods.values()
+        calls = sum(stats.calls for stats in methods)
+        if not calls:
+            return 0.0
+        return sum(stats.total_time for stats in methods) / calls
+
+class MultiClient(object):
+    def __init__(self, clients, policy='fewest_torrents'):
+        """
+        Spreads torrents over several instances of torrent clients.
+        
+        clients - A list of (name, client) tuples.
+        policy - The name of a policy in ROUTING_POLICIES or a function that picks
+                 the instance a new torrent is added to from a list of ClientInstance.
+        """
+        self.instances = [ClientInstance(name, client) for name, client in clients]
+        self.next_instance = None
+        if not callable(policy):
+            if policy not in ROUTING_POLICIES:
+                raise UnknownRoutingPolicyException('Unknown routing policy %r, the choices are: %s' % (policy, ', '.join(sorted(ROUTING_POLICIES))))
+            policy = ROUTING_POLICIES[policy]
+        self.policy = policy
+    
+    @property
+    def rpc_stats(self):
+        """
+        The RPC stats of all instances, the methods are prefixed with the name of the instance.
+        """
+        rpc_stats = RPCStats()
+        for instance in self.instances:
+            for method, stats in instance.client.rpc_stats.methods.items():
+                rpc_stats.methods['%s:%s' % (instance.name, method)] = stats
+        return rpc_stats
+    
+    def _map(self, func):
+        """
+        Calls func with every instance in parallel, returns the results in the order of the instances.
+        """
+        if len(self.instances) == 1:
+            return [func(self.instances[0])]
+        
+        pool = ThreadPool(len(self.instances))
+        try:
+            return pool.map(func, self.instances)
+        finally:
+            pool.close()
+            pool.join()
+    
+    def test_connection(self):
+        """
+        Tests the connection to every instance.
+        """
+        results = self._map(lambda instance: instance.client.test_connection())
+        return ', '.join('%s: %s' % (instance.name, result) for instance, result in zip(self.instances, results))
+    
+    def get_torrents(self):
+        """
+        Returns a set of info hashes added to any of the instances.
+        The instances are asked in parallel.
+        """
+        results = self._map(lambda instance: instance.client.get_torrents())
+        for instance, torrents in zip(self.instances, results):
+            instance.torrents = set(torrents)
+            logger.info('%s seeds %s torrents' % (instance.name, len(instance.torrents)))
+        return set().union(*results)
+    
+    def route(self):
+        """
+        Returns the instance the next torrent is added to, it is picked by the
+        routing policy and kept until the torrent is added.
+        """
+        if self.next_instance is None:
+            self.next_instance = self.policy(self.instances)
+        return self.next_instance
+    
+    def ping(self):
+        """
+        Pings the instance the next torrent is added to.
+        """
+        return self.route().client.ping()
+    
+    def get_checking_count(self):
+        """
+        Returns the number of torrents being checked by the instance the next torrent is added to,
+        the other instances being busy does not matter for it.
+        """
+        return self.route().client.get_checking_count()
+    
+    def get_file_lists(self):
+        """
+        Returns the complete files of every torrent in all instances.
+        """
+        for instance in self.instances:
+            for file_list in instance.client.get_file_lists():
+                yield file_list
+    
+    def add_torrent(self, torrent, destination_path, files, fast_resume=True):
+        """
+        Adds a torrent to the instance picked by the routing policy.
+        """
+        instance = self.route()
+        self.next_instance = None
+        logger.info('Adding torrent to %s' % instance.name)
+        infohash = hashlib.sha1(bencode(torrent[b'info'])).hexdigest()
+        added = instance.client.add_torrent(torrent, destination_path, files, fast_resume)
+        if added:
+            instance.torrents.add(infohash)
+        return added
+
@@ -0,0 +1,154 @@
+from __future__ import division, print_function
+
+import logging
+import sys
+
+from timeit import default_timer
+
+import six
+
+__all__ = [
+    'RPCStats',
+    'InstrumentedProxy',
+    'payload_size',
+]
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def payload_size(value):
+    """
+    Estimates the size of an RPC payload from the strings and numbers in it.
+    """
+    if isinstance(value, (six.binary_type, six.text_type)):
+        return len(value)
+    elif isinstance(value, dict):
+        return sum(payload_size(k) + payload_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        return sum(payload_size(v) for v in value)
+    elif value is None:
+        return 0
+    return 8
+
+class MethodStats(object):
+    """
+    Latency histogram, payload sizes and errors of a single RPC method.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.request_bytes = 0
+        self.response_bytes = 0
+    
+    def add(self, seconds, request_bytes, response_bytes, error):
+        self.calls += 1
+        self.total_time += seconds
+        self.max_time = max(self.max_time, seconds)
+        for i, bucket in enumerate(LATENCY_BUCKETS):
+            if seconds <= bucket:
+                self.buckets[i] += 1
+        self.request_bytes += request_bytes
+        self.response_bytes += response_bytes
+        if error:
+            self.errors += 1
+
+class Call(object):
+    """
+    Times a single RPC call, set response to the result to count its size.
+    """
+    __slots__ = ('stats', 'method', 'request_bytes', 'response_bytes', 'start')
+    
+    def __init__(self, stats, method, request_bytes):
+        self.stats = stats
+        self.method = method
+        self.request_bytes = request_bytes
+        self.response_bytes = 0
+    
+    def set_response(self, response):
+        self.response_bytes = payload_size(response)
+    
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.record(self.method, default_timer() - self.start, self.request_bytes, self.response_bytes, exc_type is not None)
+
+class RPCStats(object):
+    """
+    Collects the latency, payload sizes and errors of the RPC calls made to a client.
+    """
+    def __init__(self):
+        self.methods = {}
+    
+    def call(self, method, request=None):
+        """
+        Returns a context manager timing a call to method with request as payload.
+        """
+        return Call(self, method, payload_size(request))
+    
+    def record(self, method, seconds, request_bytes=0, response_bytes=0, error=False):
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods[method] = MethodStats()
+        stats.add(seconds, request_bytes, response_bytes, error)
+        logger.debug('RPC %s took %.3f seconds' % (method, seconds))
+    
+    def record_error(self, method):
+        """
+        Counts an error found after the call finished, e.g. in the reply.
+        """
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods[method] = MethodStats()
+        stats.errors += 1
+    
+    def report(self, out=None):
+        """
+        Prints a table with the calls made to the client.
+        """
+        out = out or sys.stdout
+        print('', file=out)
+        print(' %-28s %7s %7s %11s %11s %11s %11s' % ('RPC method', 'Calls', 'Errors', 'Mean (ms)', 'Max (ms)', 'Sent', 'Received'), file=out)
+        for method in sorted(self.methods):
+            stats = self.methods[method]
+            print(' %-28s %7i %7i %11.3f %11.3f %11i %11i' % (method, stats.calls, stats.errors, stats.total_time / max(stats.calls, 1) * 1000,
+                                                             stats.max_time * 1000, stats.request_bytes, stats.response_bytes), file=out)
+    
+    def export(self, metrics):
+        """
+        Adds the stats to a Metrics object.
+        """
+        for method in sorted(self.methods):
+            stats = self.methods[method]
+            for bucket, count in zip(LATENCY_BUCKETS, stats.buckets):
+                metrics.set('autotorrent_client_rpc_duration_seconds_bucket', count, method=method, le='%s' % bucket)
+            metrics.set('autotorrent_client_rpc_duration_seconds_bucket', stats.calls, method=method, le='+Inf')
+            metrics.set('autotorrent_client_rpc_duration_seconds_sum', round(stats.total_time, 6), method=method)
+            metrics.set('autotorrent_client_rpc_duration_seconds_count', stats.calls, method=method)
+            metrics.set('autotorrent_client_rpc_errors', stats.errors, method=method)
+            metrics.set('autotorrent_client_rpc_request_bytes', stats.request_bytes, method=method)
+            metrics.set('autotorrent_client_rpc_response_bytes', stats.response_bytes, method=method)
+
+class InstrumentedProxy(object):
+    """
+    Wraps an XMLRPC proxy and records every method called through it.
+    """
+    def __init__(self, target, stats, name=None):
+        self._target = target
+        self._stats = stats
+        self._name = name
+    
+    def __getattr__(self, attr):
+        name = '%s.%s' % (self._name, attr) if self._name else attr
+        return InstrumentedProxy(getattr(self._target, attr), self._stats, name)
+    
+    def __call__(self, *args):
+        with self._stats.call(self._name, args) as call:
+            result = self._target(*args)
+            call.set_response(result)
+        return result
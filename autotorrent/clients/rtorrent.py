@@ -9,10 +9,14 @@ from six.moves.urllib.parse import quote
 from six.moves.xmlrpc_client import ServerProxy
 
 from ..bencode import bencode
+from ..pieces import get_piece_map
 from ..scgitransport import SCGITransport
+from .rpcstats import InstrumentedProxy, RPCStats
 
 logger = logging.getLogger(__name__)
 
+FILE_LIST_BATCH_SIZE = 100
+
 def create_proxy(url):
     proto = url.split(':')[0].lower()
     if proto == 'scgi':
@@ -23,18 +27,6 @@ def create_proxy(url):
         logger.debug('Creating Normal XMLRPC Proxy with url %r' % url)
         return ServerProxy(url)
 
-def bitfield_to_string(bitfield):
-    """
-    Converts a list of booleans into a bitfield
-    """
-    retval = bytearray((len(bitfield) + 7) // 8)
-    
-    for piece, bit in enumerate(bitfield):
-        if bit:
-            retval[piece//8] |= 1 << (7 - piece % 8)
-    
-    return bytes(retval)
-    
 class RTorrentClient(object):
     def __init__(self, url, label):
         """
@@ -43,23 +35,77 @@ class RTorrentClient(object):
         url - The url where rtorrent xmlrpc can be reached. Can be both scgi and http.
         label - The label shown in interfaces like rutorrent.
         """
+        self.rpc_stats = RPCStats()
         self.proxy = create_proxy(url)
         self.label = label
     
+    @property
+    def proxy(self):
+        return self._proxy
+    
+    @proxy.setter
+    def proxy(self, proxy):
+        """
+        Sets the XMLRPC proxy, calls are made through self.rpc so they are recorded in rpc_stats.
+        """
+        self._proxy = proxy
+        self.rpc = InstrumentedProxy(proxy, self.rpc_stats)
+    
     def test_connection(self):
         """
         Tests the XMLRPC proxy, returns tuple with cwd and pid if found.
         """
-        methods = self.proxy.system.listMethods()
+        methods = self.rpc.system.listMethods()
         assert 'view.list' in methods
-        return 'cwd:%r, pid:%r' % (self.proxy.system.cwd(), self.proxy.system.pid())
+        return 'cwd:%r, pid:%r' % (self.rpc.system.cwd(), self.rpc.system.pid())
     
     def get_torrents(self):
         """
         Returns a set of info hashes currently added to the client.
         """
         logger.info('Getting a list of torrent hashes')
-        return set(x.lower() for x in self.proxy.download_list())
+        return set(x.lower() for x in self.rpc.download_list())
+    
+    def ping(self):
+        """
+        Makes a call that is cheap for the client, used to time how fast it answers.
+        """
+        return self.rpc.system.client_version()
+    
+    def get_checking_count(self):
+        """
+        Returns the number of torrents being hashed or waiting to be hashed,
+        i.e. the size of the hashing view, without listing the torrents.
+        """
+        return self.rpc.view.size('', 'hashing')
+    
+    def get_file_lists(self):
+        """
+        Returns the complete files of every torrent in the client as tuples
+        of the path of the torrent and a list of (path, size).
+        
+        The file lists are fetched with system.multicall in batches of FILE_LIST_BATCH_SIZE torrents.
+        """
+        logger.info('Getting the files of all torrents')
+        torrents = self.rpc.d.multicall2('', 'main', 'd.hash=', 'd.directory=', 'd.is_multi_file=')
+        for i in range(0, len(torrents), FILE_LIST_BATCH_SIZE):
+            batch = torrents[i:i + FILE_LIST_BATCH_SIZE]
+            results = self.rpc.system.multicall([{'methodName': 'f.multicall',
+                                                  'params': [infohash, '', 'f.path=', 'f.size_bytes=', 'f.completed_chunks=', 'f.size_chunks=']}
+                                                 for infohash, directory, is_multi_file in batch])
+            for (infohash, directory, is_multi_file), result in zip(batch, results):
+                if isinstance(result, dict):
+                    logger.warning('Unable to get the files of %s: %s' % (infohash, result.get('faultString')))
+                    continue
+                
+                result = result[0]
+                if is_multi_file or not result:
+                    root = directory
+                else:
+                    root = os.path.join(directory, result[0][0])
+                
+                yield root, [(os.path.join(directory, path), size) for path, size, completed_chunks, size_chunks in result
+                             if completed_chunks == size_chunks]
     
     def _get_mtime(self, path):
         return int(os.stat(path).st_mtime)
@@ -79,13 +125,10 @@ class RTorrentClient(object):
         if fast_resume:
             logger.info('Trying to do fast resume data')
             
-            psize = torrent[b'info'][b'piece length']
-            pieces = len(torrent[b'info'][b'pieces']) // 20
-            bitfield = [True] * pieces
+            availability = get_piece_map(torrent, files).availability()
             
             torrent[b'libtorrent_resume'] = {b'files': []}
             
-            current_position = 0
             for f in files:
                 logger.debug('Handling file %r' % f)
                 
@@ -93,24 +136,13 @@ class RTorrentClient(object):
                 if f['completed']:
                     result[b'mtime'] = self._get_mtime(os.path.join(destination_path, *f['path']))
                 torrent[b'libtorrent_resume'][b'files'].append(result)
-                
-                last_position = current_position + f['length']
-                
-                first_piece = current_position // psize
-                last_piece = (last_position+psize-1) // psize
-                
-                for piece in range(first_piece, last_piece):
-                    logger.debug('Setting piece %s to %s' % (piece, f['completed']))
-                    bitfield[piece] *= f['completed']
-                
-                current_position = last_position
             
-            if all(bitfield):
+            if availability.is_complete:
                 logger.info('This torrent is complete, setting bitfield to chunk count')
-                torrent[b'libtorrent_resume'][b'bitfield'] = pieces # rtorrent wants the number of pieces when torrent is complete
+                torrent[b'libtorrent_resume'][b'bitfield'] = availability.piece_map.piece_count # rtorrent wants the number of pieces when torrent is complete
             else:
                 logger.info('This torrent is incomplete, setting bitfield')
-                torrent[b'libtorrent_resume'][b'bitfield'] = bitfield_to_string(bitfield)
+                torrent[b'libtorrent_resume'][b'bitfield'] = availability.bitfield()
         
         torrent_file = os.path.join(destination_path, '__tmp_torrent%s.torrent' % uuid.uuid4())
         with open(torrent_file, 'wb') as f:
@@ -122,7 +154,7 @@ class RTorrentClient(object):
         cmd.append('d.set_custom1=%s' % quote(self.label))
         
         logger.info('Sending to rtorrent: %r' % cmd)
-        self.proxy.load_start(*cmd)
+        self.rpc.load_start(*cmd)
         os.remove(torrent_file)
         
         return infohash in self.get_torrents()
@@ -22,7 +22,11 @@ class DelugeRPCClient(object):
     def call(self, method, *args, **kwargs):
         if method == 'core.get_free_space':
             return 9001
+        elif method == 'daemon.info':
+            return b'2.0.3'
         elif method == 'core.get_torrents_status':
+            if args[0]:
+                return dict((k, v) for k, v in self.torrents.items() if v.get(b'state') == args[0]['state'].encode('utf-8'))
             return self.torrents
         elif method == 'core.add_torrent_file':
             if self.allow_add:
@@ -62,6 +66,14 @@ class TestDelugeClient(TestCase):
         self.client.rpcclient.allow_add = False
         self.assertFalse(self._add_torrent_with_links(['a', 'b', 'c']))
     
+    def test_rpc_stats(self):
+        self.assertTrue(self._add_torrent_with_links(['a', 'b', 'c']))
+        
+        stats = self.client.rpc_stats.methods['core.add_torrent_file']
+        self.assertEqual(stats.calls, 1)
+        self.assertTrue(stats.request_bytes > 0)
+        self.assertEqual(stats.response_bytes, 40)
+    
     def test_add_torrent_complete(self):
         self.assertTrue(self._add_torrent_with_links(['a', 'b', 'c']))
         torrent = self.client.rpcclient.torrents['2ce6b00e106f26a7c56dbd2c52290e4b6dea10c0']
@@ -69,4 +81,25 @@ class TestDelugeClient(TestCase):
                                    'mapped_files': {0: 'tmp/tmp/file_a.txt',
                                                     1: 'tmp/tmp/file_b.txt',
                                                     2: 'tmp/tmp/file_c.txt'}})
-    
\ No newline at end of file
+    
+    def test_get_file_lists(self):
+        self.client.rpcclient.torrents = {
+            b'a' * 40: {b'name': b'Some-Release', b'save_path': b'/downloads', b'file_progress': [1.0, 0.5], b'files': [
+                {b'path': b'Some-Release/some-rls.rar', b'size': 100},
+                {b'path': b'Some-Release/Sample/some-rls.mkv', b'size': 50},
+            ]},
+        }
+        
+        self.assertEqual(list(self.client.get_file_lists()), [
+            ('/downloads/Some-Release', [('/downloads/Some-Release/some-rls.rar', 100)]),
+        ])
+    
+    def test_ping(self):
+        self.assertEqual(self.client.ping(), b'2.0.3')
+    
+    def test_get_checking_count(self):
+        self.client.rpcclient.torrents = {
+            b'a' * 40: {b'state': b'Checking'},
+            b'b' * 40: {b'state': b'Seeding'},
+        }
+        self.assertEqual(self.client.get_checking_count(), 1)
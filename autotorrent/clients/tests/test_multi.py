@@ -0,0 +1,102 @@
+import hashlib
+import os
+
+from io import open
+
+from unittest import TestCase
+
+from ...bencode import bencode, bdecode
+
+from ..multi import MultiClient, UnknownRoutingPolicyException
+from ..rpcstats import RPCStats
+
+current_path = os.path.dirname(__file__)
+
+class DummyClient(object):
+    def __init__(self, torrents, latency=0.0):
+        self.torrents = set(torrents)
+        self.added = []
+        self.rpc_stats = RPCStats()
+        if latency:
+            self.rpc_stats.record('download_list', latency)
+    
+    def test_connection(self):
+        return 'ok'
+    
+    def get_torrents(self):
+        return set(self.torrents)
+    
+    def ping(self):
+        return 'pong'
+    
+    def get_checking_count(self):
+        return len(self.torrents) - 1
+    
+    def get_file_lists(self):
+        return iter([('/downloads/%s' % infohash, []) for infohash in sorted(self.torrents)])
+    
+    def add_torrent(self, torrent, destination_path, files, fast_resume=True):
+        self.added.append(destination_path)
+        self.torrents.add(hashlib.sha1(bencode(torrent[b'info'])).hexdigest())
+        return True
+
+class TestMultiClient(TestCase):
+    def setUp(self):
+        with open(os.path.join(current_path, 'test.torrent'), 'rb') as f:
+            self.torrent = bdecode(f.read())
+        self.infohash = hashlib.sha1(bencode(self.torrent[b'info'])).hexdigest()
+        
+        self.client1 = DummyClient(['a', 'b'], latency=0.01)
+        self.client2 = DummyClient(['c'], latency=0.5)
+        self.client = MultiClient([('client', self.client1), ('client2', self.client2)])
+    
+    def test_test_connection(self):
+        self.assertEqual(self.client.test_connection(), 'client: ok, client2: ok')
+    
+    def test_get_torrents(self):
+        self.assertEqual(self.client.get_torrents(), set(['a', 'b', 'c']))
+    
+    def test_get_checking_count(self):
+        self.client.get_torrents()
+        self.assertEqual(self.client.get_checking_count(), 0) # client2 gets the next torrent
+    
+    def test_route(self):
+        self.client.get_torrents()
+        self.assertEqual(self.client.route().name, 'client2')
+        
+        self.client.instances[1].torrents.update(['d', 'e'])
+        self.assertEqual(self.client.route().name, 'client2') # kept until the torrent is added
+        
+        self.client.add_torrent(self.torrent, '/tmp/1', [])
+        self.assertEqual(self.client2.added, ['/tmp/1'])
+        self.assertEqual(self.client.route().name, 'client')
+    
+    def test_get_file_lists(self):
+        self.assertEqual([root for root, files in self.client.get_file_lists()], ['/downloads/a', '/downloads/b', '/downloads/c'])
+    
+    def test_fewest_torrents(self):
+        self.client.get_torrents()
+        self.assertTrue(self.client.add_torrent(self.torrent, '/tmp/1', []))
+        self.assertEqual(self.client2.added, ['/tmp/1'])
+        
+        self.assertEqual(self.client.instances[1].torrents, set(['c', self.infohash]))
+        
+        self.assertTrue(self.client.add_torrent(self.torrent, '/tmp/2', []))
+        self.assertEqual(self.client1.added, ['/tmp/2'])
+    
+    def test_lowest_latency(self):
+        self.client = MultiClient([('client', self.client1), ('client2', self.client2)], 'lowest_latency')
+        self.client.get_torrents()
+        self.client.add_torrent(self.torrent, '/tmp/1', [])
+        self.assertEqual(self.client1.added, ['/tmp/1'])
+    
+    def test_custom_policy(self):
+        self.client = MultiClient([('client', self.client1), ('client2', self.client2)], lambda instances: instances[0])
+        self.client.add_torrent(self.torrent, '/tmp/1', [])
+        self.assertEqual(self.client1.added, ['/tmp/1'])
+    
+    def test_unknown_policy(self):
+        self.assertRaises(UnknownRoutingPolicyException, MultiClient, [('client', self.client1)], 'random')
+    
+    def test_rpc_stats(self):
+        self.assertEqual(sorted(self.client.rpc_stats.methods), ['client2:download_list', 'client:download_list'])
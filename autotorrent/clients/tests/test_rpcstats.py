@@ -0,0 +1,52 @@
+from io import StringIO
+
+from unittest import TestCase
+
+from ...metrics import Metrics
+from ..rpcstats import InstrumentedProxy, RPCStats, payload_size
+
+class MockProxy(object):
+    def __init__(self):
+        self.system = self
+    
+    def pid(self):
+        return 10000
+    
+    def fail(self):
+        raise IOError('Connection refused')
+
+class TestRPCStats(TestCase):
+    def setUp(self):
+        self.stats = RPCStats()
+        self.proxy = InstrumentedProxy(MockProxy(), self.stats)
+    
+    def test_payload_size(self):
+        self.assertEqual(payload_size([b'abc', u'de', {'f': 1}, None]), 1 + 3 + 2 + 8)
+    
+    def test_instrumented_proxy(self):
+        self.assertEqual(self.proxy.system.pid(), 10000)
+        self.assertEqual(self.proxy.system.pid(), 10000)
+        
+        stats = self.stats.methods['system.pid']
+        self.assertEqual(stats.calls, 2)
+        self.assertEqual(stats.errors, 0)
+        self.assertEqual(stats.response_bytes, 16)
+        self.assertEqual(stats.buckets[-1], 2)
+    
+    def test_instrumented_proxy_error(self):
+        self.assertRaises(IOError, self.proxy.fail)
+        self.assertEqual(self.stats.methods['fail'].errors, 1)
+    
+    def test_report_and_export(self):
+        self.proxy.system.pid()
+        
+        out = StringIO()
+        self.stats.report(out)
+        self.assertIn('system.pid', out.getvalue())
+        
+        metrics = Metrics()
+        self.stats.export(metrics)
+        text = metrics.render()
+        self.assertIn('# TYPE autotorrent_client_rpc_duration_seconds histogram\n', text)
+        self.assertIn('autotorrent_client_rpc_duration_seconds_bucket{le="+Inf",method="system.pid"} 1\n', text)
+        self.assertIn('autotorrent_client_rpc_duration_seconds_count{method="system.pid"} 1\n', text)
@@ -14,7 +14,11 @@ current_path = os.path.dirname(__file__)
 class MockXMLRPCProxy(object):
     def __init__(self):
         self.system = self
+        self.d = self
+        self.view = self
         self.torrents = {}
+        self.files = {}
+        self.hashing = []
         self.allow_add = True
     
     def listMethods(self):
@@ -26,6 +30,19 @@ class MockXMLRPCProxy(object):
     def pid(self):
         return 10000
     
+    def client_version(self):
+        return '0.9.8'
+    
+    def size(self, target, view):
+        assert view == 'hashing'
+        return len(self.hashing)
+    
+    def multicall2(self, target, view, *commands):
+        return [[infohash, directory, len(files) > 1] for infohash, (directory, files) in sorted(self.files.items())]
+    
+    def multicall(self, calls):
+        return [[self.files[call['params'][0]][1]] for call in calls]
+    
     def download_list(self):
         return self.torrents.keys()
     
@@ -67,6 +84,15 @@ class TestRTorrentClient(TestCase):
         self.client.proxy.allow_add = False
         self.assertFalse(self._add_torrent_with_links(['a', 'b', 'c']))
     
+    def test_rpc_stats(self):
+        self.assertTrue(self._add_torrent_with_links(['a', 'b', 'c']))
+        
+        methods = self.client.rpc_stats.methods
+        self.assertEqual(sorted(methods), ['download_list', 'load_start'])
+        self.assertEqual(methods['load_start'].calls, 1)
+        self.assertEqual(methods['load_start'].errors, 0)
+        self.assertTrue(methods['load_start'].request_bytes > 0)
+    
     def test_add_torrent_complete(self):
         self.assertTrue(self._add_torrent_with_links(['a', 'b', 'c']))
         torrent = self.client.proxy.torrents['2CE6B00E106F26A7C56DBD2C52290E4B6DEA10C0']
@@ -97,4 +123,21 @@ class TestRTorrentClient(TestCase):
         
         bitfield = resume_data[b'bitfield']
         self.assertEqual(bitfield, b'\x98') # bitfield: 10011 000
-    
\ No newline at end of file
+        
+    def test_get_file_lists(self):
+        self.client.proxy.files = {
+            'A' * 40: ('/downloads/Some-Release', [['some-rls.rar', 100, 1, 1], ['Sample/some-rls.mkv', 50, 0, 1]]),
+            'B' * 40: ('/downloads', [['some-movie.mkv', 200, 2, 2]]),
+        }
+        
+        self.assertEqual(list(self.client.get_file_lists()), [
+            ('/downloads/Some-Release', [('/downloads/Some-Release/some-rls.rar', 100)]),
+            ('/downloads/some-movie.mkv', [('/downloads/some-movie.mkv', 200)]),
+        ])
+    
+    def test_ping(self):
+        self.assertEqual(self.client.ping(), '0.9.8')
+    
+    def test_get_checking_count(self):
+        self.client.proxy.hashing = ['a' * 40, 'b' * 40]
+        self.assertEqual(self.client.get_checking_count(), 2)
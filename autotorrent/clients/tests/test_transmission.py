@@ -1,12 +1,15 @@
+import json
 import os
 
+import requests
+
 from io import open
 
 from unittest import TestCase
 
 from ...bencode import bdecode
 
-from ..transmission import TransmissionClient as RealTransmissionClient
+from ..transmission import TransmissionClient as RealTransmissionClient, RPCCallFailedException
 
 current_path = os.path.dirname(__file__)
 
@@ -23,6 +26,8 @@ class TransmissionClient(RealTransmissionClient):
                     'config-dir': '/home/autotorrent/.config/transmission-daemon',
                     'download-dir': '/home/autotorrent/Downloads',
                     'rpc-version': 15}
+        elif method == 'session-stats':
+            return {'activeTorrentCount': 1}
         elif method == 'torrent-add':
             self._torrent_id += 1
             self._torrents[self._torrent_id] = kwargs
@@ -30,6 +35,18 @@ class TransmissionClient(RealTransmissionClient):
         elif method == 'torrent-rename-path':
             self._torrents[kwargs['ids'][0]].update(kwargs)
             return {}
+        elif method == 'torrent-get' and kwargs['fields'] == ['status']:
+            return {'torrents': [{'status': 0}, {'status': 1}, {'status': 2}, {'status': 6}]}
+        elif method == 'torrent-get':
+            return {'torrents': [
+                {'downloadDir': '/downloads', 'name': 'Some-Release', 'files': [
+                    {'name': 'Some-Release/some-rls.rar', 'length': 100, 'bytesCompleted': 100},
+                    {'name': 'Some-Release/Sample/some-rls.mkv', 'length': 50, 'bytesCompleted': 10},
+                ]},
+                {'downloadDir': '/downloads', 'name': 'some-movie.mkv', 'files': [
+                    {'name': 'some-movie.mkv', 'length': 200, 'bytesCompleted': 200},
+                ]},
+            ]}
         elif method == 'torrent-start':
             self._torrents[kwargs['ids'][0]]['paused'] = False
             return {}
@@ -63,4 +80,57 @@ class TestTransmissionClient(TestCase):
         self.assertTrue(self._add_torrent_with_links(['a', 'b', 'c']))
         self.assertTrue((2 in self.client._torrents))
         self.assertEqual(self.client._torrents[2]['paused'], False)
-    
\ No newline at end of file
+    
+    def test_ping(self):
+        self.assertEqual(self.client.ping(), {'activeTorrentCount': 1})
+    
+    def test_get_checking_count(self):
+        self.assertEqual(self.client.get_checking_count(), 2)
+    
+    def test_get_file_lists(self):
+        self.assertEqual(list(self.client.get_file_lists()), [
+            ('/downloads/Some-Release', [('/downloads/Some-Release/some-rls.rar', 100)]),
+            ('/downloads/some-movie.mkv', [('/downloads/some-movie.mkv', 200)]),
+        ])
+    
+
+class MockResponse(object):
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content.encode('utf-8')
+        self.headers = headers or {}
+    
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+class TestTransmissionRPCStats(TestCase):
+    def setUp(self):
+        self.client = RealTransmissionClient('http://127.0.0.1:9091')
+        self.responses = []
+        self.posts = []
+        
+        def post(url, data, headers):
+            self.posts.append(data)
+            return self.responses.pop(0)
+        
+        self._original_post = requests.post
+        requests.post = post
+    
+    def tearDown(self):
+        requests.post = self._original_post
+    
+    def test_rpc_stats(self):
+        self.responses.append(MockResponse(409, '', {'X-Transmission-Session-Id': 'abc'}))
+        self.responses.append(MockResponse(200, '{"result": "success", "arguments": {"torrents": []}}'))
+        self.assertEqual(self.client.get_torrents(), set())
+        
+        stats = self.client.rpc_stats.methods['torrent-get']
+        self.assertEqual(stats.calls, 2)
+        self.assertEqual(stats.errors, 0)
+        self.assertEqual(stats.request_bytes, sum(len(data) for data in self.posts))
+        self.assertEqual(stats.response_bytes, 52)
+    
+    def test_rpc_stats_failed(self):
+        self.responses.append(MockResponse(200, '{"result": "error", "arguments": {}}'))
+        self.assertRaises(RPCCallFailedException, self.client.get_torrents)
+        self.assertEqual(self.client.rpc_stats.methods['torrent-get'].errors, 1)
@@ -8,9 +8,13 @@ import os
 import requests
 
 from ..bencode import bencode
+from .rpcstats import RPCStats
 
 logger = logging.getLogger(__name__)
 
+TR_STATUS_CHECK_WAIT = 1
+TR_STATUS_CHECK = 2
+
 class UnableToLoginException(Exception):
     pass
 
@@ -29,13 +33,18 @@ class TransmissionClient(object):
         url - The url where transmission rpc can be reached.
         """
         self.url = url
+        self.rpc_stats = RPCStats()
     
     def _call(self, method, **kwargs):
         """
         Actual calls Transmission JSON RPC.
         """
         logger.debug('Calling %r args %r' % (method, kwargs))
-        return requests.post(self.url, data=json.dumps({'method': method, 'arguments': kwargs}), headers={'X-Transmission-Session-Id': self._session_id})
+        data = json.dumps({'method': method, 'arguments': kwargs})
+        with self.rpc_stats.call(method, data) as call:
+            r = requests.post(self.url, data=data, headers={'X-Transmission-Session-Id': self._session_id})
+            call.response_bytes = len(r.content)
+        return r
     
     def call(self, method, **kwargs):
         """
@@ -47,11 +56,13 @@ class TransmissionClient(object):
             r = self._call(method, **kwargs)
         
         if r.status_code != 200:
+            self.rpc_stats.record_error(method)
             raise UnableToLoginException()
         
         r = r.json()
         logger.debug('Got transmission reply %r' % r)
         if r['result'] != 'success':
+            self.rpc_stats.record_error(method)
             raise RPCCallFailedException()
         
         return r['arguments']
@@ -74,6 +85,32 @@ class TransmissionClient(object):
         result = self.call('torrent-get', fields=['hashString'])
         return set(x['hashString'].lower() for x in result['torrents'])
     
+    def ping(self):
+        """
+        Makes a call that is cheap for the client, used to time how fast it answers.
+        """
+        return self.call('session-stats')
+    
+    def get_checking_count(self):
+        """
+        Returns the number of torrents being verified or waiting to be verified.
+        Transmission cannot filter by status, so the status of every torrent is fetched.
+        """
+        result = self.call('torrent-get', fields=['status'])
+        return sum(1 for x in result['torrents'] if x['status'] in (TR_STATUS_CHECK_WAIT, TR_STATUS_CHECK))
+    
+    def get_file_lists(self):
+        """
+        Returns the complete files of every torrent in the client as tuples
+        of the path of the torrent and a list of (path, size).
+        """
+        logger.info('Getting the files of all torrents')
+        result = self.call('torrent-get', fields=['downloadDir', 'name', 'files'])
+        for torrent in result['torrents']:
+            yield (os.path.join(torrent['downloadDir'], torrent['name']),
+                   [(os.path.join(torrent['downloadDir'], f['name']), f['length']) for f in torrent['files']
+                    if f['bytesCompleted'] == f['length']])
+    
     def add_torrent(self, torrent, destination_path, files, fast_resume=True):
         """
         Add a new torrent to Transmission.
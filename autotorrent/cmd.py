@@ -1,11 +1,55 @@
 import argparse
 import logging
 import os
+import sys
+
+from multiprocessing.pool import ThreadPool
 
 from six.moves import configparser
 
 from autotorrent.at import AutoTorrent
-from autotorrent.db import Database
+from autotorrent.db import Database, CorruptDatabaseException, OutdatedDatabaseException
+from autotorrent.metrics import Metrics
+from autotorrent.profiler import Profiler
+from autotorrent.progress import RebuildProgress
+from autotorrent.scheduler import AddScheduler, DEFAULT_MAX_WAIT
+from autotorrent.throttle import set_idle_io_priority
+from autotorrent.utils import find_torrent_files
+
+class UnknownClientException(Exception):
+    pass
+
+def create_client(config, section):
+    """
+    Creates the client configured in a client section, e.g. client or client2.
+    """
+    client_name = config.get(section, 'client')
+    if client_name == 'rtorrent':
+        from autotorrent.clients.rtorrent import RTorrentClient
+        return RTorrentClient(config.get(section, 'url'),
+                              config.get(section, 'label'))
+    elif client_name == 'deluge':
+        from autotorrent.clients.deluge import DelugeClient
+        host, port = config.get(section, 'host').split(':')
+        return DelugeClient(host, int(port),
+                            config.get(section, 'username'),
+                            config.get(section, 'password'))
+    elif client_name == 'transmission':
+        from autotorrent.clients.transmission import TransmissionClient
+        return TransmissionClient(config.get(section, 'url'))
+    else:
+        raise UnknownClientException('Unknown client %r in %s' % (client_name, section))
+
+def create_clients(config, sections):
+    """
+    Creates the clients configured in sections in parallel, returns them in the order of sections.
+    """
+    pool = ThreadPool(len(sections))
+    try:
+        return pool.map(lambda section: create_client(config, section), sections)
+    finally:
+        pool.close()
+        pool.join()
 
 def commandline_handler():
     parser = argparse.ArgumentParser()
@@ -13,9 +57,17 @@ def commandline_handler():
     
     parser.add_argument("-t", "--test_connection", action="store_true", dest="test_connection", default=False, help='Tests the connection to the torrent client')
     parser.add_argument("-r", "--rebuild", action="store_true", dest="rebuild", default=False, help='Rebuild the database')
-    parser.add_argument("-a", "--addfile", dest="addfile", default=False, help='Add a new torrent file to client', nargs='+')
+    parser.add_argument("--rebuild-disk", action="append", dest="rebuild_disks", default=[], help='Rebuild the database of a single disk, e.g. disk2, can be given more than once')
+    parser.add_argument("--rebuild-fresh", action="store_true", dest="rebuild_fresh", default=False, help='Start the rebuild over instead of continuing a stopped rebuild')
+    parser.add_argument("--index-client", action="store_true", dest="index_client", default=False, help='Add the files of the torrents seeded by the client to the database without scanning the disks')
+    parser.add_argument("--export-index", dest="export_index", default=None, help='Export the database to a compressed snapshot that can be imported on another machine')
+    parser.add_argument("--rewrite-prefix", action="append", dest="rewrite_prefixes", default=[], metavar='OLD=NEW', help='Rewrite paths starting with OLD to NEW when exporting, can be given more than once')
+    parser.add_argument("--import-index", dest="import_index", default=[], nargs='+', help='Merge snapshots made with --export-index into the database')
+    parser.add_argument("-a", "--addfile", dest="addfile", default=False, help='Add new torrent files to client, folders are searched for torrent files', nargs='+')
     parser.add_argument("-d", "--delete_torrents", action="store_true", dest="delete_torrents", default=False, help='Delete torrents when they are added to the client')
     parser.add_argument("--verbose", help="increase output verbosity", action="store_true", dest="verbose")
+    parser.add_argument("--profile", action="store_true", dest="profile", default=False, help='Print the time spent in each phase of rebuilding and adding torrents')
+    parser.add_argument("--profile-stats", dest="profile_stats", default=None, help='Dump cProfile stats to this file, implies --profile')
     
     args = parser.parse_args()
     
@@ -36,13 +88,26 @@ def commandline_handler():
 
     i = 1
     disks = []
+    disk_names = {}
     while config.has_option('disks', 'disk%s' % i):
         disks.append(config.get('disks', 'disk%s' % i))
+        disk_names['disk%s' % i] = disks[-1]
         i += 1
     
+    prefixes = []
+    for rewrite_prefix in args.rewrite_prefixes:
+        if '=' not in rewrite_prefix:
+            parser.error('Invalid prefix rewrite %r, it must be OLD=NEW' % rewrite_prefix)
+        prefixes.append(tuple(rewrite_prefix.split('=', 1)))
+    
+    for disk_name in args.rebuild_disks:
+        if disk_name not in disk_names:
+            parser.error('Unknown disk %r, the disks are named disk1, disk2 etc.' % disk_name)
+    
     normal_mode = False
     unsplitable_mode = False
     exact_mode = False
+    size_mode = False
     scan_mode = set(config.get('general', 'scan_mode').split(','))
     
     if 'exact' in scan_mode:
@@ -54,28 +119,82 @@ def commandline_handler():
     if 'normal' in scan_mode:
         normal_mode = True
     
+    if 'size' in scan_mode:
+        size_mode = True
+    
+    db_kwargs = {
+        'exclude_paths': [config.get('general', 'store_path')],
+    }
+    if args.profile or args.profile_stats:
+        profiler = Profiler(args.profile_stats and os.path.join(current_path, args.profile_stats))
+        db_kwargs['profiler'] = profiler
+    else:
+        profiler = None
+    
+    if config.has_option('general', 'metrics_path'):
+        metrics_path = config.get('general', 'metrics_path')
+        metrics_name = os.path.splitext(os.path.basename(args.config_file))[0]
+        rebuild_metrics = Metrics(config=metrics_name)
+        add_metrics = Metrics(config=metrics_name)
+        db_kwargs['metrics'] = rebuild_metrics
+    else:
+        metrics_path = None
+        add_metrics = None
+    
+    if config.has_option('general', 'size_mode_min_size'):
+        db_kwargs['size_mode_min_size'] = config.getint('general', 'size_mode_min_size')
+    
+    if 'fuzzy' in scan_mode:
+        db_kwargs['fuzzy_mode'] = True
+    
+    if config.has_option('general', 'fuzzy_mode_min_size'):
+        db_kwargs['fuzzy_mode_min_size'] = config.getint('general', 'fuzzy_mode_min_size')
+    
+    if config.has_option('general', 'ignore_directories'):
+        db_kwargs['ignore_directories'] = config.get('general', 'ignore_directories').split(',')
+    
+    if config.has_option('general', 'skip_symlinks'):
+        db_kwargs['skip_symlinks'] = config.getboolean('general', 'skip_symlinks')
+    
+    if config.has_option('general', 'rebuild_ops_per_second'):
+        db_kwargs['ops_per_second'] = config.getfloat('general', 'rebuild_ops_per_second')
+    
+    if config.has_option('general', 'rebuild_max_latency'):
+        db_kwargs['max_stat_latency'] = config.getfloat('general', 'rebuild_max_latency') / 1000
+    
     db = Database(config.get('general', 'db'), disks,
                   config.get('general', 'ignore_files').split(','),
-                  normal_mode, unsplitable_mode, exact_mode)
+                  normal_mode, unsplitable_mode, exact_mode, size_mode,
+                  **db_kwargs)
     
-    client_name = config.get('client', 'client')
-    if client_name == 'rtorrent':
-        from autotorrent.clients.rtorrent import RTorrentClient
-        client = RTorrentClient(config.get('client', 'url'),
-                                config.get('client', 'label'))
-    elif client_name == 'deluge':
-        from autotorrent.clients.deluge import DelugeClient
-        host, port = config.get('client', 'host').split(':')
-        client = DelugeClient(host, int(port),
-                              config.get('client', 'username'),
-                              config.get('client', 'password'))
-    elif client_name == 'transmission':
-        from autotorrent.clients.transmission import TransmissionClient
-        client = TransmissionClient(config.get('client', 'url'))
-    else:
-        print('Unknown client %r' % client_name)
+    client_sections = ['client']
+    i = 2
+    while config.has_section('client%s' % i):
+        client_sections.append('client%s' % i)
+        i += 1
+    
+    try:
+        if len(client_sections) > 1:
+            from autotorrent.clients.multi import MultiClient, UnknownRoutingPolicyException
+            try:
+                client = MultiClient(list(zip(client_sections, create_clients(config, client_sections))),
+                                     (config.get('general', 'client_routing') if config.has_option('general', 'client_routing') else 'fewest_torrents'))
+            except UnknownRoutingPolicyException as e:
+                parser.error(str(e))
+        else:
+            client = create_client(config, 'client')
+    except UnknownClientException as e:
+        print(str(e))
         quit(1)
     
+    add_max_checking = (config.getint('general', 'add_max_checking') if config.has_option('general', 'add_max_checking') else 0)
+    add_max_latency = (config.getfloat('general', 'add_max_latency') / 1000 if config.has_option('general', 'add_max_latency') else 0)
+    if add_max_checking or add_max_latency:
+        add_scheduler = AddScheduler(client, add_max_checking, add_max_latency,
+                                     (config.getfloat('general', 'add_max_wait') if config.has_option('general', 'add_max_wait') else DEFAULT_MAX_WAIT))
+    else:
+        add_scheduler = None
+    
     at = AutoTorrent(
         db,
         client,
@@ -84,6 +203,12 @@ def commandline_handler():
         config.getfloat('general', 'add_limit_percent'),
         args.delete_torrents,
         (config.get('general', 'link_type') if config.has_option('general', 'link_type') else 'soft'),
+        (config.getint('general', 'verify_pieces') if config.has_option('general', 'verify_pieces') else 0),
+        (config.getint('general', 'verify_processes') if config.has_option('general', 'verify_processes') else 1),
+        (config.getint('general', 'link_workers') if config.has_option('general', 'link_workers') else 1),
+        profiler=profiler,
+        metrics=add_metrics,
+        add_scheduler=add_scheduler,
     )
     
     if args.test_connection:
@@ -92,16 +217,83 @@ def commandline_handler():
             print('Connected to torrent client successfully!')
             print('  result: %s' % proxy_test_result)
     
-    if args.rebuild:
+    if profiler:
+        profiler.start()
+    
+    if args.rebuild or args.rebuild_disks:
         print('Rebuilding database')
-        db.rebuild()
+        if config.has_option('general', 'rebuild_idle_priority') and config.getboolean('general', 'rebuild_idle_priority'):
+            print('Scanning with %s' % set_idle_io_priority())
+        try:
+            if args.rebuild:
+                db.rebuild(RebuildProgress(sys.stdout), resume=not args.rebuild_fresh)
+            else:
+                db.rebuild(RebuildProgress(sys.stdout), resume=not args.rebuild_fresh,
+                           disks=[disk_names[disk_name] for disk_name in args.rebuild_disks])
+        except OutdatedDatabaseException as e:
+            print(e)
+            print('Rebuild the database with: autotorrent -r')
+            quit(1)
+        except CorruptDatabaseException as e:
+            print(e)
+            print('Start the rebuild over with: autotorrent -r --rebuild-fresh')
+            quit(1)
         print('Database rebuilt')
+        
+        if metrics_path:
+            rebuild_metrics.write(os.path.join(metrics_path, '%s-rebuild.prom' % metrics_name))
 
+    if args.index_client:
+        print('Indexing the files in the client')
+        try:
+            torrent_count, file_count = db.index_client(client)
+        except OutdatedDatabaseException as e:
+            print(e)
+            print('Rebuild the database with: autotorrent -r')
+            quit(1)
+        print('Indexed %s files in %s torrents' % (file_count, torrent_count))
+        
+        if metrics_path:
+            rebuild_metrics.write(os.path.join(metrics_path, '%s-rebuild.prom' % metrics_name))
+    
+    if args.export_index or args.import_index:
+        try:
+            if args.export_index:
+                db.export_index(os.path.join(current_path, args.export_index), prefixes)
+                print('Exported database to %s' % args.export_index)
+            
+            for snapshot in args.import_index:
+                db.import_index(os.path.join(current_path, snapshot))
+                print('Imported %s' % snapshot)
+        except OutdatedDatabaseException as e:
+            print(e)
+            print('Rebuild the database with: autotorrent -r')
+            quit(1)
+    
     if args.addfile:
-        print('Found %s torrent(s)' % len(args.addfile))
+        try:
+            db.check_version()
+        except OutdatedDatabaseException as e:
+            print(e)
+            print('Rebuild the database with: autotorrent -r')
+            quit(1)
+        
         at.populate_torrents_seeded()
-        for torrent in args.addfile:
-            at.handle_torrentfile(os.path.join(current_path, torrent))
+        count = 0
+        for torrent, status in at.handle_torrentfiles(find_torrent_files(os.path.join(current_path, path) for path in args.addfile)):
+            count += 1
+        print('Handled %s torrent file(s)' % count)
+        
+        if metrics_path:
+            client.rpc_stats.export(add_metrics)
+            add_metrics.write(os.path.join(metrics_path, '%s-add.prom' % metrics_name))
+    
+    if profiler:
+        profiler.stop()
+        profiler.report()
+        client.rpc_stats.report()
+    
+    db.close()
 
 if __name__ == '__main__':
     commandline_handler()
\ No newline at end of file
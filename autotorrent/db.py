@@ -1,47 +1,489 @@
-from __future__ import unicode_literals
+from __future__ import division, unicode_literals
 
+import gzip
 import hashlib
 import logging
 import os
+import re
 import shelve
+import tempfile
+import time
 
-from fnmatch import fnmatch
+from collections import OrderedDict
 
-from .utils import is_unsplitable, get_root_of_unsplitable
+import six
+
+from six.moves import cPickle as pickle
+
+if six.PY3:
+    import dbm
+
+from .metrics import NullMetrics
+from .profiler import NullProfiler
+from .progress import RebuildProgress
+from .throttle import IOThrottle, NullThrottle
+from .utils import is_unsplitable, is_unsplitable_subfolder, get_root_of_unsplitable, compile_patterns
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_SIZE_MODE_MIN_SIZE = 100 * 1024 * 1024
+DEFAULT_FUZZY_MODE_MIN_SIZE = 1024 * 1024
+
+FUZZY_MIN_SIMILARITY = 0.5
+TOKEN_SEPARATOR_RE = re.compile(r'[\W_]+', re.UNICODE)
+
+SCHEMA_VERSION = 4
+
+META_VERSION_KEY = 'meta|version'
+META_REBUILD_KEY = 'meta|rebuild'
+META_COUNTS_KEY = 'meta|counts'
+META_DEVICE_KEY = 'meta|device'
+META_IMPORTED_KEY = 'meta|imported'
+META_DIRECTORIES_KEY = 'meta|directories'
+DIRECTORY_KEY = 'dir|%s'
+
+CLIENT_SHARD = 'client'
+
+SNAPSHOT_FORMAT = 1
+
+CHECKPOINT_INTERVAL = 60
+
+# Digest keys start with a NUL byte, the dir| and meta| keys never do, so the two cannot collide
+HASH_KEY_PREFIX = b'\x00'
+
+if hasattr(hashlib, 'blake2s'): # blake2s is the fastest for short keys
+    def hash_key(data):
+        return (HASH_KEY_PREFIX + hashlib.blake2s(data, digest_size=16).digest()).decode('latin-1')
+elif six.PY3:
+    def hash_key(data):
+        return (HASH_KEY_PREFIX + hashlib.sha256(data).digest()[:16]).decode('latin-1')
+else:
+    def hash_key(data):
+        return HASH_KEY_PREFIX + hashlib.sha256(data).digest()[:16]
+
+class OutdatedDatabaseException(Exception):
+    pass
+
+class CorruptDatabaseException(Exception):
+    pass
+
+def rewrite_prefix(path, prefixes):
+    """
+    Replaces the first matching prefix of path, prefixes is a list of (old, new) pairs.
+    Prefixes only match whole folder names.
+    """
+    for old, new in prefixes:
+        old = old.rstrip(os.sep)
+        if path == old or path.startswith(old + os.sep):
+            return new.rstrip(os.sep) + path[len(old):]
+    return path
+
+def count_finished(finished):
+    """
+    Returns the number of folders and files in the finished subfolders of a rebuild checkpoint.
+    """
+    folders, files = 0, 0
+    for value in finished.values():
+        if isinstance(value, dict):
+            value_folders, value_files = count_finished(value)
+            folders += value_folders
+            files += value_files
+        else:
+            folders += value[2]
+            files += value[1]
+    return folders, files
+
+def open_shelf(db_file, flag='c'):
+    """
+    Opens a shelf, on Python 3 the keys are encoded as latin-1 so binary keys survive.
+    
+    The dbm backend is the best one installed. dbm.dumb, used when there is no other,
+    pads every value to 512 bytes so smaller values do not make the files smaller.
+    """
+    if six.PY3:
+        return shelve.Shelf(dbm.open(db_file, flag), keyencoding='latin-1')
+    return shelve.open(db_file, flag=flag)
+
+if six.PY3:
+    class SnapshotUnpickler(pickle.Unpickler):
+        """
+        Unpickles snapshots, only plain data is allowed so a snapshot cannot run code.
+        """
+        def find_class(self, module, name):
+            raise pickle.UnpicklingError('Snapshot refers to %s.%s, only plain data is allowed' % (module, name))
+else:
+    def SnapshotUnpickler(f):
+        unpickler = pickle.Unpickler(f)
+        unpickler.find_global = None # refuses classes and functions
+        return unpickler
+
+class DatabaseShard(object):
+    """
+    The files found on a single disk, stored in their own shelf.
+    """
+    def __init__(self, db, path=None, db_file=None):
+        self.db = db
+        self.path = path
+        self.db_file = db_file
+        self.reset_directories()
+    
+    def truncate(self):
+        """
+        Truncates the shard
+        """
+        logger.info('Truncated the shard of %s' % self.path)
+        if self.db_file is None:
+            self.db.clear()
+        else:
+            self.db.close()
+            self.db = open_shelf(self.db_file, flag='n')
+        self.db[META_VERSION_KEY] = SCHEMA_VERSION
+        self.reset_directories()
+    
+    def is_outdated(self):
+        version = self.db.get(META_VERSION_KEY)
+        if version is None:
+            return len(self.db) > 0
+        return version != SCHEMA_VERSION
+    
+    def is_online(self):
+        """
+        Checks if the disk is still the one that was scanned, i.e. it is mounted.
+        """
+        device = self.db.get(META_DEVICE_KEY)
+        if device is None or self.path is None:
+            return True
+        
+        try:
+            return os.stat(self.path).st_dev == device
+        except OSError:
+            return False
+    
+    def set_device(self):
+        self.db[META_DEVICE_KEY] = os.stat(self.path).st_dev
+    
+    def sync(self):
+        if self.db_file is not None:
+            self.db.sync()
+    
+    def close(self):
+        if self.db_file is not None:
+            self.db.close()
+    
+    def reset_directories(self):
+        """
+        Clears the cached directory table.
+        """
+        self._directory_ids = {}
+        self._directory_paths = {}
+    
+    def load_directories(self):
+        """
+        Loads the whole directory table, needed before adding to an existing database.
+        The ids are given out in order and the number of ids is stored with the table.
+        """
+        self.reset_directories()
+        for directory_id in range(self.db.get(META_DIRECTORIES_KEY, 0)):
+            path = self.db.get(DIRECTORY_KEY % directory_id)
+            if path is None:
+                raise CorruptDatabaseException('Directory %i is missing from the shard of %s' % (directory_id, self.path))
+            self._directory_paths[directory_id] = path
+            self._directory_ids[path] = directory_id
+    
+    def get_directory_id(self, root):
+        """
+        Returns the id of a directory in the directory table, adding it if it is not there.
+        """
+        directory_id = self._directory_ids.get(root)
+        if directory_id is None:
+            directory_id = self._directory_ids[root] = len(self._directory_paths)
+            self._directory_paths[directory_id] = root
+            self.db[DIRECTORY_KEY % directory_id] = root
+            self.db[META_DIRECTORIES_KEY] = directory_id + 1
+        return directory_id
+    
+    def get_directory_path(self, directory_id):
+        path = self._directory_paths.get(directory_id)
+        if path is None:
+            path = self._directory_paths[directory_id] = self.db[DIRECTORY_KEY % directory_id]
+        return path
+    
+    def encode_path(self, root, f):
+        """
+        Turns a path into the (directory id, basename) stored in the database.
+        """
+        return self.get_directory_id(root), f
+    
+    def decode_path(self, entry):
+        """
+        Turns a stored (directory id, basename) back into a path.
+        """
+        if entry is None:
+            return None
+        return os.path.join(self.get_directory_path(entry[0]), entry[1])
+    
 class Database(object):
-    def __init__(self, db_file, paths, ignore_files, normal_mode, unsplitable_mode, exact_mode):
-        self.db = shelve.open(db_file)
+    def __init__(self, db_file, paths, ignore_files, normal_mode, unsplitable_mode, exact_mode,
+                 size_mode=False, size_mode_min_size=DEFAULT_SIZE_MODE_MIN_SIZE,
+                 ignore_directories=(), exclude_paths=(), skip_symlinks=False, profiler=None, metrics=None,
+                 ops_per_second=0, max_stat_latency=0, fuzzy_mode=False, fuzzy_mode_min_size=DEFAULT_FUZZY_MODE_MIN_SIZE):
+        self.db = open_shelf(db_file)
         self.db_file = db_file
         self.paths = paths
-        self.ignore_files = [self.normalize_filename(x) for x in ignore_files]
+        self.shards = OrderedDict((path, self.open_shard(path)) for path in paths)
+        for path in self.db.get(META_IMPORTED_KEY, []):
+            if path not in self.shards:
+                self.shards[path] = self.open_shard(path)
+        self.shard = None
+        self._online_shards = None
+        self.ignore_files = ignore_files
+        self.ignore_directories = ignore_directories
+        self.exclude_paths = exclude_paths
+        self.skip_symlinks = skip_symlinks
         self.normal_mode = normal_mode
         self.unsplitable_mode = unsplitable_mode
         self.exact_mode = exact_mode
+        self.size_mode = size_mode
+        self.size_mode_min_size = size_mode_min_size
+        self.fuzzy_mode = fuzzy_mode
+        self.fuzzy_mode_min_size = fuzzy_mode_min_size
+        self.profiler = profiler or NullProfiler()
+        self.metrics = metrics or NullMetrics()
+        self.progress = RebuildProgress()
+        self.ops_per_second = ops_per_second
+        self.max_stat_latency = max_stat_latency
+        self.throttle = NullThrottle()
+    
+    @property
+    def ignore_files(self):
+        return self._ignore_files
+    
+    @ignore_files.setter
+    def ignore_files(self, ignore_files):
+        self._ignore_files = [self.normalize_filename(x) for x in ignore_files]
+        self._ignore_files_re = compile_patterns(self._ignore_files)
+    
+    @property
+    def ignore_directories(self):
+        return self._ignore_directories
+    
+    @ignore_directories.setter
+    def ignore_directories(self, ignore_directories):
+        self._ignore_directories = [self.normalize_filename(x) for x in ignore_directories]
+        self._ignore_directories_re = compile_patterns(self._ignore_directories)
+    
+    @property
+    def exclude_paths(self):
+        return self._exclude_paths
+    
+    @exclude_paths.setter
+    def exclude_paths(self, exclude_paths):
+        self._exclude_paths = set(os.path.abspath(x) for x in exclude_paths)
+    
+    def get_shard_file(self, path):
+        """
+        Returns the file of the shard for a disk, named from a hash of the disk path.
+        """
+        if path == CLIENT_SHARD:
+            return '%s.%s' % (self.db_file, CLIENT_SHARD)
+        return '%s.%s' % (self.db_file, hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16])
+    
+    def open_shard(self, path):
+        shard_file = self.get_shard_file(path)
+        return DatabaseShard(open_shelf(shard_file), path, shard_file)
+    
+    def close(self):
+        self.db.close()
+        for shard in self.shards.values():
+            shard.close()
+    
+    def is_outdated(self):
+        """
+        Checks if the database was built with another schema and must be rebuilt.
+        An empty database is not outdated.
+        """
+        version = self.db.get(META_VERSION_KEY)
+        if version is None:
+            outdated = len(self.db) > 0
+        else:
+            outdated = version != SCHEMA_VERSION
+        return outdated or any(shard.is_outdated() for shard in self.shards.values())
+    
+    def check_version(self):
+        """
+        Raises OutdatedDatabaseException if the database must be rebuilt before it is used.
+        """
+        if self.is_outdated():
+            raise OutdatedDatabaseException('The database %r was built by another version of AutoTorrent (schema version %s, expected %s)' % (
+                self.db_file, self.db.get(META_VERSION_KEY, 1), SCHEMA_VERSION))
     
     def truncate(self):
         """
-        Truncates the database
+        Truncates the database, imported disks are kept as they cannot be rescanned.
         """
         logger.info('Truncated the database')
+        imported = self.db.get(META_IMPORTED_KEY)
         self.db.close()
-        self.db = shelve.open(self.db_file, flag='n')
+        self.db = open_shelf(self.db_file, flag='n')
+        self.db[META_VERSION_KEY] = SCHEMA_VERSION
+        if imported:
+            self.db[META_IMPORTED_KEY] = imported
+        for path in self.paths:
+            self.shards[path].truncate()
+    
+    def get_online_shards(self):
+        """
+        Returns the shards of the disks that are online in the order of the disks.
+        """
+        if self._online_shards is None:
+            self._online_shards = []
+            for shard in self.shards.values():
+                if shard.is_online():
+                    self._online_shards.append(shard)
+                else:
+                    logger.warning('Disk %s is offline, skipping it' % shard.path)
+        return self._online_shards
+    
+    def get(self, key):
+        """
+        Looks up a key in the shards, the first disk with the key wins.
+        """
+        for shard in self.get_online_shards():
+            value = shard.db.get(key)
+            if value is not None:
+                return shard.decode_path(value)
+        return None
+    
+    def export_index(self, path, prefixes=()):
+        """
+        Writes the shards of the disks to a compressed snapshot that can be imported
+        by another instance with import_index.
+        
+        The paths are rewritten with prefixes, a list of (old, new) pairs, e.g. to
+        where the disks are mounted on the importing machine.
+        """
+        self.check_version()
+        
+        dirname = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % os.path.basename(path), dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as raw_f:
+                with gzip.GzipFile(fileobj=raw_f, mode='wb') as f:
+                    pickle.dump({
+                        'format': SNAPSHOT_FORMAT,
+                        'version': SCHEMA_VERSION,
+                        'disks': [rewrite_prefix(os.path.abspath(p), prefixes) for p in self.paths],
+                    }, f, 2)
+                    for disk_path in self.paths:
+                        shard = self.shards[disk_path]
+                        for key in shard.db.keys():
+                            if key == META_DEVICE_KEY: # the device is different on the importing machine
+                                continue
+                            value = shard.db[key]
+                            if key.startswith(DIRECTORY_KEY % ''):
+                                value = rewrite_prefix(value, prefixes)
+                            pickle.dump((key, value), f, 2)
+                        pickle.dump(None, f, 2) # end of disk
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        
+        logger.info('Exported the index of %i disks to %r' % (len(self.paths), path))
+    
+    def import_index(self, path):
+        """
+        Merges a snapshot made with export_index into the database.
+        Every disk in the snapshot replaces the shard of the disk with the same path.
+        
+        Only plain data is read from the snapshot, anything else raises pickle.UnpicklingError.
+        """
+        self.check_version()
+        
+        with gzip.open(path, 'rb') as f:
+            unpickler = SnapshotUnpickler(f)
+            header = unpickler.load()
+            if header.get('format') != SNAPSHOT_FORMAT or header.get('version') != SCHEMA_VERSION:
+                raise OutdatedDatabaseException('The snapshot %r was exported by another version of AutoTorrent (schema version %s, expected %s)' % (
+                    path, header.get('version'), SCHEMA_VERSION))
+            
+            imported = self.db.get(META_IMPORTED_KEY, [])
+            local_paths = dict((os.path.abspath(p), p) for p in self.paths)
+            for disk_path in header['disks']:
+                disk_path = local_paths.get(disk_path, disk_path)
+                shard = self.shards.get(disk_path)
+                if shard is None:
+                    shard = self.shards[disk_path] = self.open_shard(disk_path)
+                shard.truncate()
+                
+                while True:
+                    item = unpickler.load()
+                    if item is None:
+                        break
+                    key, value = item
+                    shard.db[key] = value
+                shard.sync()
+                
+                if disk_path not in self.paths and disk_path not in imported:
+                    imported.append(disk_path)
+                logger.info('Imported the index of %s' % disk_path)
+            
+            self.db[META_VERSION_KEY] = SCHEMA_VERSION
+            self.db[META_IMPORTED_KEY] = imported
+            self.db.sync()
+            self._online_shards = None
     
-    def insert_into_database(self, root, f, mode, prefix=None, unsplitable_name=None):
+    def insert_into_database(self, root, f, mode, prefix=None, unsplitable_name=None, size=None, count=1, mtime=None):
         """
         Does the actual insertion into the database.
+        
+        Exact entries are stored as (path, size, file count, mtime) so candidates
+        can be rejected without touching the disk. A folder with symlinked folders
+        in it is stored with size None as the size of its content is unknown.
+        
+        Inserting the same file again replaces it, so a resumed rebuild can rescan folders.
+        
+        Paths are stored as (directory id, basename), see DatabaseShard.encode_path.
+        The file is inserted into the shard of the disk being scanned.
         """
-        path = os.path.abspath(os.path.join(root, f))
-        if mode == 'exact':
+        shard = self.shard
+        db = shard.db
+        path = shard.encode_path(root, f)
+        if mode in ('size', 'fuzzy'):
+            if mode == 'size':
+                keys = [self.keyify('size', '%s' % size)]
+            else:
+                keys = [self.keyify('fuzzy', '%s' % size, token) for token in self.tokenize_filename(f)]
+            
+            for key in keys:
+                if key in db:
+                    paths = db[key]
+                    if path not in paths:
+                        db[key] = paths + [path]
+                else:
+                    db[key] = [path]
+        elif mode == 'exact':
             key = self.keyify(prefix, f)
-            if key in self.db:
-                self.db[key] = self.db[key] + [path]
+            if mtime is None or (size is None and prefix == 'f'):
+                stat = os.stat(os.path.join(root, f))
+                if size is None and prefix == 'f':
+                    size = stat.st_size
+                mtime = stat.st_mtime
+            entry = path + (size, count, int(mtime))
+            
+            if key in db:
+                db[key] = [e for e in db[key] if e[:2] != path] + [entry]
             else:
-                self.db[key] = [path]
+                db[key] = [entry]
         else:
-            size = os.path.getsize(path)
+            if size is None:
+                size = os.path.getsize(os.path.join(root, f))
             normalized_filename = self.normalize_filename(f)
         
             if mode == 'unsplitable':
@@ -53,82 +495,444 @@ class Database(object):
             elif mode == 'normal':
                 key = self.keyify(size, normalized_filename)
             
-            if key in self.db: # check if same file
-                old_inode = os.stat(self.db[key]).st_ino
-                new_inode = os.stat(path).st_ino
-                if old_inode != new_inode:
-                    logger.warning('Duplicate key %s and %s' % (path, self.db[key]))
+            if key in db and db[key] != path: # check if same file
+                old_path = shard.decode_path(db[key])
+                new_path = shard.decode_path(path)
+                if os.stat(old_path).st_ino != os.stat(new_path).st_ino:
+                    logger.warning('Duplicate key %s and %s' % (new_path, old_path))
+                    self.metrics.inc('autotorrent_database_duplicate_keys')
+    
+            db[key] = path
+    
+    def get_rebuild_signature(self, disks):
+        """
+        Returns the settings a rebuild depends on, a checkpoint is only
+        resumed if they have not changed.
+        """
+        return (list(self.paths), list(disks), self.normal_mode, self.unsplitable_mode, self.exact_mode, self.size_mode,
+                self.size_mode_min_size, self.fuzzy_mode, self.fuzzy_mode_min_size, list(self.ignore_files), list(self.ignore_directories),
+                sorted(self.exclude_paths), self.skip_symlinks)
     
-            self.db[key] = path
+    def save_checkpoint(self, force=False):
+        """
+        Stores the finished folders of the current rebuild, at most every CHECKPOINT_INTERVAL seconds.
+        """
+        if not force and time.time() - self._last_checkpoint < CHECKPOINT_INTERVAL:
+            return
+        
+        logger.debug('Saving rebuild checkpoint')
+        self.db[META_REBUILD_KEY] = self._checkpoint
+        with self.profiler.phase('rebuild sync'):
+            if self.shard is not None:
+                self.shard.sync()
+            self.db.sync()
+        self._last_checkpoint = time.time()
     
-    def rebuild(self):
+    def rebuild(self, progress=None, resume=True, disks=None):
         """
         Scans the paths for files and rebuilds the database.
+        
+        If disks is set, only the shards of those disks are rebuilt.
+        
+        Every folder is checkpointed when it is scanned, so a stopped rebuild only rescans
+        the folders it was in. If a previous rebuild was stopped, it is resumed from the
+        last checkpoint unless resume is False or the settings changed.
         """
         logger.info('Rebuilding database')
-        self.truncate()
-        
-        unsplitable_paths = set()
-        if self.unsplitable_mode or self.exact_mode:
-            logger.info('Special modes enabled, doing a preliminary scan')
-            for root_path in self.paths:
-                logger.info('Preliminary scanning %s' % root_path)
-                for root, dirs, files in os.walk(root_path):
-                    if is_unsplitable(files):
-                        sep_root = root.split(os.sep)
-                        name = get_root_of_unsplitable(root.split(os.sep))
-                        while sep_root[-1] != name:
-                            sep_root.pop()
-                        path = os.path.join(*sep_root)
-                        logger.debug('Found unsplitable path %r' % path)
-                        unsplitable_paths.add(path)
-                logger.info('Done preliminary scanning %s' % root_path)
-        
-        for root_path in self.paths:
+        self.progress = progress = progress or RebuildProgress()
+        
+        if disks is None:
+            disks = list(self.paths)
+        elif self.is_outdated():
+            raise OutdatedDatabaseException('The database %r must be fully rebuilt before rebuilding single disks' % self.db_file)
+        
+        signature = self.get_rebuild_signature(disks)
+        counts = self.db.get(META_COUNTS_KEY, {})
+        checkpoint = self.db.get(META_REBUILD_KEY) if resume else None
+        if checkpoint and checkpoint['signature'] == signature:
+            logger.info('Resuming rebuild from checkpoint')
+        else:
+            if checkpoint:
+                logger.info('The settings changed since the rebuild was stopped, starting over')
+            if disks == list(self.paths):
+                self.truncate()
+                if counts: # used to estimate the time left
+                    self.db[META_COUNTS_KEY] = counts
+            else:
+                for root_path in disks:
+                    self.shards[root_path].truncate()
+            checkpoint = {'signature': signature, 'disks': {}, 'finished_disks': {}}
+        
+        self._checkpoint = checkpoint
+        self.save_checkpoint(force=True)
+        
+        scanned_disks = []
+        for root_path in disks:
+            if os.path.abspath(root_path) in self.exclude_paths:
+                logger.info('Skipping excluded path %s' % root_path)
+                continue
+            scanned_disks.append(root_path)
+        
+        progress.start(scanned_disks, counts)
+        for root_path in scanned_disks:
+            if root_path in checkpoint['finished_disks']:
+                logger.info('Already scanned %s' % root_path)
+                progress.start_disk(root_path, *checkpoint['finished_disks'][root_path])
+                continue
+            
+            finished = checkpoint['disks'].setdefault(root_path, {})
+            progress.start_disk(root_path, *count_finished(finished))
+            
+            self.shard = self.shards[root_path]
+            self.shard.load_directories() # a resumed shard already has directories
+            
             logger.info('Scanning %s' % root_path)
-            for root, dirs, files in os.walk(root_path):
-                unsplitable = False
-                if self.unsplitable_mode or self.exact_mode:
-                    sep_root = root.split(os.sep)
-                    while sep_root:
-                        if os.path.join(*sep_root) in unsplitable_paths:
-                            break
-                        sep_root.pop()
+            start = time.time()
+            self.throttle = self.create_throttle()
+            try:
+                size, count, linked = self.scan_folder(os.path.abspath(root_path), {}, is_root=True, finished=finished)
+            finally:
+                if self.throttle.enabled:
+                    logger.info('Throttled scanning %s for %.1f seconds' % (root_path, self.throttle.slept))
+                self.throttle = NullThrottle()
+            progress.finish_disk()
+            logger.info('Done scanning %s' % root_path)
+            
+            self.shard.set_device()
+            checkpoint['finished_disks'][root_path] = tuple(progress.counts[root_path])
+            self.save_checkpoint(force=True)
+            self.shard = None
+            
+            self.metrics.set('autotorrent_rebuild_duration_seconds', round(time.time() - start, 3), disk=root_path)
+            self.metrics.set('autotorrent_rebuild_files', count, disk=root_path)
+            self.metrics.set('autotorrent_rebuild_bytes', size, disk=root_path)
+        
+        counts.update((disk, tuple(c)) for disk, c in progress.counts.items())
+        self.db[META_COUNTS_KEY] = counts
+        del self.db[META_REBUILD_KEY]
+        with self.profiler.phase('rebuild sync'):
+            self.db.sync()
+        self._online_shards = None
+        
+        if self.metrics.enabled:
+            self.metrics.set('autotorrent_database_keys', len(self.db) + sum(len(shard.db) for shard in self.shards.values()))
+            self.metrics.set('autotorrent_database_size_bytes', self.get_size_on_disk())
+    
+    def create_throttle(self):
+        """
+        Creates the throttle used when scanning a disk, each disk is limited separately.
+        """
+        if self.ops_per_second or self.max_stat_latency:
+            return IOThrottle(self.ops_per_second, self.max_stat_latency)
+        return NullThrottle()
+    
+    def get_size_on_disk(self):
+        """
+        Returns the size of the files making up the database and its shards,
+        the shelve backends use different extensions.
+        """
+        dirname, basename = os.path.split(os.path.abspath(self.db_file))
+        size = 0
+        for f in os.listdir(dirname):
+            if f == basename or f.startswith(basename + '.'):
+                size += os.path.getsize(os.path.join(dirname, f))
+        return size
+    
+    def list_folder(self, path, listings=None):
+        """
+        Lists a folder and returns a tuple with folders, files and the folders that are symlinks.
+        Ignored folders are not included.
+        
+        If the folder is found in listings, the cached listing is used instead.
+        """
+        if listings and path in listings:
+            return listings.pop(path)
+        
+        with self.profiler.phase('rebuild walk'):
+            return self._list_folder(path)
+    
+    def _list_folder(self, path):
+        self.throttle.wait()
+        dirs, files, linked_dirs = [], [], set()
+        try:
+            if scandir is not None:
+                for entry in scandir(path):
+                    is_link = entry.is_symlink()
+                    if is_link and self.skip_symlinks:
+                        continue
                     
-                    if sep_root:
-                        unsplitable = True
-                        if self.unsplitable_mode:
-                            unsplitable_name = sep_root[-1]
-                            logger.info('Looks like we found a unsplitable release in %r' % (os.sep.join(sep_root)))
-                            for f in files:
-                                self.insert_into_database(root, f, 'unsplitable', unsplitable_name=unsplitable_name)
-                            continue
-                
-                if not unsplitable:
-                    if self.normal_mode:
-                        for f in files:
-                            normalized_filename = self.normalize_filename(f)
-                            
-                            do_skip = False
-                            for ignore_file in self.ignore_files:
-                                if fnmatch(normalized_filename, ignore_file):
-                                    do_skip = True
-                                    break
-                            if do_skip:
-                                continue
-                            
-                            self.insert_into_database(root, f, 'normal')
-                        
-                    if self.exact_mode:
-                        for f in files:
-                            self.insert_into_database(root, f, 'exact', 'f')
-                        
-                        for d in dirs:
-                            self.insert_into_database(root, d, 'exact', 'd')
-
+                    if entry.is_dir():
+                        dirs.append(entry.name)
+                        if is_link:
+                            linked_dirs.add(entry.name)
+                    else:
+                        files.append(entry.name)
+            else:
+                for name in os.listdir(path):
+                    p = os.path.join(path, name)
+                    is_link = os.path.islink(p)
+                    if is_link and self.skip_symlinks:
+                        continue
                     
-            logger.info('Done scanning %s' % root_path)
-        self.db.sync()
+                    if os.path.isdir(p):
+                        dirs.append(name)
+                        if is_link:
+                            linked_dirs.add(name)
+                    else:
+                        files.append(name)
+        except OSError as e:
+            logger.warning('Unable to list %r: %s' % (path, e))
+        
+        dirs = [d for d in dirs if not self.is_ignored_directory(path, d)]
+        return dirs, files, linked_dirs
+    
+    def find_unsplitable_name(self, path, dirs, files, linked_dirs, listings, is_root=False):
+        """
+        Returns the name of the unsplitable release path is the root of, or None.
+        """
+        name = os.path.basename(os.path.normpath(path))
+        if not is_root and is_unsplitable_subfolder(name): # subfolders are checked with their parent
+            return None
+        
+        if not self.find_unsplitable(path, dirs, files, linked_dirs, listings):
+            return None
+        
+        if is_unsplitable_subfolder(name):
+            name = get_root_of_unsplitable(os.path.abspath(path).split(os.sep))
+        logger.info('Looks like we found a unsplitable release in %r' % path)
+        return name
+    
+    def find_unsplitable(self, path, dirs, files, linked_dirs, listings):
+        """
+        Checks if a folder is the root of an unsplitable release by looking at its files
+        and the files in its release subfolders, e.g. cd1 or sample.
+        
+        The subfolders listed are kept in listings so they are only listed once.
+        """
+        if is_unsplitable(files):
+            return True
+        
+        for d in dirs:
+            if d in linked_dirs or not is_unsplitable_subfolder(d):
+                continue
+            
+            p = os.path.join(path, d)
+            listings[p] = listing = self.list_folder(p, listings)
+            if self.find_unsplitable(p, *listing, listings=listings):
+                return True
+        
+        return False
+    
+    def scan_folder(self, path, listings, unsplitable_name=None, is_root=False, finished=None):
+        """
+        Scans a folder and its subfolders and inserts them into the database.
+        
+        Unsplitable releases are found while scanning, unsplitable_name is
+        the name of the release this folder is part of.
+        
+        finished is a dict of the subfolders of this folder seen by the rebuild. A scanned
+        subfolder has [size, files, folders, linked], a subfolder being scanned has a dict of its
+        own subfolders. It is updated when a subfolder is done and the rebuild checkpointed.
+        
+        Returns the total size and number of files scanned in the folder and if a symlinked
+        folder is in it, symlinked folders are not followed so their content is not counted.
+        """
+        dirs, files, linked_dirs = self.list_folder(path, listings)
+        
+        sizes, mtimes = {}, {}
+        with self.profiler.phase('rebuild stat'):
+            stat_file = self.throttle.stat
+            for f in files:
+                try:
+                    stat = stat_file(os.path.join(path, f))
+                except OSError as e:
+                    logger.warning('Unable to stat %r: %s' % (os.path.join(path, f), e))
+                    continue
+                sizes[f] = stat.st_size
+                mtimes[f] = stat.st_mtime
+            files = [f for f in files if f in sizes]
+        self.progress.add_folder(len(files))
+        
+        if (self.unsplitable_mode or self.exact_mode or self.fuzzy_mode) and unsplitable_name is None:
+            unsplitable_name = self.find_unsplitable_name(path, dirs, files, linked_dirs, listings, is_root)
+        
+        with self.profiler.phase('rebuild insert'):
+            self.insert_files(path, files, sizes, mtimes, unsplitable_name)
+        
+        total_size, total_count, has_linked = sum(sizes.values()), len(files), False
+        for d in dirs:
+            if finished is not None and isinstance(finished.get(d), list):
+                size, count, _, linked = finished[d]
+            elif d in linked_dirs: # symlinked folders are not followed
+                size, count, linked = 0, 0, True
+            elif finished is not None:
+                subfolders = finished.setdefault(d, {})
+                folders_before = self.progress.counts[self.progress.disk][0] - count_finished(subfolders)[0]
+                size, count, linked = self.scan_folder(os.path.join(path, d), listings, unsplitable_name, finished=subfolders)
+                finished[d] = [size, count, self.progress.counts[self.progress.disk][0] - folders_before, linked]
+                self.save_checkpoint()
+            else:
+                size, count, linked = self.scan_folder(os.path.join(path, d), listings, unsplitable_name)
+            
+            if self.exact_mode and unsplitable_name is None:
+                with self.profiler.phase('rebuild insert'):
+                    self.insert_into_database(path, d, 'exact', 'd', size=None if linked else size, count=count)
+            
+            total_size += size
+            total_count += count
+            has_linked = has_linked or linked
+        
+        return total_size, total_count, has_linked
+    
+    def insert_files(self, path, files, sizes, mtimes, unsplitable_name=None):
+        """
+        Inserts the files of a folder in the modes enabled, sizes and mtimes are dicts
+        with the size and modification time of each file.
+        
+        Files in unsplitable releases are not added to the fuzzy index, all the volumes
+        of a release have the same size and similar names.
+        """
+        if self.size_mode:
+            for f in files:
+                if sizes[f] >= self.size_mode_min_size and not self.is_ignored(f):
+                    self.insert_into_database(path, f, 'size', size=sizes[f])
+        
+        if self.fuzzy_mode and unsplitable_name is None:
+            for f in files:
+                if sizes[f] >= self.fuzzy_mode_min_size and not self.is_ignored(f):
+                    self.insert_into_database(path, f, 'fuzzy', size=sizes[f])
+        
+        if unsplitable_name is not None and (self.unsplitable_mode or self.exact_mode): # releases are also found for fuzzy mode
+            if self.unsplitable_mode:
+                for f in files:
+                    self.insert_into_database(path, f, 'unsplitable', unsplitable_name=unsplitable_name, size=sizes[f])
+        else:
+            if self.normal_mode:
+                for f in files:
+                    if self.is_ignored(f):
+                        continue
+                    
+                    self.insert_into_database(path, f, 'normal', size=sizes[f])
+            
+            if self.exact_mode:
+                for f in files:
+                    self.insert_into_database(path, f, 'exact', 'f', size=sizes[f], mtime=mtimes[f])
+    
+    def index_client(self, client):
+        """
+        Indexes the complete files of the torrents in a client from the file lists the
+        client returns, the disks are not touched.
+        
+        The files are kept in their own shard that is replaced every time the client is indexed.
+        
+        Returns the number of torrents and files indexed.
+        """
+        self.check_version()
+        logger.info('Indexing the files in the client')
+        
+        shard = self.shards.get(CLIENT_SHARD)
+        if shard is None:
+            shard = self.shards[CLIENT_SHARD] = self.open_shard(CLIENT_SHARD)
+        shard.truncate()
+        
+        start = time.time()
+        torrent_count, file_count, size = 0, 0, 0
+        self.shard = shard
+        try:
+            with self.profiler.phase('client files'):
+                file_lists = list(client.get_file_lists())
+            
+            for root, files in file_lists:
+                if not files or self.is_excluded(root):
+                    continue
+                
+                with self.profiler.phase('rebuild insert'):
+                    self.index_torrent_files(root, files)
+                torrent_count += 1
+                file_count += len(files)
+                size += sum(f[1] for f in files)
+        finally:
+            self.shard = None
+        
+        imported = self.db.get(META_IMPORTED_KEY, [])
+        if CLIENT_SHARD not in imported:
+            self.db[META_IMPORTED_KEY] = imported + [CLIENT_SHARD]
+        with self.profiler.phase('rebuild sync'):
+            shard.sync()
+            self.db.sync()
+        self._online_shards = None
+        
+        logger.info('Indexed %i files in %i torrents' % (file_count, torrent_count))
+        if self.metrics.enabled:
+            self.metrics.set('autotorrent_rebuild_duration_seconds', round(time.time() - start, 3), disk=CLIENT_SHARD)
+            self.metrics.set('autotorrent_rebuild_files', file_count, disk=CLIENT_SHARD)
+            self.metrics.set('autotorrent_rebuild_bytes', size, disk=CLIENT_SHARD)
+        
+        return torrent_count, file_count
+    
+    def index_torrent_files(self, root, files):
+        """
+        Inserts the files of a torrent in a client, as if the folders were scanned.
+        
+        root is the path of the torrent, i.e. its folder or its single file, files is a list
+        of (path, size) of the complete files in it.
+        """
+        if len(files) == 1 and files[0][0] == root: # single file torrent
+            path, size = files[0]
+            dirname, f = os.path.split(path)
+            self.insert_files(dirname, [f], {f: size}, {f: 0})
+            return
+        
+        listings, sizes = {}, {}
+        for path, size in files:
+            dirname, f = os.path.split(path)
+            listings.setdefault(dirname, ([], [], set()))[1].append(f)
+            sizes[path] = size
+            
+            while dirname != root and dirname.startswith(root + os.sep): # add the folders up to the root
+                parent, d = os.path.split(dirname)
+                if parent in listings:
+                    if d in listings[parent][0]:
+                        break
+                    listings[parent][0].append(d)
+                else:
+                    listings[parent] = ([d], [], set())
+                dirname = parent
+        
+        if root not in listings:
+            return
+        
+        for path, (dirs, files, linked_dirs) in listings.items():
+            dirs[:] = [d for d in dirs if not self.is_ignored_directory(path, d)]
+        
+        size, count = self.index_folder(root, listings, sizes, is_root=True)
+        if self.exact_mode:
+            self.insert_into_database(os.path.dirname(root), os.path.basename(root), 'exact', 'd', size=size, count=count, mtime=0)
+    
+    def index_folder(self, path, listings, sizes, unsplitable_name=None, is_root=False):
+        """
+        Works like scan_folder but with listings and sizes of all folders and files known.
+        
+        Returns the total size and number of files in the folder.
+        """
+        dirs, files, linked_dirs = self.list_folder(path, listings)
+        folder_sizes = dict((f, sizes[os.path.join(path, f)]) for f in files)
+        
+        if (self.unsplitable_mode or self.exact_mode or self.fuzzy_mode) and unsplitable_name is None:
+            unsplitable_name = self.find_unsplitable_name(path, dirs, files, linked_dirs, listings, is_root)
+        
+        self.insert_files(path, files, folder_sizes, dict((f, 0) for f in files), unsplitable_name)
+        
+        total_size, total_count = sum(folder_sizes.values()), len(files)
+        for d in dirs:
+            size, count = self.index_folder(os.path.join(path, d), listings, sizes, unsplitable_name)
+            if self.exact_mode and unsplitable_name is None:
+                self.insert_into_database(path, d, 'exact', 'd', size=size, count=count, mtime=0)
+            
+            total_size += size
+            total_count += count
+        
+        return total_size, total_count
     
     def find_unsplitable_file_path(self, rls, f, size):
         """
@@ -137,15 +941,100 @@ class Database(object):
         f = [self.normalize_filename(x) for x in f]
         key = self.keyify(size, self.normalize_filename(rls), *f)
 
-        return self.db.get(key, None)
+        return self.get(key)
     
     def find_exact_file_path(self, prefix, rls):
         """
         Looks for a name in the database.
         """
+        entries = self.find_exact_entries(prefix, rls)
+        if entries is None:
+            return None
+        
+        return [entry[0] for entry in entries]
+    
+    def find_exact_entries(self, prefix, rls):
+        """
+        Looks for a name in the database and returns the
+        (path, size, file count, mtime) entries from all disks.
+        """
         key = self.keyify(prefix, rls)
-
-        return self.db.get(key, None)
+        result = None
+        for shard in self.get_online_shards():
+            entries = shard.db.get(key, None)
+            if entries is not None:
+                result = (result or []) + [(shard.decode_path(entry[:2]), ) + tuple(entry[2:]) for entry in entries]
+        
+        return result
+    
+    def find_exact_candidates(self, prefix, rls, size, count=1):
+        """
+        Looks for a name in the database and returns the paths that can
+        contain size bytes in count files, the most likely match first.
+        
+        Folders with symlinked folders in them have an unknown size, they are
+        returned last and must be checked on disk.
+        """
+        entries = self.find_exact_entries(prefix, rls)
+        if not entries:
+            return []
+        
+        candidates, unknown_candidates = [], []
+        for path, entry_size, entry_count, mtime in entries:
+            if entry_size is None:
+                unknown_candidates.append((-mtime, path))
+                continue
+            
+            if entry_size < size or entry_count < count or (prefix == 'f' and entry_size != size):
+                logger.debug('Rejecting exact path %r (got size %s, expected %s)' % (path, entry_size, size))
+                continue
+            
+            candidates.append(((entry_size - size, entry_count - count, -mtime), path))
+        
+        return [path for _, path in sorted(candidates) + sorted(unknown_candidates)]
+    
+    def find_size_file_paths(self, size):
+        """
+        Looks for files with a given size in the database.
+        Only files larger than size_mode_min_size are indexed.
+        """
+        key = self.keyify('size', '%s' % size)
+        
+        result = []
+        for shard in self.get_online_shards():
+            result += [shard.decode_path(entry) for entry in shard.db.get(key, [])]
+        return result
+    
+    def find_fuzzy_file_paths(self, f, size):
+        """
+        Looks for files with the same size and extension as f and a similar name,
+        e.g. Show.Name.S01E01.mkv for Show Name S01E01.mkv.
+        
+        Only the files sharing a word with f are looked at, the candidates are
+        ranked by the share of words they have in common with f.
+        Only files larger than fuzzy_mode_min_size are indexed.
+        """
+        tokens = self.tokenize_filename(f)
+        if not tokens:
+            return []
+        
+        extension = os.path.splitext(f)[1].lower()
+        candidates = OrderedDict()
+        for token in sorted(tokens):
+            key = self.keyify('fuzzy', '%s' % size, token)
+            for shard in self.get_online_shards():
+                for entry in shard.db.get(key, []):
+                    path = shard.decode_path(entry)
+                    if path not in candidates and os.path.splitext(path)[1].lower() == extension:
+                        candidates[path] = self.tokenize_filename(os.path.basename(path))
+        
+        ranked = []
+        for i, (path, candidate_tokens) in enumerate(candidates.items()):
+            similarity = len(tokens & candidate_tokens) / len(tokens | candidate_tokens)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                ranked.append((-similarity, i, path))
+        
+        return [path for _, _, path in sorted(ranked)]
     
     def find_file_path(self, f, size):
         """
@@ -153,16 +1042,75 @@ class Database(object):
         """
         key = self.keyify(size, self.normalize_filename(f))
 
-        return self.db.get(key, None)
+        return self.get(key)
+    
+    def find_many(self, requests):
+        """
+        Looks for many files in the database at once.
+        
+        requests is a list of (name, size) tuples for normal lookups and
+        (release, path, size) tuples for unsplitable lookups.
+        Returns a list of paths (or None) in the same order as requests.
+        """
+        normalized = {}
+        def normalize(name):
+            if name not in normalized:
+                normalized[name] = self.normalize_filename(name)
+            return normalized[name]
+        
+        keys = []
+        for request in requests:
+            if len(request) == 2:
+                name, size = request
+                keys.append(self.keyify(size, normalize(name)))
+            else:
+                rls, f, size = request
+                keys.append(self.keyify(size, normalize(rls), *[normalize(x) for x in f]))
+        
+        found = {}
+        for key in sorted(set(keys)):
+            found[key] = self.get(key)
+        
+        return [found[key] for key in keys]
     
     def keyify(self, size, *names):
         """
         Turns a name and size into a key that can be stored in the database.
+        The key is a 16 byte digest after HASH_KEY_PREFIX, as a latin-1 string on Python 3.
+        """
+        return hash_key(('%s|%s' % (size, '|'.join(names))).encode('utf-8'))
+    
+    def is_ignored(self, filename):
+        """
+        Checks if a filename matches any of the ignored files.
+        """
+        return self._ignore_files_re is not None and self._ignore_files_re.match(self.normalize_filename(filename)) is not None
+    
+    def is_ignored_directory(self, root, dirname):
+        """
+        Checks if a directory should not be scanned.
         """
-        key = '%s|%s' % (size, '|'.join(names))
-        logger.debug('Keyify: %s' % key)
+        if self._ignore_directories_re is not None and self._ignore_directories_re.match(self.normalize_filename(dirname)):
+            return True
         
-        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+        if self.exclude_paths and os.path.abspath(os.path.join(root, dirname)) in self.exclude_paths:
+            return True
+        
+        return False
+    
+    def is_excluded(self, path):
+        """
+        Checks if a path is inside one of the excluded paths, e.g. the store_path.
+        """
+        path = os.path.abspath(path)
+        return any(path == p or path.startswith(p + os.sep) for p in self.exclude_paths)
+    
+    def tokenize_filename(self, filename):
+        """
+        Splits the name of a file, without the extension, into a set of lowercased words.
+        """
+        name = os.path.splitext(filename)[0].lower()
+        return set(token for token in TOKEN_SEPARATOR_RE.split(name) if token)
     
     def normalize_filename(self, filename):
         """
@@ -0,0 +1,153 @@
+from array import array
+
+__all__ = [
+    'TorrentFile',
+    'TorrentFileTable',
+]
+
+try:
+    array('q')
+    LENGTH_TYPECODE = 'q'
+except ValueError: # Python 2 has no long long arrays
+    LENGTH_TYPECODE = 'L'
+
+class TorrentFile(object):
+    """
+    A view of a single file in a TorrentFileTable.
+
+    Behaves like the dicts used to describe files, i.e. supports
+    f['path'], f['length'], f['actual_path'] and f['completed'].
+    """
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, key):
+        table = self.table
+        if key == 'path':
+            return table.paths[self.index].split('/')
+        elif key == 'length':
+            return table.lengths[self.index]
+        elif key == 'actual_path':
+            return table.actual_paths[self.index]
+        elif key == 'completed':
+            return bool(table.completed[self.index])
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        table = self.table
+        if key == 'path':
+            table.paths[self.index] = '/'.join(value)
+        elif key == 'length':
+            table.lengths[self.index] = value
+        elif key == 'actual_path':
+            table.actual_paths[self.index] = value
+        elif key == 'completed':
+            table.completed[self.index] = bool(value)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in TorrentFileTable.fields
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def keys(self):
+        return list(TorrentFileTable.fields)
+
+    def to_dict(self):
+        return dict((key, self[key]) for key in TorrentFileTable.fields)
+
+    def __eq__(self, other):
+        if isinstance(other, TorrentFile):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+class TorrentFileTable(object):
+    """
+    Compact representation of the files in a torrent.
+
+    The files are stored in parallel arrays in the original torrent order,
+    so the index of a file is also its index in the torrent.
+    Paths are stored as '/' joined strings, torrent paths cannot contain '/'.
+    """
+    fields = ('path', 'length', 'actual_path', 'completed')
+
+    def __init__(self):
+        self.paths = []
+        self.lengths = array(LENGTH_TYPECODE)
+        self.actual_paths = []
+        self.completed = bytearray()
+        self.piece_map = None
+
+    @classmethod
+    def from_files(cls, files):
+        """
+        Creates a table from a list of file dicts.
+        """
+        table = cls()
+        for f in files:
+            table.append(f['path'], f['length'], f.get('actual_path'), f.get('completed', False))
+        return table
+
+    def append(self, path, length, actual_path=None, completed=False):
+        self.paths.append('/'.join(path))
+        self.lengths.append(length)
+        self.actual_paths.append(actual_path)
+        self.completed.append(bool(completed))
+
+    def set_actual_path(self, index, actual_path):
+        self.actual_paths[index] = actual_path
+        self.completed[index] = actual_path is not None
+
+    def sizes(self):
+        """
+        Returns a tuple with found and missing size.
+        """
+        found_size, missing_size = 0, 0
+        for length, completed in zip(self.lengths, self.completed):
+            if completed:
+                found_size += length
+            else:
+                missing_size += length
+        return found_size, missing_size
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return TorrentFile(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield TorrentFile(self, i)
+
+    def __eq__(self, other):
+        if isinstance(other, TorrentFileTable):
+            other = list(other)
+        return list(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
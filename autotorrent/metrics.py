@@ -0,0 +1,133 @@
+from __future__ import division
+
+import logging
+import os
+import tempfile
+import time
+
+from collections import OrderedDict
+
+__all__ = [
+    'Metrics',
+    'NullMetrics',
+]
+
+logger = logging.getLogger(__name__)
+
+METRICS = {
+    'autotorrent_last_run_timestamp_seconds': 'Time the run finished.',
+    'autotorrent_run_duration_seconds': 'Duration of the run.',
+    'autotorrent_torrents': 'Torrents handled in the last run by status.',
+    'autotorrent_found_bytes': 'Bytes found on disk for the handled torrents.',
+    'autotorrent_missing_bytes': 'Bytes that must be downloaded for the handled torrents.',
+    'autotorrent_client_requests': 'Requests made to the torrent client by method.',
+    'autotorrent_client_errors': 'Failed requests to the torrent client by method.',
+    'autotorrent_client_wait_seconds': 'Time spent waiting for the torrent client to check torrents before adding more.',
+    'autotorrent_rebuild_duration_seconds': 'Time spent scanning each disk.',
+    'autotorrent_rebuild_files': 'Files found on each disk.',
+    'autotorrent_rebuild_bytes': 'Bytes found on each disk.',
+    'autotorrent_database_keys': 'Keys in the database after rebuilding.',
+    'autotorrent_database_duplicate_keys': 'Files with the same key as another file.',
+    'autotorrent_database_size_bytes': 'Size of the database files on disk.',
+    'autotorrent_client_rpc_duration_seconds': 'Latency of the RPC calls made to the torrent client by method.',
+    'autotorrent_client_rpc_errors': 'Failed RPC calls made to the torrent client by method.',
+    'autotorrent_client_rpc_request_bytes': 'Estimated size of the RPC requests sent to the torrent client by method.',
+    'autotorrent_client_rpc_response_bytes': 'Estimated size of the RPC responses from the torrent client by method.',
+}
+
+METRIC_TYPES = {
+    'autotorrent_client_rpc_duration_seconds': 'histogram',
+}
+
+HISTOGRAM_SUFFIXES = ['_bucket', '_sum', '_count']
+
+def get_family(name):
+    """
+    Returns the name of the metric a sample belongs to, e.g. the histogram of a _bucket sample.
+    """
+    for suffix in HISTOGRAM_SUFFIXES:
+        if name.endswith(suffix) and METRIC_TYPES.get(name[:-len(suffix)]) == 'histogram':
+            return name[:-len(suffix)]
+    return name
+
+def escape_label(value):
+    return ('%s' % value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+class NullMetrics(object):
+    """
+    Metrics used when no metrics are written, does nothing.
+    """
+    enabled = False
+    
+    def inc(self, name, value=1, **labels):
+        pass
+    
+    def set(self, name, value, **labels):
+        pass
+
+class Metrics(object):
+    """
+    Collects metrics of a run and writes them in the Prometheus textfile collector format.
+    
+    All metrics describe the last run, they are gauges except the RPC latency histograms.
+    """
+    enabled = True
+    
+    def __init__(self, **labels):
+        self.labels = labels
+        self.values = OrderedDict()
+        self.started = time.time()
+    
+    def _key(self, name, labels):
+        if get_family(name) not in METRICS:
+            raise KeyError('Unknown metric %r' % name)
+        return name, tuple(sorted(labels.items()))
+    
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        self.values[key] = self.values.get(key, 0) + value
+    
+    def set(self, name, value, **labels):
+        self.values[self._key(name, labels)] = value
+    
+    def render(self):
+        """
+        Returns the metrics as text.
+        """
+        lines = []
+        for family in sorted(set(get_family(name) for name, labels in self.values)):
+            lines.append('# HELP %s %s' % (family, METRICS[family]))
+            lines.append('# TYPE %s %s' % (family, METRIC_TYPES.get(family, 'gauge')))
+            for key in self.values: # samples are kept in the order they were added, e.g. histogram buckets
+                if get_family(key[0]) != family:
+                    continue
+                
+                name = key[0]
+                labels = sorted(list(self.labels.items()) + list(key[1]))
+                if labels:
+                    label_text = '{%s}' % ','.join('%s="%s"' % (k, escape_label(v)) for k, v in labels)
+                else:
+                    label_text = ''
+                lines.append('%s%s %s' % (name, label_text, self.values[key]))
+        return '\n'.join(lines) + '\n'
+    
+    def write(self, path):
+        """
+        Writes the metrics to path. The file is replaced atomically so the
+        collector never reads a partial file.
+        """
+        self.set('autotorrent_last_run_timestamp_seconds', int(time.time()))
+        self.set('autotorrent_run_duration_seconds', round(time.time() - self.started, 3))
+        
+        dirname = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % os.path.basename(path), dir=dirname)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.render())
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        
+        logger.info('Wrote metrics to %r' % path)
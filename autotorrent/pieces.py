@@ -0,0 +1,142 @@
+from __future__ import division
+
+import bisect
+
+from array import array
+
+from .filetable import LENGTH_TYPECODE, TorrentFileTable
+
+__all__ = [
+    'PieceAvailability',
+    'PieceMap',
+    'get_piece_map',
+]
+
+class PieceAvailability(object):
+    """
+    The pieces of a torrent that can be satisfied by the found files.
+    """
+    def __init__(self, piece_map, missing, boundary_pieces, download_size):
+        self.piece_map = piece_map
+        self.missing = missing
+        self.boundary_pieces = boundary_pieces
+        self.download_size = download_size
+        self.missing_pieces = sum(missing)
+        self.satisfiable_pieces = piece_map.piece_count - self.missing_pieces
+
+    @property
+    def is_complete(self):
+        return not self.missing_pieces
+
+    def bitfield(self):
+        """
+        Returns the satisfiable pieces as a bitfield, first piece in the highest bit.
+        """
+        retval = bytearray((len(self.missing) + 7) // 8)
+        for piece, missing in enumerate(self.missing):
+            if not missing:
+                retval[piece//8] |= 1 << (7 - piece % 8)
+        return bytes(retval)
+
+class PieceMap(object):
+    """
+    Maps the files of a torrent to the pieces they are in.
+
+    The mapping is done once and kept in compact arrays, the availability
+    is computed from the current completed flags of the files.
+    """
+    def __init__(self, piece_length, files):
+        self.piece_length = piece_length
+        self.files = files
+
+        self.offsets = array(LENGTH_TYPECODE)
+        self.first_pieces = array(LENGTH_TYPECODE)
+        self.last_pieces = array(LENGTH_TYPECODE)
+
+        position = 0
+        for f in files:
+            length = f['length']
+            self.offsets.append(position)
+            self.first_pieces.append(position // piece_length)
+            self.last_pieces.append((position + length - 1) // piece_length if length else position // piece_length - 1)
+            position += length
+
+        self.total_length = position
+        self.piece_count = (position + piece_length - 1) // piece_length
+
+    def piece_size(self, piece):
+        if piece == self.piece_count - 1:
+            return self.total_length - piece * self.piece_length
+        return self.piece_length
+
+    def availability(self):
+        """
+        Finds the pieces that must be downloaded because they contain data from missing files.
+        """
+        if isinstance(self.files, TorrentFileTable):
+            completed = self.files.completed
+        else:
+            completed = [f['completed'] for f in self.files]
+
+        missing = bytearray(self.piece_count)
+        for i, is_completed in enumerate(completed):
+            if not is_completed:
+                for piece in range(self.first_pieces[i], self.last_pieces[i] + 1):
+                    missing[piece] = 1
+
+        boundary_pieces = set()
+        for i, is_completed in enumerate(completed):
+            if is_completed and self.first_pieces[i] <= self.last_pieces[i]:
+                for piece in (self.first_pieces[i], self.last_pieces[i]):
+                    if missing[piece]:
+                        boundary_pieces.add(piece)
+
+        download_size = 0
+        for piece, is_missing in enumerate(missing):
+            if is_missing:
+                download_size += self.piece_size(piece)
+
+        return PieceAvailability(self, missing, sorted(boundary_pieces), download_size)
+
+    def files_in_piece(self, piece):
+        """
+        Returns the indexes of the files that have data in a piece.
+        """
+        start = piece * self.piece_length
+        end = start + self.piece_size(piece)
+
+        i = max(bisect.bisect_right(self.offsets, start) - 1, 0)
+        result = []
+        while i < len(self.offsets) and self.offsets[i] < end:
+            if self.first_pieces[i] <= piece <= self.last_pieces[i]:
+                result.append(i)
+            i += 1
+        return result
+
+    def segments(self, piece):
+        """
+        Returns the (path, offset, length) segments that make up a piece.
+        """
+        start = piece * self.piece_length
+        end = start + self.piece_size(piece)
+
+        result = []
+        for i in self.files_in_piece(piece):
+            f = self.files[i]
+            file_start = max(start, self.offsets[i])
+            file_end = min(end, self.offsets[i] + f['length'])
+            result.append((f['actual_path'], file_start - self.offsets[i], file_end - file_start))
+        return result
+
+def get_piece_map(torrent, files):
+    """
+    Returns the piece map of the files in a torrent. A TorrentFileTable
+    keeps its piece map so it is only created once.
+    """
+    piece_length = torrent[b'info'][b'piece length']
+    piece_map = getattr(files, 'piece_map', None)
+    if piece_map is None or piece_map.piece_length != piece_length:
+        piece_map = PieceMap(piece_length, files)
+        if hasattr(files, 'piece_map'):
+            files.piece_map = piece_map
+    return piece_map
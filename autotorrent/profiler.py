@@ -0,0 +1,127 @@
+from __future__ import division, print_function
+
+import cProfile
+import logging
+import sys
+
+from timeit import default_timer
+
+__all__ = [
+    'Profiler',
+    'NullProfiler',
+]
+
+logger = logging.getLogger(__name__)
+
+class Phase(object):
+    __slots__ = ('profiler', 'name', 'start', 'nested')
+    
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+    
+    def __enter__(self):
+        self.nested = 0.0
+        self.profiler.running.append(self)
+        self.start = default_timer()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = default_timer() - self.start
+        running = self.profiler.running
+        running.pop()
+        if running:
+            running[-1].nested += seconds
+        self.profiler.add(self.name, seconds - self.nested)
+
+class NullPhase(object):
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+NULL_PHASE = NullPhase()
+
+class NullProfiler(object):
+    """
+    Profiler used when profiling is disabled, does nothing.
+    """
+    enabled = False
+    
+    def phase(self, name):
+        return NULL_PHASE
+    
+    def add(self, name, seconds):
+        pass
+    
+    def start(self):
+        pass
+    
+    def stop(self):
+        pass
+    
+    def report(self, out=None):
+        pass
+
+class Profiler(object):
+    """
+    Times the phases of rebuilding the database and adding torrents.
+    The time of a phase inside another phase is only counted in the inner phase.
+    
+    If stats_file is set, everything between start and stop is also
+    profiled with cProfile and the stats are dumped to the file.
+    """
+    enabled = True
+    
+    def __init__(self, stats_file=None):
+        self.stats_file = stats_file
+        self.phases = []
+        self.timings = {}
+        self.running = []
+        self._profile = None
+    
+    def phase(self, name):
+        """
+        Returns a context manager timing a phase.
+        """
+        return Phase(self, name)
+    
+    def add(self, name, seconds):
+        timing = self.timings.get(name)
+        if timing is None:
+            self.phases.append(name)
+            timing = self.timings[name] = [0, 0.0, 0.0]
+        
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+    
+    def start(self):
+        if self.stats_file and self._profile is None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+    
+    def stop(self):
+        if self._profile is not None:
+            self._profile.disable()
+            logger.info('Dumping profiling stats to %r' % self.stats_file)
+            self._profile.dump_stats(self.stats_file)
+            self._profile = None
+    
+    def report(self, out=None):
+        """
+        Prints a table with the time spent in each phase.
+        """
+        out = out or sys.stdout
+        print('', file=out)
+        print(' %-20s %8s %12s %12s %12s' % ('Phase', 'Calls', 'Total (s)', 'Mean (ms)', 'Max (ms)'), file=out)
+        for name in self.phases:
+            calls, total, slowest = self.timings[name]
+            print(' %-20s %8i %12.3f %12.3f %12.3f' % (name, calls, total, total / calls * 1000, slowest * 1000), file=out)
+        
+        if self.stats_file:
+            print('', file=out)
+            print(' cProfile stats written to %s' % self.stats_file, file=out)
@@ -0,0 +1,102 @@
+from __future__ import division, print_function
+
+import logging
+
+from timeit import default_timer
+
+__all__ = [
+    'RebuildProgress',
+]
+
+logger = logging.getLogger(__name__)
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return '%i:%02i:%02i' % (seconds // 3600, (seconds // 60) % 60, seconds % 60)
+
+class RebuildProgress(object):
+    """
+    Keeps track of the folders and files scanned while rebuilding the database.
+    
+    If out is set, the progress is written to it every interval seconds with an ETA
+    based on the number of files found on each disk the last time it was scanned.
+    """
+    def __init__(self, out=None, interval=5.0):
+        self.out = out
+        self.interval = interval
+        self.expected = {}
+        self.counts = {}
+        self.disk = None
+        self.disks = []
+    
+    def start(self, disks, expected=None):
+        """
+        Starts the rebuild of disks, expected is a dict of disk: (folders, files) from the last rebuild.
+        """
+        self.disks = list(disks)
+        self.expected = expected or {}
+        self.counts = {}
+        self.started = self.last_report = default_timer()
+        self.scanned_files = 0
+        self.scanned_folders = 0
+    
+    def start_disk(self, disk, folders=0, files=0):
+        """
+        Starts scanning a disk, folders and files are already scanned, e.g. when resuming.
+        """
+        self.disk = disk
+        self.counts[disk] = [folders, files]
+    
+    def add_folder(self, files):
+        counts = self.counts[self.disk]
+        counts[0] += 1
+        counts[1] += files
+        self.scanned_folders += 1
+        self.scanned_files += files
+        
+        if self.out is not None and default_timer() - self.last_report >= self.interval:
+            self.report()
+    
+    def finish_disk(self):
+        if self.out is not None:
+            self.report()
+        self.disk = None
+    
+    def eta(self):
+        """
+        Returns the estimated number of seconds left or None if unknown.
+        """
+        remaining = 0
+        for disk in self.disks:
+            if disk not in self.expected:
+                return None
+            
+            expected_files = self.expected[disk][1]
+            if disk == self.disk:
+                remaining += max(expected_files - self.counts[disk][1], 0)
+            elif disk not in self.counts:
+                remaining += expected_files
+        
+        elapsed = default_timer() - self.started
+        if not self.scanned_files or not elapsed:
+            return None
+        
+        return remaining / (self.scanned_files / elapsed)
+    
+    def report(self):
+        self.last_report = now = default_timer()
+        elapsed = max(now - self.started, 0.001)
+        folders, files = self.counts[self.disk]
+        
+        if self.disk in self.expected and self.expected[self.disk][1]:
+            disk_progress = ' %3i%%' % min(files / self.expected[self.disk][1] * 100, 100)
+        else:
+            disk_progress = ''
+        
+        eta = self.eta()
+        message = 'Scanning disk %i of %i%s: %s folders, %s files (%i folders/s, %i files/s), ETA %s' % (
+            self.disks.index(self.disk) + 1, len(self.disks), disk_progress, folders, files,
+            self.scanned_folders / elapsed, self.scanned_files / elapsed, format_duration(eta) if eta is not None else 'unknown')
+        logger.info(message)
+        print(message, file=self.out)
+        self.out.flush()
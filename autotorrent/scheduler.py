@@ -0,0 +1,147 @@
+from __future__ import division
+
+import logging
+import time
+
+from timeit import default_timer
+
+__all__ = [
+    'AddScheduler',
+    'NullScheduler',
+    'DEFAULT_MAX_WAIT',
+    'NO_WAIT_LIMIT',
+]
+
+logger = logging.getLogger(__name__)
+
+MIN_POLL_INTERVAL = 1.0
+MAX_POLL_INTERVAL = 30.0
+
+DEFAULT_CHECK_INTERVAL = 10.0
+DEFAULT_MAX_WAIT = 600.0
+NO_WAIT_LIMIT = -1
+
+class NullScheduler(object):
+    """
+    Scheduler used when adds are not throttled, does nothing.
+    """
+    enabled = False
+    slept = 0.0
+    
+    def wait(self):
+        return 0.0
+
+class ClientLoad(object):
+    """
+    How busy a client was the last time it was asked.
+    """
+    def __init__(self):
+        self.checking = 0
+        self.average_latency = 0.0
+        self.checked_at = None
+
+class AddScheduler(object):
+    """
+    Holds back new torrents while the client is busy checking the torrents already added.
+    
+    The number of torrents the client is checking, or waiting to check, is fetched at most
+    every check_interval seconds, every add in between counts as one more torrent checking.
+    How fast the client answers is timed with a cheap call, client.ping.
+    
+    If max_checking or more torrents are checking, or the moving average of the time the
+    client takes to answer is above max_latency, the add waits and polls again with
+    a doubling interval until the client has caught up or max_wait seconds have passed.
+    A negative max_wait, e.g. NO_WAIT_LIMIT, waits as long as it takes.
+    
+    With a MultiClient only the instance the torrent is routed to is asked.
+    """
+    enabled = True
+    
+    def __init__(self, client, max_checking=0, max_latency=0, max_wait=DEFAULT_MAX_WAIT,
+                 check_interval=DEFAULT_CHECK_INTERVAL, clock=default_timer, sleep=time.sleep):
+        self.client = client
+        self.max_checking = max_checking
+        self.max_latency = max_latency
+        self.max_wait = max_wait
+        self.check_interval = check_interval
+        self.clock = clock
+        self.sleep = sleep
+        
+        self.loads = {}
+        self.slept = 0.0
+    
+    def get_client(self):
+        """
+        Returns the client the next torrent is added to, the routed instance of a MultiClient.
+        """
+        route = getattr(self.client, 'route', None)
+        if route is not None:
+            return route().client
+        return self.client
+    
+    def get_load(self, client):
+        load = self.loads.get(client)
+        if load is None:
+            load = self.loads[client] = ClientLoad()
+        return load
+    
+    def update(self, client, load):
+        """
+        Asks the client how busy it is, returns False if it could not be asked.
+        """
+        load.checked_at = self.clock()
+        try:
+            if self.max_latency:
+                start = self.clock()
+                client.ping()
+                load.average_latency = load.average_latency * 0.8 + (self.clock() - start) * 0.2
+            
+            if self.max_checking:
+                load.checking = client.get_checking_count()
+        except Exception as e:
+            logger.warning('Unable to ask the client how busy it is, not waiting: %r' % e)
+            return False
+        
+        return True
+    
+    def is_busy(self, refresh=False):
+        """
+        Checks if adding must wait. The client is only asked if refresh is set
+        or its last answer is more than check_interval seconds old.
+        """
+        client = self.get_client()
+        load = self.get_load(client)
+        if refresh or load.checked_at is None or self.clock() - load.checked_at >= self.check_interval:
+            if not self.update(client, load):
+                return False
+        
+        if self.max_checking and load.checking >= self.max_checking:
+            logger.info('Client is checking %i torrents, waiting' % load.checking)
+            return True
+        
+        if self.max_latency and load.average_latency > self.max_latency:
+            logger.info('Client answers in %.3f seconds, waiting' % load.average_latency)
+            return True
+        
+        return False
+    
+    def wait(self):
+        """
+        Waits until the client can take another torrent, returns the seconds waited.
+        """
+        waited = 0.0
+        interval = MIN_POLL_INTERVAL
+        busy = self.is_busy()
+        while busy:
+            if self.max_wait >= 0 and waited >= self.max_wait:
+                logger.warning('Waited %.1f seconds for the client, adding anyway' % waited)
+                break
+            
+            self.sleep(interval)
+            waited += interval
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+            busy = self.is_busy(refresh=True)
+        
+        self.get_load(self.get_client()).checking += 1 # the torrent about to be added may be checked too
+        self.slept += waited
+        return waited
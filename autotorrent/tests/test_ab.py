@@ -5,12 +5,17 @@ import os
 import shutil
 import tempfile
 
+from collections import OrderedDict
 from io import open
-from unittest import TestCase
+from unittest import SkipTest, TestCase
 
-from ..at import AutoTorrent, Status
+from ..at import AutoTorrent, Status, UnknownLinkTypeException
 from ..bencode import bdecode, bencode
-from ..db import Database
+from ..db import Database, DatabaseShard
+from ..metrics import Metrics
+from ..profiler import Profiler
+from ..scheduler import AddScheduler
+from ..utils import find_torrent_files, reflink, ReflinkNotSupportedException
 
 def create_file(temp_folder, path, size):
     path = os.path.join(temp_folder, *path)
@@ -23,10 +28,14 @@ def create_file(temp_folder, path, size):
 
 class DummyDatabase(Database):
     def __init__(self):
-        self.db = {}
+        self.shard = DatabaseShard({})
+        self.shards = OrderedDict([(None, self.shard)])
+        self._online_shards = None
         self.normal_mode = True
         self.unsplitable_mode = True
         self.exact_mode = True
+        self.size_mode = False
+        self.fuzzy_mode = False
     
     def truncate(self):
         pass
@@ -37,7 +46,7 @@ class DummyDatabase(Database):
     def add_file(self, f, size):
         basename = os.path.basename(f)
         key = self.keyify(size, self.normalize_filename(basename))
-        self.db[key] = f
+        self.shard.db[key] = self.shard.encode_path(os.path.dirname(f), basename)
 
 class DummyAutoTorrent(AutoTorrent):
     def __init__(self, *args, **kwargs):
@@ -51,10 +60,14 @@ class DummyAutoTorrent(AutoTorrent):
 class DummyClient(object):
     def __init__(self):
         self.hashes = set()
+        self.checking = [0]
     
     def get_torrents(self):
         return self.hashes
     
+    def get_checking_count(self):
+        return self.checking.pop(0) if len(self.checking) > 1 else self.checking[0]
+    
     def add_torrent(self, torrent, destination_path, files):
         infohash = hashlib.sha1(bencode(torrent[b'info'])).hexdigest()
         self.hashes.add(infohash)
@@ -110,6 +123,7 @@ class TestAutoTorrent(TestCase):
         self.actual_db = Database(os.path.join(self._temp_path, 'db.db'), list(paths), '', True, True, False)
 
     def tearDown(self):
+        self.actual_db.close()
         if self._temp_path.startswith('/tmp'): # paranoid-mon, the best pokemon.
             shutil.rmtree(self._temp_path)
     
@@ -207,6 +221,120 @@ class TestAutoTorrent(TestCase):
             p = os.path.join(self.dst, 'test', os.path.basename(f)) # file ends up in a subfolder with torrent name.
             self.assertTrue(os.path.isfile(p))
     
+    def test_handle_torrentfile_profiler(self):
+        for f in self.files:
+            self.db.add_file(f, 11)
+        
+        self.at.profiler = Profiler()
+        self.assertEqual(self.at.handle_torrentfile(self.torrent_file), Status.OK)
+        self.assertEqual(self.at.profiler.phases, ['decode', 'hash', 'seeded check', 'match', 'pieces', 'link', 'client add'])
+        self.assertTrue(all(self.at.profiler.timings[phase][0] == 1 for phase in self.at.profiler.phases))
+    
+    def test_handle_torrentfile_metrics(self):
+        self.db.add_file(self.files[0], 11)
+        
+        self.at.metrics = Metrics()
+        self.assertEqual(self.at.handle_torrentfile(self.torrent_file), Status.MISSING_FILES)
+        self.assertEqual(self.at.metrics.values[('autotorrent_torrents', (('status', 'missing_files'), ))], 1)
+        self.assertEqual(self.at.metrics.values[('autotorrent_found_bytes', ())], 8)
+        self.assertEqual(self.at.metrics.values[('autotorrent_missing_bytes', ())], 25)
+    
+    def test_handle_torrentfile_add_scheduler(self):
+        for f in self.files:
+            self.db.add_file(f, 11)
+        
+        self.client.checking = [3, 1]
+        sleeps = []
+        self.at.add_scheduler = AddScheduler(self.client, max_checking=2, sleep=sleeps.append)
+        self.at.metrics = Metrics()
+        self.assertEqual(self.at.handle_torrentfile(self.torrent_file), Status.OK)
+        self.assertEqual(sleeps, [1.0])
+        self.assertEqual(self.at.metrics.values[('autotorrent_client_wait_seconds', ())], 1.0)
+    
+    def test_handle_torrentfiles(self):
+        torrent_path = os.path.join(self._temp_path, 'torrents')
+        os.makedirs(os.path.join(torrent_path, 'a'))
+        os.makedirs(os.path.join(torrent_path, 'b'))
+        shutil.copy(self.torrent_file, os.path.join(torrent_path, 'a', 'test.torrent'))
+        shutil.copy(self.torrent_file, os.path.join(torrent_path, 'b', 'copy.TORRENT'))
+        create_file(torrent_path, ['b', 'test.nfo'], 10)
+        
+        paths = list(find_torrent_files([torrent_path, self.torrent_file_single]))
+        self.assertEqual(paths, [os.path.join(torrent_path, 'a', 'test.torrent'),
+                                 os.path.join(torrent_path, 'b', 'copy.TORRENT'),
+                                 self.torrent_file_single])
+        
+        for f in self.files:
+            self.db.add_file(f, 11)
+        
+        self.assertEqual([status for path, status in self.at.handle_torrentfiles(paths)],
+                         [Status.OK, Status.DUPLICATE, Status.OK])
+    
+    def test_find_torrent_files_symlink_loop(self):
+        if not hasattr(os, 'symlink'):
+            raise SkipTest('Symlinks are not supported')
+        
+        torrent_path = os.path.join(self._temp_path, 'torrents')
+        os.makedirs(os.path.join(torrent_path, 'a'))
+        shutil.copy(self.torrent_file, os.path.join(torrent_path, 'a', 'test.torrent'))
+        os.symlink(torrent_path, os.path.join(torrent_path, 'a', 'loop'))
+        
+        self.assertEqual(list(find_torrent_files([torrent_path])), [os.path.join(torrent_path, 'a', 'test.torrent')])
+    
+    def test_find_torrent_files_unreadable_folder(self):
+        torrent_path = os.path.join(self._temp_path, 'torrents')
+        os.makedirs(os.path.join(torrent_path, 'a'))
+        os.makedirs(os.path.join(torrent_path, 'b'))
+        shutil.copy(self.torrent_file, os.path.join(torrent_path, 'b', 'test.torrent'))
+        os.chmod(os.path.join(torrent_path, 'a'), 0)
+        
+        try:
+            self.assertEqual(list(find_torrent_files([torrent_path])), [os.path.join(torrent_path, 'b', 'test.torrent')])
+        finally:
+            os.chmod(os.path.join(torrent_path, 'a'), 0o755)
+    
+    def test_handle_torrentfiles_retry_failed(self):
+        copy_file = os.path.join(self._temp_path, 'copy.torrent')
+        shutil.copy(self.torrent_file, copy_file)
+        
+        for f in self.files:
+            self.db.add_file(f, 11)
+        
+        add_torrent = self.client.add_torrent
+        def fail_once(*args):
+            self.client.add_torrent = add_torrent
+            raise Exception('Client went away')
+        self.client.add_torrent = fail_once
+        
+        self.assertEqual([status for path, status in self.at.handle_torrentfiles([self.torrent_file, copy_file, self.torrent_file])],
+                         [Status.ERROR, Status.OK, Status.DUPLICATE])
+    
+    def test_handle_torrentfiles_error(self):
+        broken_file = os.path.join(self._temp_path, 'broken.torrent')
+        with open(broken_file, 'wb') as f:
+            f.write(b'd4:info')
+        missing_file = os.path.join(self._temp_path, 'missing.torrent')
+        
+        for f in self.files:
+            self.db.add_file(f, 11)
+        
+        self.assertEqual([status for path, status in self.at.handle_torrentfiles([broken_file, missing_file, self.torrent_file])],
+                         [Status.ERROR, Status.ERROR, Status.OK])
+        self.assertTrue(self._check_at_log(Status.ERROR))
+    
+    def test_handle_torrentfiles_delete_duplicate(self):
+        duplicate_file = os.path.join(self._temp_path, 'copy.torrent')
+        shutil.copy(self.torrent_file, duplicate_file)
+        
+        for f in self.files:
+            self.db.add_file(f, 11)
+        
+        self.at.delete_torrents = True
+        self.assertEqual([status for path, status in self.at.handle_torrentfiles([self.torrent_file, duplicate_file])],
+                         [Status.OK, Status.DUPLICATE])
+        self.assertFalse(os.path.isfile(self.torrent_file))
+        self.assertFalse(os.path.isfile(duplicate_file))
+    
     def test_handle_torrentfile_already_seeded(self):
         for f in self.files:
             self.db.add_file(f, 11)
@@ -242,8 +370,8 @@ class TestAutoTorrent(TestCase):
         for f in self.files[:-1]:
             self.db.add_file(f, 11)
         
-        self.at.add_limit_percent = 50.0
-        self.at.add_limit_size = 12
+        self.at.add_limit_percent = 60.0
+        self.at.add_limit_size = 17 # file_c is in piece 2 to 4, piece 2 is shared with file_b
         
         self.assertEqual(self.at.handle_torrentfile(self.torrent_file), Status.OK)
         self.assertTrue(self._check_at_log(Status.OK))
@@ -258,6 +386,21 @@ class TestAutoTorrent(TestCase):
         p = os.path.join(self.dst, 'test', os.path.basename(self.files[-1]))
         self.assertFalse(os.path.isfile(p))
     
+    def test_handle_torrentfile_missing_pieces(self):
+        for f in self.files[:-1]:
+            self.db.add_file(f, 11)
+        
+        self.at.add_limit_percent = 60.0
+        self.at.add_limit_size = 11 # file_c is 11 bytes but piece 2 is shared with file_b, 17 bytes must be downloaded
+        self.assertEqual(self.at.handle_torrentfile(self.torrent_file), Status.MISSING_FILES)
+        
+        self.at.add_limit_size = 17
+        self.at.add_limit_percent = 50.0
+        self.assertEqual(self.at.handle_torrentfile(self.torrent_file), Status.MISSING_FILES)
+        
+        self.at.add_limit_percent = 52.0
+        self.assertEqual(self.at.handle_torrentfile(self.torrent_file), Status.OK)
+    
     def test_handle_torrentfile_remove_torrent(self):
         for f in self.files:
             self.db.add_file(f, 11)
@@ -271,6 +414,34 @@ class TestAutoTorrent(TestCase):
             p = os.path.join(self.dst, 'test', os.path.basename(f)) # file ends up in a subfolder with torrent name.
             self.assertTrue(os.path.isfile(p))
     
+    def test_handle_torrentfile_verify_pieces(self):
+        for f in self.files:
+            self.db.add_file(f, 11)
+        
+        with open(self.files[1], 'wb') as f:
+            f.write(b'y' * 11)
+        
+        self.at.add_limit_percent = 50.0
+        self.at.add_limit_size = 12
+        self.assertEqual(self.at.handle_torrentfile(self.torrent_file), Status.OK)
+        
+        self.client.hashes = set()
+        self.at.store_path = os.path.join(self._temp_path, 'dst_verify')
+        self.at.verify_pieces = 5
+        self.assertEqual(self.at.handle_torrentfile(self.torrent_file), Status.MISSING_FILES)
+    
+    def test_handle_torrentfiles_verify_pool(self):
+        for f in self.files:
+            self.db.add_file(f, 11)
+        
+        with open(self.files[1], 'wb') as f:
+            f.write(b'y' * 11)
+        
+        self.at.verify_pieces = 5
+        self.at.verify_processes = 2
+        self.assertEqual([status for path, status in self.at.handle_torrentfiles([self.torrent_file])], [Status.MISSING_FILES])
+        self.assertEqual(self.at.verify_pool, None)
+    
     def test_link_files_soft(self):
         self.at.link_files(self.dst, [{
             'completed': True,
@@ -285,6 +456,77 @@ class TestAutoTorrent(TestCase):
         self.at.link_type = 'hard'
         self.test_link_files_soft()
     
+    def test_link_files_reflink(self):
+        try:
+            reflink(self.files[0], os.path.join(self._temp_path, 'reflink-test'))
+        except ReflinkNotSupportedException:
+            raise SkipTest('Reflinks are not supported by the filesystem at %r' % self._temp_path)
+        
+        self.at.link_type = 'reflink'
+        self.test_link_files_soft()
+        
+        for f in self.files:
+            p = os.path.join(self.dst, 'p', os.path.basename(f))
+            self.assertFalse(os.path.islink(p))
+            self.assertNotEqual(os.stat(p).st_ino, os.stat(f).st_ino)
+            with open(p, 'rb') as link, open(f, 'rb') as source:
+                self.assertEqual(link.read(), source.read())
+    
+    def test_link_files_reflink_fallback(self):
+        def failing_reflink(source, destination):
+            raise ReflinkNotSupportedException()
+        
+        from .. import at
+        original_reflink = at.reflink
+        at.reflink = failing_reflink
+        try:
+            self.at.link_type = 'reflink'
+            self.test_link_files_soft()
+        finally:
+            at.reflink = original_reflink
+        
+        for f in self.files:
+            p = os.path.join(self.dst, 'p', os.path.basename(f))
+            self.assertEqual(os.stat(p).st_ino, os.stat(f).st_ino)
+    
+    def test_link_files_workers(self):
+        self.at.link_workers = 4
+        self.at.link_files(self.dst, [{
+            'completed': True,
+            'path': ['p', 'q', os.path.basename(f)],
+            'actual_path': f,
+        } for f in self.files] + [{
+            'completed': False,
+            'path': ['r', 'missing.txt'],
+            'actual_path': None,
+        }])
+        
+        for f in self.files:
+            self.assertTrue(os.path.isfile(os.path.join(self.dst, 'p', 'q', os.path.basename(f))))
+        self.assertFalse(os.path.exists(os.path.join(self.dst, 'r')))
+    
+    def test_link_files_rollback(self):
+        self.at.link_type = 'hard'
+        self.at.link_workers = 2
+        files = [{
+            'completed': True,
+            'path': ['p', os.path.basename(f)],
+            'actual_path': f,
+        } for f in self.files]
+        files[1]['actual_path'] = os.path.join(self.src, 'does-not-exist.txt')
+        
+        destination_path = os.path.join(self.dst, 'rollback')
+        self.assertRaises(OSError, self.at.link_files, destination_path, files)
+        self.assertFalse(os.path.exists(destination_path))
+        
+        os.makedirs(os.path.join(destination_path, 'p'))
+        self.assertRaises(OSError, self.at.link_files, destination_path, files)
+        self.assertEqual(os.listdir(os.path.join(destination_path, 'p')), [])
+    
+    def test_link_files_unknown_type(self):
+        self.at.link_type = 'magic'
+        self.assertRaises(UnknownLinkTypeException, self.at.link_files, self.dst, [])
+    
     def test_index_torrent(self):
         self.actual_db.rebuild()
         self.at.db = self.actual_db
@@ -463,6 +705,99 @@ class TestAutoTorrent(TestCase):
         
         self.assertEqual(listing, expected_listing)
     
+    def test_index_torrent_size_mode(self):
+        os.rename(os.path.join(self.src, 'file_b.txt'), os.path.join(self.src, 'renamed_b.txt'))
+        
+        self.actual_db.rebuild()
+        self.at.db = self.actual_db
+        
+        result = self.at.index_torrent(self.torrent)
+        self.assertEqual([f['completed'] for f in result['files']], [True, False, True])
+        
+        self.actual_db.size_mode = True
+        self.actual_db.size_mode_min_size = 11
+        self.actual_db.rebuild()
+        
+        result = self.at.index_torrent(self.torrent)
+        self.assertEqual([f['actual_path'] for f in result['files']], [os.path.join(self.src, 'file_a.txt'),
+                                                                       os.path.join(self.src, 'renamed_b.txt'),
+                                                                       os.path.join(self.src, 'file_c.txt')])
+        
+        self.actual_db.size_mode_min_size = 12
+        result = self.at.index_torrent(self.torrent)
+        self.assertEqual([f['completed'] for f in result['files']], [True, False, True])
+    
+    def test_index_torrent_size_mode_other_data(self):
+        os.rename(os.path.join(self.src, 'file_b.txt'), os.path.join(self.src, 'renamed_b.txt'))
+        with open(os.path.join(self.src, 'renamed_b.txt'), 'w') as f:
+            f.write(u'y' * 11)
+        
+        self.actual_db.size_mode = True
+        self.actual_db.size_mode_min_size = 11
+        self.actual_db.rebuild()
+        self.at.db = self.actual_db
+        
+        result = self.at.index_torrent(self.torrent)
+        self.assertEqual([f['completed'] for f in result['files']], [True, False, True])
+    
+    def test_index_torrent_size_mode_unsplitable(self):
+        os.rename(os.path.join(self.src, 'Some-Release', 'some-rls.r03'), os.path.join(self.src, 'other-rls.r03'))
+        
+        self.actual_db.size_mode = True
+        self.actual_db.size_mode_min_size = 1
+        self.actual_db.rebuild()
+        self.at.db = self.actual_db
+        
+        with open(os.path.join(self.src, 'Some-Release.torrent'), 'rb') as f:
+            torrent = bdecode(f.read())
+        
+        result = self.at.index_torrent(torrent)
+        self.assertEqual([f['path'] for f in result['files'] if not f['completed']], [['some-rls.r03']])
+    
+    def test_index_torrent_fuzzy_mode(self):
+        os.rename(os.path.join(self.src, 'file_b.txt'), os.path.join(self.src, 'File.B.txt'))
+        
+        self.actual_db.fuzzy_mode = True
+        self.actual_db.fuzzy_mode_min_size = 11
+        self.actual_db.rebuild()
+        self.at.db = self.actual_db
+        
+        result = self.at.index_torrent(self.torrent)
+        self.assertEqual([f['actual_path'] for f in result['files']], [os.path.join(self.src, 'file_a.txt'),
+                                                                       os.path.join(self.src, 'File.B.txt'),
+                                                                       os.path.join(self.src, 'file_c.txt')])
+        
+        self.actual_db.fuzzy_mode_min_size = 12
+        result = self.at.index_torrent(self.torrent)
+        self.assertEqual([f['completed'] for f in result['files']], [True, False, True])
+    
+    def test_index_torrent_fuzzy_mode_other_data(self):
+        os.rename(os.path.join(self.src, 'file_b.txt'), os.path.join(self.src, 'File.B.txt'))
+        with open(os.path.join(self.src, 'File.B.txt'), 'w') as f:
+            f.write(u'y' * 11)
+        
+        self.actual_db.fuzzy_mode = True
+        self.actual_db.fuzzy_mode_min_size = 11
+        self.actual_db.rebuild()
+        self.at.db = self.actual_db
+        
+        result = self.at.index_torrent(self.torrent)
+        self.assertEqual([f['completed'] for f in result['files']], [True, False, True])
+    
+    def test_index_torrent_fuzzy_mode_unsplitable(self):
+        os.rename(os.path.join(self.src, 'Some-Release', 'some-rls.r03'), os.path.join(self.src, 'other-rls.r03'))
+        
+        self.actual_db.fuzzy_mode = True
+        self.actual_db.fuzzy_mode_min_size = 1
+        self.actual_db.rebuild()
+        self.at.db = self.actual_db
+        
+        with open(os.path.join(self.src, 'Some-Release.torrent'), 'rb') as f:
+            torrent = bdecode(f.read())
+        
+        result = self.at.index_torrent(torrent)
+        self.assertEqual([f['path'] for f in result['files'] if not f['completed']], [['some-rls.r03']])
+    
     def test_handle_torrentfile_unsplitable(self):
         self.actual_db.rebuild()
         self.at.db = self.actual_db
@@ -520,6 +855,25 @@ class TestAutoTorrent(TestCase):
         self.assertEqual(self.at.handle_torrentfile(os.path.join(self.src, 'My-DVD.torrent')), Status.OK)
         self.assertEqual(self.client.last_destination_path[len(self._temp_path):].lstrip('/'), 'src/My-DVD')
     
+    def test_index_torrent_exact_mode_symlinked_folder(self):
+        elsewhere = os.path.join(self._temp_path, 'elsewhere')
+        os.makedirs(elsewhere)
+        os.rename(os.path.join(self.src, 'My-DVD'), os.path.join(elsewhere, 'My-DVD'))
+        os.symlink(os.path.join(elsewhere, 'My-DVD'), os.path.join(self.src, 'My-DVD'))
+        
+        self.actual_db.normal_mode = False
+        self.actual_db.unsplitable_mode = False
+        self.actual_db.exact_mode = True
+        self.actual_db.rebuild()
+        self.at.db = self.actual_db
+        
+        with open(os.path.join(self.src, 'My-DVD.torrent'), 'rb') as f:
+            torrent = bdecode(f.read())
+        
+        result = self.at.index_torrent(torrent)
+        self.assertEqual(result['mode'], 'exact')
+        self.assertEqual(result['source_path'], os.path.join(self.src, 'My-DVD'))
+    
     def test_index_torrent_exact_mode(self):
         self.actual_db.exact_mode = True
         self.actual_db.rebuild()
@@ -1,13 +1,21 @@
 from __future__ import unicode_literals
 
+import gzip
 import os
 import shutil
 import tempfile
 
-from io import open
+from io import open, StringIO
 from unittest import TestCase
 
-from ..db import Database
+from six.moves import cPickle as pickle
+
+from .. import db as db_module
+from ..db import (Database, rewrite_prefix, CorruptDatabaseException, DIRECTORY_KEY, META_DEVICE_KEY, META_REBUILD_KEY,
+                  META_VERSION_KEY, OutdatedDatabaseException, SCHEMA_VERSION, SNAPSHOT_FORMAT)
+from ..metrics import Metrics
+from ..progress import RebuildProgress
+from ..throttle import IOThrottle
 
 def create_file(temp_folder, path, size):
     path = os.path.join(temp_folder, *path)
@@ -18,6 +26,13 @@ def create_file(temp_folder, path, size):
     with open(path, 'w') as f:
         f.write(u'x' * size)
 
+class DummyClient(object):
+    def __init__(self, file_lists):
+        self.file_lists = file_lists
+    
+    def get_file_lists(self):
+        return iter(self.file_lists)
+
 class TestDatabase(TestCase):
     def setUp(self):
         self._temp_path = tempfile.mkdtemp()
@@ -48,6 +63,7 @@ class TestDatabase(TestCase):
         self.db.rebuild()
     
     def tearDown(self):
+        self.db.close()
         if self._temp_path.startswith('/tmp'): # paranoid-mon, the best pokemon.
             shutil.rmtree(self._temp_path)
     
@@ -152,4 +168,431 @@ class TestDatabase(TestCase):
         self.assertEqual(self.db.find_exact_file_path('d', 'My-Bluray'), [os.path.join(self._temp_path, '3', 'My-Bluray')])
     
     def test_exact_dvd_release(self):
-        self.assertEqual(self.db.find_exact_file_path('d', 'My-DVD'), [os.path.join(self._temp_path, '3', 'My-DVD')])
\ No newline at end of file
+        self.assertEqual(self.db.find_exact_file_path('d', 'My-DVD'), [os.path.join(self._temp_path, '3', 'My-DVD')])
+    
+    def test_find_many(self):
+        requests = [
+            ('b', 20),
+            ('Some-Release', ['some-rls.r01'], 12),
+            ('missing', 10),
+            ('a', 10),
+            ('Some-CD-Release', ['cd2', 'somestuff-2.r04'], 11),
+            ('a', 10),
+        ]
+        
+        self.assertEqual(self.db.find_many(requests), [
+            os.path.join(self._temp_path, '1', 'b'),
+            os.path.join(self._temp_path, '3', 'Some-Release', 'some-rls.r01'),
+            None,
+            os.path.join(self._temp_path, '1', 'a'),
+            os.path.join(self._temp_path, '3', 'Some-CD-Release', 'CD2', 'somestuff-2.r04'),
+            os.path.join(self._temp_path, '1', 'a'),
+        ])
+        
+        self.assertEqual(self.db.find_many([]), [])
+    
+    def test_exact_entries_have_sizes(self):
+        entries = self.db.find_exact_entries('f', 'a')
+        self.assertEqual([entry[:3] for entry in entries],
+                         [(os.path.join(self._temp_path, '1', 'a'), 10, 1),
+                          (os.path.join(self._temp_path, '1', 'f', 'a'), 12, 1)])
+        
+        path, size, count, mtime = self.db.find_exact_entries('d', 'f')[0]
+        self.assertEqual((path, size, count), (os.path.join(self._temp_path, '1', 'f'), 27, 2))
+        
+        path, size, count, mtime = self.db.find_exact_entries('d', 'Some-Release')[0]
+        self.assertEqual((size, count), (12 * 13, 13))
+    
+    def test_exact_candidates(self):
+        self.assertEqual(self.db.find_exact_candidates('f', 'a', 12),
+                         [os.path.join(self._temp_path, '1', 'f', 'a')])
+        self.assertEqual(self.db.find_exact_candidates('f', 'a', 10),
+                         [os.path.join(self._temp_path, '1', 'a')])
+        self.assertEqual(self.db.find_exact_candidates('f', 'a', 13), [])
+        self.assertEqual(self.db.find_exact_candidates('d', 'Some-Release', 12 * 14, 13), [])
+        self.assertEqual(self.db.find_exact_candidates('d', 'unknown', 1), [])
+        
+        self.assertEqual(self.db.find_exact_candidates('d', '1', 27, 2), [])
+        self.assertEqual(self.db.find_exact_candidates('d', 'f', 12, 1),
+                         [os.path.join(self._temp_path, '1', 'f')])
+    
+    def test_size_index(self):
+        self.db.size_mode = True
+        self.db.size_mode_min_size = 15
+        self.db.rebuild()
+        
+        self.assertEqual(self.db.find_size_file_paths(20), [os.path.join(self._temp_path, '1', 'b')])
+        self.assertEqual(sorted(self.db.find_size_file_paths(15)),
+                         [os.path.join(self._temp_path, '1', 'f', 'c'),
+                          os.path.join(self._temp_path, '2', 'e')])
+        self.assertEqual(self.db.find_size_file_paths(12), [])
+        self.assertEqual(self.db.find_size_file_paths(1000), [])
+    
+    def test_fuzzy_index(self):
+        create_file(self._temp_path, ['2', 'Show.Name.S01E01.mkv'], 30)
+        create_file(self._temp_path, ['2', 'Show.Name.S01E01.720p.mkv'], 30)
+        create_file(self._temp_path, ['2', 'Other.Show.S01E01.mkv'], 30)
+        create_file(self._temp_path, ['2', 'Show.Name.S01E01.avi'], 30)
+        
+        self.db.fuzzy_mode = True
+        self.db.fuzzy_mode_min_size = 15
+        self.db.rebuild()
+        
+        self.assertEqual(self.db.tokenize_filename('Show Name_S01E01.mkv'), set(['show', 'name', 's01e01']))
+        self.assertEqual(self.db.find_fuzzy_file_paths('Show Name S01E01.mkv', 30),
+                         [os.path.join(self._temp_path, '2', 'Show.Name.S01E01.mkv'),
+                          os.path.join(self._temp_path, '2', 'Show.Name.S01E01.720p.mkv'),
+                          os.path.join(self._temp_path, '2', 'Other.Show.S01E01.mkv')])
+        self.assertEqual(self.db.find_fuzzy_file_paths('Show Name S01E01.mkv', 31), [])
+        self.assertEqual(self.db.find_fuzzy_file_paths('Completely Different.mkv', 30), [])
+        self.assertEqual(self.db.find_fuzzy_file_paths('d', 12), [])
+    
+    def test_fuzzy_index_unsplitable(self):
+        self.db.fuzzy_mode = True
+        self.db.fuzzy_mode_min_size = 1
+        self.db.rebuild()
+        
+        self.assertEqual(self.db.find_fuzzy_file_paths('other-rls.r01', 12), [])
+        self.assertEqual(self.db.find_fuzzy_file_paths('somestuff-1.r04', 11), [])
+    
+    def test_ignore_directories(self):
+        self.db.ignore_directories = ['F', 'some-cd-*']
+        self.db.rebuild()
+        
+        self.assertEqual(self.db.find_file_path('c', 15), None)
+        self.assertEqual(self.db.find_exact_file_path('d', 'f'), None)
+        self.assertEqual(self.db.find_unsplitable_file_path('Some-CD-Release', ['CD1', 'somestuff-1.r04'], 11), None)
+        self.assertEqual(self.db.find_file_path('a', 10), os.path.join(self._temp_path, '1', 'a'))
+        self.assertEqual(self.db.find_exact_file_path('d', 'Some-Release'),
+                         [os.path.join(self._temp_path, '3', 'Some-Release')])
+    
+    def test_exclude_paths(self):
+        self.db.exclude_paths = [os.path.join(self._temp_path, '1', 'f'), os.path.join(self._temp_path, '2')]
+        self.db.rebuild()
+        
+        self.assertEqual(self.db.find_file_path('c', 15), None)
+        self.assertEqual(self.db.find_file_path('d', 12), None)
+        self.assertEqual(self.db.find_file_path('a', 10), os.path.join(self._temp_path, '1', 'a'))
+    
+    def test_skip_symlinks(self):
+        os.symlink(os.path.join(self._temp_path, '1', 'b'), os.path.join(self._temp_path, '2', 'linked'))
+        os.symlink(os.path.join(self._temp_path, '1', 'f'), os.path.join(self._temp_path, '2', 'linked_folder'))
+        self.db.rebuild()
+        
+        self.assertEqual(self.db.find_file_path('linked', 20), os.path.join(self._temp_path, '2', 'linked'))
+        self.assertEqual(len(self.db.find_exact_file_path('d', 'linked_folder')), 1)
+        
+        self.db.skip_symlinks = True
+        self.db.rebuild()
+        
+        self.assertEqual(self.db.find_file_path('linked', 20), None)
+        self.assertEqual(self.db.find_exact_file_path('d', 'linked_folder'), None)
+        self.test_initial_build()
+    
+    def test_rebuild_lists_folders_once(self):
+        listed = []
+        list_folder = self.db.list_folder
+        def counting_list_folder(path, listings=None):
+            if not listings or path not in listings:
+                listed.append(path)
+            return list_folder(path, listings)
+        
+        self.db.list_folder = counting_list_folder
+        self.db.rebuild()
+        
+        self.assertEqual(len(listed), len(set(listed)))
+        self.assertIn(os.path.join(self._temp_path, '3', 'Some-CD-Release', 'CD1'), listed)
+        self.test_unsplitable_release_multicd()
+        self.test_initial_build()
+    
+    def test_rebuild_metrics(self):
+        self.db.metrics = Metrics()
+        self.db.rebuild()
+        
+        values = self.db.metrics.values
+        self.assertEqual(values[('autotorrent_rebuild_files', (('disk', os.path.join(self._temp_path, '2')), ))], 2)
+        self.assertEqual(values[('autotorrent_rebuild_bytes', (('disk', os.path.join(self._temp_path, '2')), ))], 27)
+        self.assertEqual(values[('autotorrent_database_keys', ())], len(self.db.db) + sum(len(shard.db) for shard in self.db.shards.values()))
+        self.assertTrue(values[('autotorrent_database_size_bytes', ())] > 0)
+    
+    def test_rebuild_symlinked_folder(self):
+        os.makedirs(os.path.join(self._temp_path, '2', 'h'))
+        os.symlink(os.path.join(self._temp_path, '1', 'f'), os.path.join(self._temp_path, '2', 'h', 'g'))
+        self.db.metrics = Metrics()
+        self.db.rebuild()
+        
+        self.assertEqual(self.db.find_exact_candidates('d', 'g', 27, 2), [os.path.join(self._temp_path, '2', 'h', 'g')])
+        self.assertEqual(self.db.find_exact_candidates('d', 'h', 27, 2), [os.path.join(self._temp_path, '2', 'h')])
+        self.assertEqual(self.db.metrics.values[('autotorrent_rebuild_bytes', (('disk', os.path.join(self._temp_path, '2')), ))], 27)
+    
+    def test_rebuild_resume(self):
+        stop_path = os.path.join(self._temp_path, '3', 'My-DVD')
+        scan_folder = self.db.scan_folder
+        def crashing_scan_folder(path, *args, **kwargs):
+            if path == stop_path:
+                raise KeyboardInterrupt()
+            return scan_folder(path, *args, **kwargs)
+        
+        checkpoint_interval = db_module.CHECKPOINT_INTERVAL
+        db_module.CHECKPOINT_INTERVAL = 0
+        try:
+            self.db.scan_folder = crashing_scan_folder
+            self.assertRaises(KeyboardInterrupt, self.db.rebuild)
+            del self.db.scan_folder
+        finally:
+            db_module.CHECKPOINT_INTERVAL = checkpoint_interval
+        
+        checkpoint = self.db.db[META_REBUILD_KEY]
+        finished = checkpoint['disks'][os.path.join(self._temp_path, '3')]
+        self.assertEqual(len(checkpoint['finished_disks']), 2)
+        self.assertNotIn('My-DVD', finished)
+        
+        listed = []
+        list_folder = self.db.list_folder
+        def counting_list_folder(path, listings=None):
+            listed.append(path)
+            return list_folder(path, listings)
+        self.db.list_folder = counting_list_folder
+        
+        self.db.rebuild()
+        
+        self.assertNotIn(os.path.join(self._temp_path, '1'), listed)
+        self.assertIn(stop_path, listed)
+        for d in finished:
+            self.assertNotIn(os.path.join(self._temp_path, '3', d), listed)
+        self.assertNotIn(META_REBUILD_KEY, self.db.db)
+        
+        self.test_initial_build()
+        self.test_unsplitable_release()
+        self.test_unsplitable_release_multicd()
+        self.test_exact_release()
+        self.assertEqual(len(self.db.find_exact_entries('f', 'Some-Release.torrent')), 1)
+        self.test_exact_entries_have_sizes()
+    
+    def test_rebuild_resume_subfolder(self):
+        create_file(self._temp_path, ['2', 'g', 'h', 'x'], 10)
+        create_file(self._temp_path, ['2', 'g', 'i', 'y'], 11)
+        self.db.rebuild()
+        expected_counts = list(self.db.progress.counts[os.path.join(self._temp_path, '2')])
+        
+        parent_path = os.path.join(self._temp_path, '2', 'g')
+        entered = []
+        scan_folder = self.db.scan_folder
+        def crashing_scan_folder(path, *args, **kwargs):
+            if os.path.dirname(path) == parent_path:
+                entered.append(path)
+                if len(entered) == 2:
+                    raise KeyboardInterrupt()
+            return scan_folder(path, *args, **kwargs)
+        
+        checkpoint_interval = db_module.CHECKPOINT_INTERVAL
+        db_module.CHECKPOINT_INTERVAL = 0
+        try:
+            self.db.scan_folder = crashing_scan_folder
+            self.assertRaises(KeyboardInterrupt, self.db.rebuild)
+            del self.db.scan_folder
+        finally:
+            db_module.CHECKPOINT_INTERVAL = checkpoint_interval
+        
+        finished = self.db.db[META_REBUILD_KEY]['disks'][os.path.join(self._temp_path, '2')]
+        self.assertEqual(list(finished['g']), [os.path.basename(entered[0])])
+        
+        listed = []
+        list_folder = self.db.list_folder
+        def counting_list_folder(path, listings=None):
+            listed.append(path)
+            return list_folder(path, listings)
+        self.db.list_folder = counting_list_folder
+        
+        self.db.rebuild()
+        
+        self.assertNotIn(entered[0], listed)
+        self.assertIn(entered[1], listed)
+        self.assertEqual(self.db.progress.counts[os.path.join(self._temp_path, '2')], expected_counts)
+        self.assertEqual(self.db.find_file_path('x', 10), os.path.join(self._temp_path, '2', 'g', 'h', 'x'))
+        self.assertEqual(self.db.find_file_path('y', 11), os.path.join(self._temp_path, '2', 'g', 'i', 'y'))
+    
+    def test_rebuild_settings_changed(self):
+        self.db.db[META_REBUILD_KEY] = {'signature': self.db.get_rebuild_signature(self.db.paths), 'disks': {}, 'finished_disks': {
+            os.path.join(self._temp_path, '1'): (2, 4)}}
+        self.db.ignore_files = ['*.nfo']
+        self.db.rebuild()
+        self.test_initial_build()
+    
+    def test_rebuild_no_resume(self):
+        self.db.db[META_REBUILD_KEY] = {'signature': self.db.get_rebuild_signature(self.db.paths), 'disks': {}, 'finished_disks': {
+            os.path.join(self._temp_path, '1'): (2, 4)}}
+        self.db.rebuild(resume=False)
+        self.test_initial_build()
+    
+    def test_rebuild_progress(self):
+        out = StringIO()
+        progress = RebuildProgress(out, interval=0)
+        self.db.rebuild(progress)
+        
+        self.assertEqual(progress.counts[os.path.join(self._temp_path, '1')], [2, 4])
+        self.assertIn('ETA', out.getvalue())
+        
+        out = StringIO()
+        self.db.rebuild(RebuildProgress(out, interval=0))
+        self.assertIn('Scanning disk 1 of 3 100%: 2 folders, 4 files', out.getvalue())
+    
+    def test_rebuild_throttled(self):
+        throttles = []
+        def create_throttle():
+            throttle = IOThrottle(1000, sleep=lambda seconds: None)
+            throttles.append(throttle)
+            return throttle
+        
+        self.db.create_throttle = create_throttle
+        self.db.rebuild()
+        
+        self.assertEqual(len(throttles), 3)
+        self.assertTrue(throttles[0].tokens < 1000)
+        self.test_initial_build()
+    
+    def test_keyify(self):
+        key = self.db.keyify(10, 'a')
+        self.assertEqual(len(key), 17)
+        self.assertEqual(key[0], '\x00')
+        self.assertEqual(key, self.db.keyify(10, 'a'))
+        self.assertNotEqual(key, self.db.keyify(11, 'a'))
+    
+    def test_load_directories(self):
+        shard = self.db.shards[os.path.join(self._temp_path, '1')]
+        directory_paths = dict(shard._directory_paths)
+        self.assertEqual(len(directory_paths), 2)
+        
+        shard.load_directories()
+        self.assertEqual(shard._directory_paths, directory_paths)
+        self.assertEqual(shard._directory_ids, dict((path, directory_id) for directory_id, path in directory_paths.items()))
+    
+    def test_load_directories_missing(self):
+        shard = self.db.shards[os.path.join(self._temp_path, '3')]
+        del shard.db[DIRECTORY_KEY % 1]
+        self.assertRaises(CorruptDatabaseException, shard.load_directories)
+    
+    def test_schema_version(self):
+        self.assertFalse(self.db.is_outdated())
+        self.db.check_version()
+        
+        del self.db.db[META_VERSION_KEY]
+        self.assertTrue(self.db.is_outdated())
+        self.assertRaises(OutdatedDatabaseException, self.db.check_version)
+        
+        self.db.rebuild()
+        self.assertFalse(self.db.is_outdated())
+    
+    def test_reopen(self):
+        self.db.close()
+        self.db = Database(self.db.db_file, self.db.paths, [], True, True, True)
+        
+        self.assertFalse(self.db.is_outdated())
+        self.test_initial_build()
+        self.test_exact_release()
+    
+    def test_rebuild_disk(self):
+        create_file(self._temp_path, ['1', 'g'], 11)
+        create_file(self._temp_path, ['2', 'g'], 13)
+        
+        self.db.rebuild(disks=[os.path.join(self._temp_path, '2')])
+        
+        self.assertEqual(self.db.find_file_path('g', 13), os.path.join(self._temp_path, '2', 'g'))
+        self.assertEqual(self.db.find_file_path('g', 11), None)
+        self.test_initial_build()
+        self.test_exact_release()
+    
+    def test_rebuild_disk_outdated(self):
+        del self.db.db[META_VERSION_KEY]
+        self.assertRaises(OutdatedDatabaseException, self.db.rebuild, disks=[os.path.join(self._temp_path, '2')])
+    
+    def test_offline_disk(self):
+        self.db.shards[os.path.join(self._temp_path, '1')].db[META_DEVICE_KEY] = -1
+        self.db._online_shards = None
+        
+        self.assertEqual(self.db.find_file_path('a', 10), None)
+        self.assertEqual(self.db.find_file_path('d', 12), os.path.join(self._temp_path, '2', 'd'))
+    
+    def test_disk_priority(self):
+        create_file(self._temp_path, ['2', 'a'], 10)
+        self.db.rebuild()
+        
+        self.assertEqual(self.db.find_file_path('a', 10), os.path.join(self._temp_path, '1', 'a'))
+    
+    def test_rewrite_prefix(self):
+        self.assertEqual(rewrite_prefix('/data/disk1/a', [('/data/', '/mnt/node1')]), '/mnt/node1/disk1/a')
+        self.assertEqual(rewrite_prefix('/data', [('/data', '/mnt/node1')]), '/mnt/node1')
+        self.assertEqual(rewrite_prefix('/database/a', [('/data', '/mnt/node1')]), '/database/a')
+    
+    def test_export_import_index(self):
+        snapshot = os.path.join(self._temp_path, 'snapshot.gz')
+        self.db.export_index(snapshot, [(self._temp_path, '/mnt/node1')])
+        
+        frontend_path = os.path.join(self._temp_path, 'frontend')
+        os.makedirs(frontend_path)
+        frontend = Database(os.path.join(frontend_path, 'autotorrent.db'), [], [], True, True, True)
+        frontend.import_index(snapshot)
+        frontend.import_index(snapshot)
+        
+        self.assertEqual(len(frontend.shards), 3)
+        self.assertEqual(frontend.find_file_path('a', 10), '/mnt/node1/1/a')
+        self.assertEqual(frontend.find_file_path('d', 12), '/mnt/node1/2/d')
+        self.assertEqual(frontend.find_exact_file_path('d', 'Some-Release'), ['/mnt/node1/3/Some-Release'])
+        
+        frontend.rebuild()
+        frontend.close()
+        
+        frontend = Database(frontend.db_file, [], [], True, True, True)
+        self.assertFalse(frontend.is_outdated())
+        self.assertEqual(frontend.find_file_path('a', 10), '/mnt/node1/1/a')
+        frontend.close()
+    
+    def test_import_index_refuses_code(self):
+        marker = os.path.join(self._temp_path, 'marker')
+        create_file(self._temp_path, ['marker'], 1)
+        
+        class RemoveMarker(object):
+            def __reduce__(self):
+                return (os.remove, (marker, ))
+        
+        snapshot = os.path.join(self._temp_path, 'snapshot.gz')
+        with gzip.open(snapshot, 'wb') as f:
+            pickle.dump({'format': SNAPSHOT_FORMAT, 'version': SCHEMA_VERSION, 'disks': ['/mnt/node1']}, f, 2)
+            pickle.dump(('key', RemoveMarker()), f, 2)
+        
+        self.assertRaises(pickle.UnpicklingError, self.db.import_index, snapshot)
+        self.assertTrue(os.path.isfile(marker))
+    
+    def test_index_client(self):
+        file_lists = []
+        for disk in ['1', '2', '3']:
+            disk_path = os.path.join(self._temp_path, disk)
+            for name in sorted(os.listdir(disk_path)):
+                root = os.path.join(disk_path, name)
+                if os.path.isdir(root):
+                    files = []
+                    for dirpath, dirnames, filenames in os.walk(root):
+                        files += [(os.path.join(dirpath, f), os.path.getsize(os.path.join(dirpath, f))) for f in filenames]
+                else:
+                    files = [(root, os.path.getsize(root))]
+                file_lists.append((root, files))
+        file_lists.append((os.path.join(self._temp_path, 'store', 'a'), [(os.path.join(self._temp_path, 'store', 'a'), 11)]))
+        
+        for disk in ['1', '2', '3']: # the files are not touched
+            shutil.rmtree(os.path.join(self._temp_path, disk))
+        
+        client_path = os.path.join(self._temp_path, 'client')
+        os.makedirs(client_path)
+        self.db.close()
+        self.db = Database(os.path.join(client_path, 'autotorrent.db'), [], [], True, True, True,
+                           exclude_paths=[os.path.join(self._temp_path, 'store')])
+        torrent_count, file_count = self.db.index_client(DummyClient(file_lists))
+        self.assertEqual(torrent_count, len(file_lists) - 1)
+        self.assertEqual(file_count, sum(len(files) for root, files in file_lists[:-1]))
+        
+        self.test_initial_build()
+        self.assertEqual(self.db.find_file_path('a', 11), None)
+        self.test_unsplitable_release()
+        self.test_unsplitable_release_multicd()
+        self.test_exact_release()
+        self.test_exact_entries_have_sizes()
@@ -0,0 +1,80 @@
+from __future__ import unicode_literals
+
+from unittest import TestCase, skipIf
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from ..filetable import TorrentFileTable
+
+class TestTorrentFileTable(TestCase):
+    def setUp(self):
+        self.files = [
+            {'path': ['a', 'file_a.txt'], 'length': 11, 'actual_path': '/tmp/file_a.txt', 'completed': True},
+            {'path': ['file_b.txt'], 'length': 12, 'actual_path': None, 'completed': False},
+            {'path': ['file_c.txt'], 'length': 2**40, 'actual_path': '/tmp/file_c.txt', 'completed': True},
+        ]
+        self.table = TorrentFileTable.from_files(self.files)
+
+    def test_rows(self):
+        self.assertEqual(len(self.table), 3)
+        self.assertEqual(self.table, self.files)
+        self.assertEqual(self.table[0]['path'], ['a', 'file_a.txt'])
+        self.assertEqual(self.table[-1]['length'], 2**40)
+        self.assertEqual(self.table[1].index, 1)
+        self.assertRaises(IndexError, lambda: self.table[3])
+        self.assertRaises(KeyError, lambda: self.table[0]['missing'])
+
+    def test_set_item(self):
+        self.table[1]['actual_path'] = '/tmp/file_b.txt'
+        self.table[1]['completed'] = True
+        self.table[0]['path'] = ['b', 'file_a.txt']
+
+        self.assertEqual(self.table.actual_paths[1], '/tmp/file_b.txt')
+        self.assertTrue(self.table[1]['completed'])
+        self.assertEqual(self.table.paths[0], 'b/file_a.txt')
+
+    def test_set_actual_path(self):
+        self.table.set_actual_path(0, None)
+        self.assertFalse(self.table[0]['completed'])
+
+        self.table.set_actual_path(1, '/tmp/file_b.txt')
+        self.assertTrue(self.table[1]['completed'])
+
+    def test_sizes(self):
+        self.assertEqual(self.table.sizes(), (11 + 2**40, 12))
+
+    @skipIf(tracemalloc is None, 'tracemalloc not available')
+    def test_memory_usage(self):
+        count = 20000
+
+        def measure(build):
+            tracemalloc.start()
+            try:
+                result = build()
+                return tracemalloc.get_traced_memory()[0], result
+            finally:
+                tracemalloc.stop()
+
+        def build_dicts():
+            return [{
+                'path': ['Season 1', 'Some.Show.S01E%05i.mkv' % i],
+                'length': 1000000 + i,
+                'actual_path': '/mnt/disk1/Some.Show/Some.Show.S01E%05i.mkv' % i,
+                'completed': True,
+            } for i in range(count)]
+
+        def build_table():
+            table = TorrentFileTable()
+            for i in range(count):
+                table.append(['Season 1', 'Some.Show.S01E%05i.mkv' % i], 1000000 + i,
+                             '/mnt/disk1/Some.Show/Some.Show.S01E%05i.mkv' % i, True)
+            return table
+
+        dict_memory, dicts = measure(build_dicts)
+        table_memory, table = measure(build_table)
+
+        self.assertEqual(len(table), len(dicts))
+        self.assertTrue(table_memory * 3 < dict_memory * 2, 'table used %s bytes, dicts used %s bytes' % (table_memory, dict_memory))
@@ -0,0 +1,54 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from io import open
+from unittest import TestCase
+
+from ..metrics import Metrics, NullMetrics
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self._temp_path = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        if self._temp_path.startswith('/tmp'): # paranoid-mon, the best pokemon.
+            shutil.rmtree(self._temp_path)
+    
+    def test_render(self):
+        metrics = Metrics(config='site-x')
+        metrics.inc('autotorrent_torrents', status='ok')
+        metrics.inc('autotorrent_torrents', status='ok')
+        metrics.inc('autotorrent_torrents', status='missing_files')
+        metrics.set('autotorrent_rebuild_files', 10, disk='/mnt/"disk1"')
+        
+        text = metrics.render()
+        self.assertIn('# TYPE autotorrent_torrents gauge\n', text)
+        self.assertIn('autotorrent_torrents{config="site-x",status="ok"} 2\n', text)
+        self.assertIn('autotorrent_torrents{config="site-x",status="missing_files"} 1\n', text)
+        self.assertIn('autotorrent_rebuild_files{config="site-x",disk="/mnt/\\"disk1\\""} 10\n', text)
+    
+    def test_unknown_metric(self):
+        self.assertRaises(KeyError, Metrics().inc, 'autotorrent_unknown')
+    
+    def test_write(self):
+        path = os.path.join(self._temp_path, 'autotorrent.prom')
+        with open(path, 'w') as f:
+            f.write('old')
+        
+        metrics = Metrics()
+        metrics.inc('autotorrent_found_bytes', 100)
+        metrics.write(path)
+        
+        with open(path) as f:
+            text = f.read()
+        self.assertIn('autotorrent_found_bytes 100\n', text)
+        self.assertIn('autotorrent_last_run_timestamp_seconds ', text)
+        self.assertEqual(os.listdir(self._temp_path), ['autotorrent.prom'])
+    
+    def test_null_metrics(self):
+        metrics = NullMetrics()
+        metrics.inc('autotorrent_unknown')
+        metrics.set('autotorrent_unknown', 1)
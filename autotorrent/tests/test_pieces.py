@@ -0,0 +1,61 @@
+from __future__ import unicode_literals
+
+from unittest import TestCase
+
+from ..filetable import TorrentFileTable
+from ..pieces import PieceMap, get_piece_map
+
+class TestPieceMap(TestCase):
+    def setUp(self):
+        self.files = [
+            {'path': ['a'], 'length': 11, 'actual_path': 'a', 'completed': True},
+            {'path': ['b'], 'length': 11, 'actual_path': None, 'completed': False},
+            {'path': ['empty'], 'length': 0, 'actual_path': None, 'completed': False},
+            {'path': ['c'], 'length': 11, 'actual_path': 'c', 'completed': True},
+        ]
+    
+    def test_mapping(self):
+        piece_map = PieceMap(8, self.files)
+        self.assertEqual(piece_map.piece_count, 5)
+        self.assertEqual(piece_map.total_length, 33)
+        self.assertEqual(list(piece_map.first_pieces), [0, 1, 2, 2])
+        self.assertEqual(list(piece_map.last_pieces), [1, 2, 1, 4])
+        self.assertEqual(piece_map.piece_size(4), 1)
+        self.assertEqual(piece_map.files_in_piece(2), [1, 3])
+        self.assertEqual(piece_map.segments(2), [(None, 5, 6), ('c', 0, 2)])
+    
+    def test_availability(self):
+        availability = PieceMap(8, self.files).availability()
+        self.assertFalse(availability.is_complete)
+        self.assertEqual(list(availability.missing), [0, 1, 1, 0, 0])
+        self.assertEqual(availability.satisfiable_pieces, 3)
+        self.assertEqual(availability.missing_pieces, 2)
+        self.assertEqual(availability.boundary_pieces, [1, 2])
+        self.assertEqual(availability.download_size, 16)
+        self.assertEqual(availability.bitfield(), b'\x98')
+    
+    def test_availability_complete(self):
+        self.files[1]['completed'] = True
+        availability = PieceMap(8, self.files).availability()
+        self.assertTrue(availability.is_complete)
+        self.assertEqual(availability.boundary_pieces, [])
+        self.assertEqual(availability.download_size, 0)
+        self.assertEqual(availability.bitfield(), b'\xf8')
+    
+    def test_availability_last_piece(self):
+        self.files[3]['completed'] = False
+        availability = PieceMap(8, self.files).availability()
+        self.assertEqual(availability.download_size, 8 + 8 + 8 + 1)
+        self.assertEqual(availability.boundary_pieces, [1])
+    
+    def test_get_piece_map(self):
+        torrent = {b'info': {b'piece length': 8}}
+        table = TorrentFileTable.from_files(self.files)
+        
+        piece_map = get_piece_map(torrent, table)
+        self.assertTrue(get_piece_map(torrent, table) is piece_map)
+        
+        table.set_actual_path(1, 'b')
+        self.assertTrue(piece_map.availability().is_complete)
+        
+        self.assertFalse(get_piece_map(torrent, self.files) is get_piece_map(torrent, self.files))
@@ -0,0 +1,79 @@
+from __future__ import unicode_literals
+
+import os
+import pstats
+import shutil
+import tempfile
+
+from io import StringIO
+from unittest import TestCase
+
+from .. import profiler as profiler_module
+from ..profiler import NullProfiler, Profiler
+
+class TestProfiler(TestCase):
+    def setUp(self):
+        self._temp_path = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        if self._temp_path.startswith('/tmp'): # paranoid-mon, the best pokemon.
+            shutil.rmtree(self._temp_path)
+    
+    def test_phases(self):
+        profiler = Profiler()
+        for i in range(3):
+            with profiler.phase('match'):
+                pass
+        with profiler.phase('link'):
+            pass
+        
+        self.assertEqual(profiler.phases, ['match', 'link'])
+        self.assertEqual(profiler.timings['match'][0], 3)
+        self.assertEqual(profiler.timings['link'][0], 1)
+        
+        out = StringIO()
+        profiler.report(out)
+        self.assertIn('match', out.getvalue())
+    
+    def test_nested_phases(self):
+        clock = iter([0.0, 1.0, 3.0, 4.0])
+        original_timer = profiler_module.default_timer
+        profiler_module.default_timer = lambda: next(clock)
+        try:
+            profiler = Profiler()
+            with profiler.phase('match'):
+                with profiler.phase('verify'):
+                    pass
+        finally:
+            profiler_module.default_timer = original_timer
+        
+        self.assertEqual(profiler.timings['match'][1], 2.0)
+        self.assertEqual(profiler.timings['verify'][1], 2.0)
+        self.assertEqual(profiler.running, [])
+    
+    def test_phase_on_error(self):
+        profiler = Profiler()
+        try:
+            with profiler.phase('link'):
+                raise ValueError()
+        except ValueError:
+            pass
+        
+        self.assertEqual(profiler.timings['link'][0], 1)
+    
+    def test_stats_file(self):
+        stats_file = os.path.join(self._temp_path, 'autotorrent.pstats')
+        profiler = Profiler(stats_file)
+        profiler.start()
+        sorted(range(1000))
+        profiler.stop()
+        
+        self.assertTrue(pstats.Stats(stats_file).total_calls > 0)
+    
+    def test_null_profiler(self):
+        profiler = NullProfiler()
+        with profiler.phase('match'):
+            pass
+        profiler.start()
+        profiler.stop()
+        profiler.report()
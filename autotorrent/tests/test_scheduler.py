@@ -0,0 +1,97 @@
+from __future__ import division
+
+from unittest import TestCase
+
+from ..clients.multi import MultiClient
+from ..scheduler import AddScheduler, DEFAULT_MAX_WAIT, MAX_POLL_INTERVAL, NO_WAIT_LIMIT
+from .test_throttle import FakeClock
+
+class DummyClient(object):
+    def __init__(self, clock, checking, latency=0.0):
+        self.clock = clock
+        self.checking = list(checking)
+        self.latency = latency
+        self.calls = 0
+    
+    def ping(self):
+        self.clock.now += self.latency
+        return 'pong'
+    
+    def get_checking_count(self):
+        self.calls += 1
+        if len(self.checking) > 1:
+            return self.checking.pop(0)
+        return self.checking[0]
+
+class TestAddScheduler(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+    
+    def test_not_busy(self):
+        scheduler = AddScheduler(DummyClient(self.clock, [1]), max_checking=2, clock=self.clock, sleep=self.clock.sleep)
+        self.assertEqual(scheduler.wait(), 0)
+        self.assertEqual(self.clock.sleeps, [])
+    
+    def test_checking(self):
+        scheduler = AddScheduler(DummyClient(self.clock, [5, 3, 2, 1]), max_checking=2, clock=self.clock, sleep=self.clock.sleep)
+        self.assertEqual(scheduler.wait(), 7)
+        self.assertEqual(self.clock.sleeps, [1, 2, 4])
+        self.assertEqual(scheduler.slept, 7)
+    
+    def test_check_interval(self):
+        client = DummyClient(self.clock, [1])
+        scheduler = AddScheduler(client, max_checking=3, clock=self.clock, sleep=self.clock.sleep)
+        self.assertEqual(scheduler.wait(), 0)
+        self.assertEqual(scheduler.wait(), 0)
+        self.assertEqual(client.calls, 1)
+        
+        self.assertEqual(scheduler.wait(), 1) # the two torrents added count as checking
+        self.assertEqual(client.calls, 2)
+        
+        self.clock.now += scheduler.check_interval
+        self.assertEqual(scheduler.wait(), 0)
+        self.assertEqual(client.calls, 3)
+    
+    def test_max_poll_interval(self):
+        scheduler = AddScheduler(DummyClient(self.clock, [5] * 10 + [0]), max_checking=2, clock=self.clock, sleep=self.clock.sleep)
+        scheduler.wait()
+        self.assertEqual(max(self.clock.sleeps), MAX_POLL_INTERVAL)
+    
+    def test_max_wait(self):
+        scheduler = AddScheduler(DummyClient(self.clock, [5]), max_checking=2, max_wait=10, clock=self.clock, sleep=self.clock.sleep)
+        self.assertEqual(scheduler.wait(), 15)
+    
+    def test_default_max_wait(self):
+        scheduler = AddScheduler(DummyClient(self.clock, [5]), max_checking=2, clock=self.clock, sleep=self.clock.sleep)
+        waited = scheduler.wait()
+        self.assertTrue(DEFAULT_MAX_WAIT <= waited < DEFAULT_MAX_WAIT + MAX_POLL_INTERVAL)
+    
+    def test_no_wait_limit(self):
+        scheduler = AddScheduler(DummyClient(self.clock, [5] * 30 + [0]), max_checking=2, max_wait=NO_WAIT_LIMIT,
+                                 clock=self.clock, sleep=self.clock.sleep)
+        self.assertTrue(scheduler.wait() > DEFAULT_MAX_WAIT)
+    
+    def test_latency(self):
+        client = DummyClient(self.clock, [0], latency=0.5)
+        scheduler = AddScheduler(client, max_latency=1.0, clock=self.clock, sleep=self.clock.sleep)
+        scheduler.get_load(client).average_latency = 2.0 # the client was slow to answer before
+        self.assertEqual(scheduler.wait(), 15)
+        self.assertTrue(scheduler.get_load(client).average_latency <= 1.0)
+        self.assertEqual(client.calls, 0) # the checking torrents are only fetched with max_checking
+    
+    def test_multi_client(self):
+        busy = DummyClient(self.clock, [5])
+        idle = DummyClient(self.clock, [0])
+        client = MultiClient([('busy', busy), ('idle', idle)], lambda instances: instances[1])
+        
+        scheduler = AddScheduler(client, max_checking=2, clock=self.clock, sleep=self.clock.sleep)
+        self.assertEqual(scheduler.wait(), 0)
+        self.assertEqual(busy.calls, 0)
+    
+    def test_client_error(self):
+        class BrokenClient(object):
+            def get_checking_count(self):
+                raise IOError('Connection refused')
+        
+        scheduler = AddScheduler(BrokenClient(), max_checking=2, clock=self.clock, sleep=self.clock.sleep)
+        self.assertEqual(scheduler.wait(), 0)
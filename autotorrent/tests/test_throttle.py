@@ -0,0 +1,63 @@
+from __future__ import division
+
+import os
+
+from unittest import TestCase
+
+from ..throttle import IOThrottle
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+    
+    def __call__(self):
+        return self.now
+    
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class TestIOThrottle(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+    
+    def test_ops_per_second(self):
+        throttle = IOThrottle(10, clock=self.clock, sleep=self.clock.sleep)
+        for i in range(30):
+            throttle.wait()
+        
+        self.assertEqual(self.clock.sleeps[0], 0.1)
+        self.assertAlmostEqual(self.clock.now, 2.0)
+        self.assertAlmostEqual(throttle.slept, 2.0)
+    
+    def test_refill(self):
+        throttle = IOThrottle(10, clock=self.clock, sleep=self.clock.sleep)
+        for i in range(10):
+            throttle.wait()
+        self.clock.now += 1
+        for i in range(10):
+            throttle.wait()
+        
+        self.assertEqual(self.clock.sleeps, [])
+    
+    def test_backoff(self):
+        throttle = IOThrottle(max_latency=0.01, clock=self.clock, sleep=self.clock.sleep)
+        throttle.wait()
+        self.assertEqual(self.clock.sleeps, [])
+        
+        for i in range(10):
+            throttle.record_latency(0.1)
+        throttle.wait()
+        self.assertEqual(len(self.clock.sleeps), 1)
+        self.assertTrue(0.5 < self.clock.sleeps[0] <= 1.0)
+        
+        for i in range(50):
+            throttle.record_latency(0.001)
+        throttle.wait()
+        self.assertEqual(len(self.clock.sleeps), 1)
+    
+    def test_stat(self):
+        throttle = IOThrottle(max_latency=0.01)
+        self.assertEqual(throttle.stat(__file__).st_size, os.stat(__file__).st_size)
+        self.assertTrue(throttle.average_latency > 0)
@@ -0,0 +1,86 @@
+from __future__ import unicode_literals
+
+import os
+import random
+import shutil
+import tempfile
+
+from io import open
+from multiprocessing.pool import ThreadPool
+from unittest import TestCase
+
+from ..bencode import bdecode
+from ..pieces import PieceMap
+from ..verify import hash_piece, sample_pieces, verify_files
+
+current_path = os.path.join(os.path.dirname(__file__), 'testfiles')
+
+class TestVerify(TestCase):
+    def setUp(self):
+        self._temp_path = tempfile.mkdtemp()
+
+        with open(os.path.join(current_path, 'test.torrent'), 'rb') as f:
+            self.torrent = bdecode(f.read())
+
+        self.files = []
+        for letter in ['a', 'b', 'c']:
+            filename = 'file_%s.txt' % letter
+            path = os.path.join(self._temp_path, filename)
+            shutil.copy(os.path.join(current_path, filename), path)
+            self.files.append({
+                'actual_path': path,
+                'completed': True,
+                'length': 11,
+                'path': [filename],
+            })
+
+    def tearDown(self):
+        if self._temp_path.startswith('/tmp'): # paranoid-mon, the best pokemon.
+            shutil.rmtree(self._temp_path)
+
+    def test_hash_piece(self):
+        piece_map = PieceMap(8, self.files)
+        pieces = self.torrent[b'info'][b'pieces']
+        for piece in range(5):
+            self.assertEqual(hash_piece(piece_map.segments(piece)), pieces[piece*20:(piece+1)*20])
+
+    def test_sample_pieces(self):
+        piece_map = PieceMap(1, self.files)
+        pieces = sample_pieces(piece_map, 3, random.Random(1))
+        self.assertEqual(len(pieces), 5)
+        self.assertEqual(pieces[0], 0)
+        self.assertEqual(pieces[-1], 32)
+
+        self.files[0]['completed'] = False
+        self.files[2]['completed'] = False
+        self.assertEqual(sample_pieces(piece_map, 20), list(range(11, 22)))
+
+    def test_verify_files(self):
+        self.assertEqual(verify_files(self.torrent, self.files, 10), [])
+        self.assertTrue(all(f['completed'] for f in self.files))
+
+    def test_verify_files_corrupt(self):
+        with open(self.files[2]['actual_path'], 'wb') as f:
+            f.write(b'y' * 11)
+
+        self.assertEqual(verify_files(self.torrent, self.files, 10, processes=2), [2, 3, 4])
+        self.assertEqual([f['completed'] for f in self.files], [True, False, False])
+        self.assertEqual(self.files[2]['actual_path'], None)
+
+    def test_verify_files_missing_file(self):
+        os.remove(self.files[0]['actual_path'])
+
+        self.assertEqual(verify_files(self.torrent, self.files, 10), [0, 1])
+        self.assertEqual([f['completed'] for f in self.files], [False, False, True])
+
+    def test_verify_files_pool(self):
+        with open(self.files[2]['actual_path'], 'wb') as f:
+            f.write(b'y' * 11)
+
+        pool = ThreadPool(2)
+        try:
+            self.assertEqual(verify_files(self.torrent, self.files, 10, pool=pool), [2, 3, 4])
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual([f['completed'] for f in self.files], [True, False, False])
@@ -0,0 +1,121 @@
+from __future__ import division
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import platform
+import time
+
+from timeit import default_timer
+
+__all__ = [
+    'IOThrottle',
+    'NullThrottle',
+    'set_idle_io_priority',
+]
+
+logger = logging.getLogger(__name__)
+
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+IOPRIO_SET_SYSCALLS = {
+    'x86_64': 251,
+    'i386': 289,
+    'i686': 289,
+    'aarch64': 30,
+    'armv7l': 314,
+    'ppc64le': 273,
+}
+
+MAX_BACKOFF_DELAY = 1.0
+
+class NullThrottle(object):
+    """
+    Throttle used when scanning is not limited, does nothing.
+    """
+    enabled = False
+    
+    def wait(self):
+        pass
+    
+    stat = staticmethod(os.stat)
+
+class IOThrottle(object):
+    """
+    Limits the metadata operations made on a disk while rebuilding.
+    
+    ops_per_second is enforced with a token bucket allowing bursts of one second worth of operations.
+    If max_latency is set and the average stat latency rises above it, the scanner backs off
+    by sleeping in proportion to the latency, giving the disk to the torrent clients.
+    """
+    enabled = True
+    
+    def __init__(self, ops_per_second=0, max_latency=0, clock=default_timer, sleep=time.sleep):
+        self.ops_per_second = ops_per_second
+        self.max_latency = max_latency
+        self.clock = clock
+        self.sleep = sleep
+        
+        self.tokens = ops_per_second
+        self.last_refill = clock()
+        self.average_latency = 0.0
+        self.slept = 0.0
+    
+    def wait(self):
+        """
+        Waits until another operation is allowed.
+        """
+        if self.ops_per_second:
+            now = self.clock()
+            self.tokens = min(self.tokens + (now - self.last_refill) * self.ops_per_second, self.ops_per_second)
+            self.last_refill = now
+            
+            self.tokens -= 1
+            if self.tokens < 0:
+                self._sleep(-self.tokens / self.ops_per_second)
+        
+        if self.max_latency and self.average_latency > self.max_latency:
+            self._sleep(min(self.average_latency * self.average_latency / self.max_latency, MAX_BACKOFF_DELAY))
+    
+    def _sleep(self, seconds):
+        self.slept += seconds
+        self.sleep(seconds)
+    
+    def record_latency(self, seconds):
+        """
+        Adds an operation latency to the moving average.
+        """
+        self.average_latency = self.average_latency * 0.8 + seconds * 0.2
+    
+    def stat(self, path):
+        self.wait()
+        start = self.clock()
+        try:
+            return os.stat(path)
+        finally:
+            self.record_latency(self.clock() - start)
+
+def set_idle_io_priority():
+    """
+    Sets the I/O priority of the process to idle using ioprio_set on Linux,
+    otherwise the process is niced as some I/O schedulers use the CPU priority.
+    
+    Returns a description of what was done.
+    """
+    syscall_number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if platform.system() == 'Linux' and syscall_number is not None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if libc.syscall(syscall_number, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) == 0:
+            logger.info('Set I/O priority to idle')
+            return 'idle I/O priority'
+        logger.warning('Unable to set I/O priority: %s' % os.strerror(ctypes.get_errno()))
+    
+    if hasattr(os, 'setpriority'):
+        os.setpriority(os.PRIO_PROCESS, 0, 19)
+    else:
+        os.nice(19 - os.nice(0))
+    logger.info('Set CPU priority to lowest')
+    return 'lowest CPU priority'
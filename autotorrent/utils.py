@@ -1,11 +1,35 @@
+import errno
+import fnmatch
+import logging
 import os
 import re
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
 __all__ = [
     'is_unsplitable',
     'get_root_of_unsplitable',
+    'is_unsplitable_subfolder',
+    'compile_patterns',
+    'find_torrent_files',
+    'reflink',
+    'ReflinkNotSupportedException',
 ]
 
+logger = logging.getLogger(__name__)
+
+FICLONE = 0x40049409 # _IOW(0x94, 9, int) from linux/fs.h
+
+REFLINK_UNSUPPORTED_ERRNOS = set([errno.EOPNOTSUPP, errno.ENOTSUP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.ENOSYS, errno.EPERM])
+
 UNSPLITABLE_FILE_EXTENSIONS = [
     set(['.rar', '.sfv']),
     set(['.mp3', '.sfv']),
@@ -42,11 +66,97 @@ def get_root_of_unsplitable(path):
         if not p:
             continue
         
-        if re.match(r'^(cd[1-9])|(samples?)|(proofs?)|((vob)?sub(title)?s?)$', p, re.IGNORECASE): # scene paths
-            continue
-        
-        if re.match(r'^(bdmv)|(disc\d*)|(video_ts)$', p, re.IGNORECASE): # bluray / dd
+        if is_unsplitable_subfolder(p):
             continue
         
+        return p
+
+def is_unsplitable_subfolder(name):
+    """
+    Checks if a folder name is a known subfolder of a release, e.g. cd1 or bdmv.
+    These folders are never the root of an unsplitable release.
+    """
+    if re.match(r'^(cd[1-9])|(samples?)|(proofs?)|((vob)?sub(title)?s?)$', name, re.IGNORECASE): # scene paths
+        return True
+    
+    if re.match(r'^(bdmv)|(disc\d*)|(video_ts)$', name, re.IGNORECASE): # bluray / dd
+        return True
+    
+    return False
+
+def compile_patterns(patterns):
+    """
+    Compiles a list of wildcard patterns into a single regular expression.
+    
+    Returns None if there are no patterns.
+    """
+    patterns = [p for p in patterns if p]
+    if not patterns:
+        return None
+    
+    return re.compile('|'.join('(?:%s)' % fnmatch.translate(p) for p in patterns))
+
+def find_torrent_files(paths):
+    """
+    Yields the torrent files in paths, folders are searched recursively
+    for files ending with .torrent. Other paths are yielded as they are.
+    
+    Symlinked folders are followed, but every folder is only searched once
+    so symlink loops end. Folders that cannot be read are logged and skipped.
+    """
+    visited = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for torrent_file in _find_torrent_files(path, visited):
+                yield torrent_file
+        else:
+            yield path
+
+def _find_torrent_files(path, visited):
+    try:
+        stat = os.stat(path)
+        if (stat.st_dev, stat.st_ino) in visited:
+            return
+        visited.add((stat.st_dev, stat.st_ino))
         
-        return p
\ No newline at end of file
+        if scandir is not None:
+            entries = sorted((entry.name, entry.is_dir()) for entry in scandir(path))
+        else:
+            entries = sorted((name, os.path.isdir(os.path.join(path, name))) for name in os.listdir(path))
+    except OSError as e:
+        logger.warning('Unable to search %r for torrent files: %s' % (path, e))
+        return
+    
+    for name, is_dir in entries:
+        p = os.path.join(path, name)
+        if is_dir:
+            for torrent_file in _find_torrent_files(p, visited):
+                yield torrent_file
+        elif name.lower().endswith('.torrent'):
+            yield p
+
+class ReflinkNotSupportedException(Exception):
+    pass
+
+def reflink(source, destination):
+    """
+    Makes a copy-on-write clone of source at destination using the FICLONE ioctl.
+    Only works on filesystems supporting it, e.g. btrfs and XFS.
+    
+    Raises ReflinkNotSupportedException if the clone cannot be made.
+    """
+    if fcntl is None:
+        raise ReflinkNotSupportedException('fcntl is not available')
+    
+    with open(source, 'rb') as src:
+        fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            fcntl.ioctl(fd, FICLONE, src.fileno())
+        except (IOError, OSError) as e:
+            os.close(fd)
+            os.remove(destination)
+            if e.errno in REFLINK_UNSUPPORTED_ERRNOS:
+                raise ReflinkNotSupportedException('Unable to reflink %r: %s' % (source, e))
+            raise
+        else:
+            os.close(fd)
@@ -0,0 +1,135 @@
+from __future__ import division
+
+import hashlib
+import logging
+import mmap
+import multiprocessing
+import random
+
+from .pieces import get_piece_map
+
+__all__ = [
+    'hash_piece',
+    'sample_pieces',
+    'verify_file',
+    'verify_files',
+]
+
+logger = logging.getLogger(__name__)
+
+def hash_piece(segments):
+    """
+    SHA1 hashes a piece made of (path, offset, length) segments.
+    The files are read using mmap.
+    """
+    h = hashlib.sha1()
+    for path, offset, length in segments:
+        if not length:
+            continue
+
+        aligned_offset = offset - (offset % mmap.ALLOCATIONGRANULARITY)
+        with open(path, 'rb') as f:
+            m = mmap.mmap(f.fileno(), length + offset - aligned_offset, access=mmap.ACCESS_READ, offset=aligned_offset)
+            try:
+                h.update(m[offset - aligned_offset:])
+            finally:
+                m.close()
+    return h.digest()
+
+def _hash_piece(args):
+    piece, segments = args
+    try:
+        return piece, hash_piece(segments)
+    except (IOError, OSError, ValueError) as e:
+        logger.debug('Failed to hash piece %s: %r' % (piece, e))
+        return piece, None
+
+def sample_pieces(piece_map, count, rng=random):
+    """
+    Returns the first and last piece fully covered by found files and
+    count random ones in between.
+    """
+    availability = piece_map.availability()
+    pieces = [piece for piece, missing in enumerate(availability.missing) if not missing]
+    if len(pieces) <= count + 2:
+        return pieces
+
+    return sorted([pieces[0], pieces[-1]] + rng.sample(pieces[1:-1], count))
+
+def verify_file(torrent, files, index, path):
+    """
+    Checks that path has the data of the file at index by hashing a piece it is part of.
+
+    A piece inside the file is used if there is one, otherwise the first or last
+    piece of the file if the rest of that piece is made of found files.
+    Returns False if no piece can be hashed or the piece does not match.
+    """
+    piece_map = get_piece_map(torrent, files)
+    piece_length = piece_map.piece_length
+    start = piece_map.offsets[index]
+    end = start + files[index]['length']
+
+    first, last = piece_map.first_pieces[index], piece_map.last_pieces[index]
+    inner_first = (start + piece_length - 1) // piece_length
+    inner_last = last if last * piece_length + piece_map.piece_size(last) <= end else last - 1
+    if inner_first <= inner_last:
+        pieces = [(inner_first + inner_last) // 2]
+    else:
+        pieces = sorted(set([first, last]))
+
+    for piece in pieces:
+        if piece < first or piece > last:
+            continue
+
+        indexes = piece_map.files_in_piece(piece)
+        if any(i != index and not files[i]['completed'] for i in indexes):
+            continue
+
+        segments = [(path if i == index else segment[0], ) + segment[1:] for i, segment in zip(indexes, piece_map.segments(piece))]
+        piece, digest = _hash_piece((piece, segments))
+        return digest == torrent[b'info'][b'pieces'][piece*20:(piece+1)*20]
+
+    logger.debug('No piece of file %s can be hashed with the found files' % index)
+    return False
+
+def verify_files(torrent, files, count, processes=1, rng=random, pool=None):
+    """
+    Checks a sample of the pieces covered by found files against the
+    piece hashes in the torrent.
+
+    The pieces are hashed with pool if it is given, e.g. a pool kept for
+    all torrents in a run, otherwise a pool of processes is created.
+
+    Files that are part of a piece that does not match are marked as not completed.
+    Returns a list of the pieces that failed.
+    """
+    info = torrent[b'info']
+    piece_map = get_piece_map(torrent, files)
+    pieces = sample_pieces(piece_map, count, rng)
+    if not pieces:
+        return []
+
+    logger.info('Verifying %s pieces' % len(pieces))
+    work = [(piece, piece_map.segments(piece)) for piece in pieces]
+    if pool is not None and len(work) > 1:
+        results = pool.map(_hash_piece, work)
+    elif processes > 1 and len(work) > 1:
+        pool = multiprocessing.Pool(min(processes, len(work)))
+        try:
+            results = pool.map(_hash_piece, work)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_hash_piece(w) for w in work]
+
+    failed_pieces = []
+    for piece, digest in results:
+        if digest != info[b'pieces'][piece*20:(piece+1)*20]:
+            logger.info('Piece %s did not match' % piece)
+            failed_pieces.append(piece)
+            for i in piece_map.files_in_piece(piece):
+                files[i]['actual_path'] = None
+                files[i]['completed'] = False
+
+    return failed_pieces
@@ -0,0 +1,9 @@
+"""
+Benchmarks for AutoTorrent.
+
+Generates a synthetic library of sparse files and matching torrents,
+then times rebuilding the database, looking up torrents, linking and
+creating rtorrent fast resume data.
+
+Run with: python -m benchmarks --help
+"""
@@ -0,0 +1,76 @@
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from .generate import generate_library, generate_torrents
+from .scenarios import run_scenarios, SCENARIOS
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmarks AutoTorrent against a generated library of sparse files')
+    parser.add_argument("--path", dest="path", default=None, help='Folder to generate the library in, a temporary folder is used if not set')
+    parser.add_argument("--keep", action="store_true", dest="keep", default=False, help='Keep the generated library')
+    parser.add_argument("--normal", dest="normal", type=int, default=100, help='Number of folders with normal files')
+    parser.add_argument("--files-per-folder", dest="files_per_folder", type=int, default=10, help='Number of files in each normal folder')
+    parser.add_argument("--scene", dest="scene", type=int, default=100, help='Number of scene releases')
+    parser.add_argument("--bluray", dest="bluray", type=int, default=10, help='Number of bluray releases')
+    parser.add_argument("--torrents", dest="torrents", type=int, default=100, help='Number of torrents to generate')
+    parser.add_argument("--seed", dest="seed", type=int, default=0, help='Seed used to generate the library')
+    parser.add_argument("--link-workers", dest="link_workers", type=int, default=1, help='Number of threads used to make links')
+    parser.add_argument("--scenario", dest="scenarios", action="append", choices=SCENARIOS, help='Scenario to run, can be used multiple times (default all)')
+    parser.add_argument("-o", "--output", dest="output", default=None, help='Write the JSON results to this file instead of stdout')
+    parser.add_argument("--verbose", help="increase output verbosity", action="store_true", dest="verbose")
+    
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.ERROR)
+    
+    work_path = args.path or tempfile.mkdtemp(prefix='autotorrent-benchmark-')
+    library_path = os.path.join(work_path, 'library')
+    try:
+        print('Generating library in %s' % library_path, file=sys.stderr)
+        start = time.time()
+        releases = generate_library(library_path, args.normal, args.files_per_folder, args.scene, args.bluray, args.seed)
+        torrent_files = generate_torrents(os.path.join(work_path, 'torrents'), releases, args.torrents, args.seed)
+        file_count = sum(len(release.files) for release in releases)
+        print('Generated %s files and %s torrents in %.2f seconds' % (file_count, len(torrent_files), time.time() - start), file=sys.stderr)
+        
+        disks = [os.path.join(library_path, layout) for layout in sorted(set(release.layout for release in releases))]
+        results = run_scenarios(work_path, disks, file_count, torrent_files, args.scenarios or SCENARIOS, args.link_workers)
+    finally:
+        if not args.keep and not args.path:
+            shutil.rmtree(work_path)
+    
+    output = {
+        'time': int(time.time()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'normal': args.normal,
+            'files_per_folder': args.files_per_folder,
+            'scene': args.scene,
+            'bluray': args.bluray,
+            'torrents': len(torrent_files),
+            'files': file_count,
+            'seed': args.seed,
+            'link_workers': args.link_workers,
+        },
+        'results': results,
+    }
+    
+    output = json.dumps(output, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
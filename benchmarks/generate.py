@@ -0,0 +1,165 @@
+from __future__ import division, unicode_literals
+
+import hashlib
+import os
+import random
+
+from autotorrent.bencode import bencode
+
+__all__ = [
+    'Release',
+    'generate_library',
+    'generate_torrents',
+]
+
+MB = 1024*1024
+
+class Release(object):
+    """
+    A folder in the generated library that a torrent can be made from.
+    files is a list of (path, size) where path is a list relative to the release folder.
+    """
+    def __init__(self, path, layout):
+        self.path = path
+        self.layout = layout
+        self.files = []
+    
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+    
+    def add_file(self, path, size):
+        self.files.append((path, size))
+        create_sparse_file(os.path.join(self.path, *path), size)
+    
+    @property
+    def total_size(self):
+        return sum(size for path, size in self.files)
+
+def create_sparse_file(path, size):
+    """
+    Creates a file with a given size without writing any data.
+    """
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+def generate_normal(path, i, files_per_folder, rng):
+    release = Release(os.path.join(path, 'normal', 'Collection.%06i' % i), 'normal')
+    for j in range(files_per_folder):
+        release.add_file(['file.%06i.%04i.mkv' % (i, j)], rng.randint(1, 2000) * MB)
+    release.add_file(['collection.%06i.nfo' % i], rng.randint(1000, 20000))
+    return release
+
+def generate_scene(path, i, rng):
+    name = 'Some.Scene.Release.%06i-GRP' % i
+    release = Release(os.path.join(path, 'scene', name), 'scene')
+    rls = 'grp-ssr%06i' % i
+    
+    if i % 5 == 0: # multi cd release
+        cds = ['CD1', 'CD2']
+    else:
+        cds = [None]
+    
+    for cd_number, cd in enumerate(cds, 1):
+        prefix = [cd] if cd else []
+        volumes = rng.randint(5, 50)
+        cd_rls = '%s-%s' % (rls, cd_number) if cd else rls
+        release.add_file(prefix + ['%s.rar' % cd_rls], 50 * MB)
+        for volume in range(volumes - 1):
+            release.add_file(prefix + ['%s.r%02i' % (cd_rls, volume)], 50 * MB)
+        release.add_file(prefix + ['%s.sfv' % cd_rls], 40 * volumes)
+    
+    release.add_file(['%s.nfo' % rls], rng.randint(1000, 20000))
+    release.add_file(['Sample', '%s-sample.mkv' % rls], rng.randint(10, 80) * MB)
+    return release
+
+def generate_bluray(path, i, rng):
+    release = Release(os.path.join(path, 'bluray', 'Some.Movie.%06i.COMPLETE.BLURAY-GRP' % i), 'bluray')
+    release.add_file(['BDMV', 'index.bdmv'], 120)
+    release.add_file(['BDMV', 'MovieObject.bdmv'], rng.randint(1000, 30000))
+    for playlist in range(rng.randint(1, 20)):
+        release.add_file(['BDMV', 'PLAYLIST', '%05i.mpls' % playlist], rng.randint(100, 10000))
+    for stream in range(rng.randint(1, 10)):
+        release.add_file(['BDMV', 'STREAM', '%05i.m2ts' % stream], rng.randint(10, 30000) * MB)
+        release.add_file(['BDMV', 'CLIPINF', '%05i.clpi' % stream], rng.randint(100, 10000))
+    release.add_file(['CERTIFICATE', 'id.bdmv'], 104)
+    return release
+
+def generate_library(path, normal=100, files_per_folder=10, scene=100, bluray=10, seed=0):
+    """
+    Generates a library of sparse files in path.
+    
+    normal is the number of folders with files_per_folder normal files,
+    scene is the number of scene releases (every fifth is a multi cd release)
+    and bluray is the number of BDMV trees.
+    
+    Returns a list of the releases generated.
+    """
+    rng = random.Random(seed)
+    releases = []
+    for i in range(normal):
+        releases.append(generate_normal(path, i, files_per_folder, rng))
+    
+    for i in range(scene):
+        releases.append(generate_scene(path, i, rng))
+    
+    for i in range(bluray):
+        releases.append(generate_bluray(path, i, rng))
+    
+    return releases
+
+def pick_piece_length(total_size):
+    """
+    Picks a piece length giving roughly 1500 pieces.
+    """
+    piece_length = 256 * 1024
+    while piece_length < 16 * MB and total_size // piece_length > 1500:
+        piece_length *= 2
+    return piece_length
+
+def create_torrent(release):
+    """
+    Creates a decoded multi-file torrent for a release.
+    The files are sparse so all pieces only contain zeros.
+    """
+    total_size = release.total_size
+    piece_length = pick_piece_length(total_size)
+    piece_count = (total_size + piece_length - 1) // piece_length
+    
+    full_piece = hashlib.sha1(b'\x00' * piece_length).digest()
+    last_piece = hashlib.sha1(b'\x00' * (total_size - (piece_count - 1) * piece_length)).digest()
+    
+    return {
+        b'announce': b'http://127.0.0.1/announce',
+        b'info': {
+            b'name': release.name.encode('utf-8'),
+            b'piece length': piece_length,
+            b'pieces': full_piece * (piece_count - 1) + last_piece,
+            b'files': [{b'length': size, b'path': [p.encode('utf-8') for p in path]} for path, size in release.files],
+        }
+    }
+
+def generate_torrents(path, releases, count=None, seed=0):
+    """
+    Writes torrents for count random releases to path.
+    
+    Returns a list of paths to the torrents.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    
+    if count is not None and count < len(releases):
+        releases = random.Random(seed).sample(releases, count)
+    
+    torrent_files = []
+    for release in releases:
+        torrent_file = os.path.join(path, '%s.torrent' % release.name)
+        with open(torrent_file, 'wb') as f:
+            f.write(bencode(create_torrent(release)))
+        torrent_files.append(torrent_file)
+    
+    return torrent_files
@@ -0,0 +1,50 @@
+"""
+Microbenchmark of Database.keyify compared to the old hex sha256 keys.
+
+Run with: python -m benchmarks.keyify
+"""
+from __future__ import division, print_function
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+from timeit import default_timer
+
+from autotorrent.db import Database
+
+logger = logging.getLogger('autotorrent.db')
+
+def keyify_v1(size, *names):
+    key = '%s|%s' % (size, '|'.join(names))
+    logger.debug('Keyify: %s' % key)
+    
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def measure(keyify, names, rounds):
+    start = default_timer()
+    for i in range(rounds):
+        for size, name in names:
+            keyify(size, name)
+    return len(names) * rounds / (default_timer() - start)
+
+def main(count=100000, rounds=5):
+    names = [(i * 1024, 'some.file.name.%06i.mkv' % i) for i in range(count)]
+    
+    temp_path = tempfile.mkdtemp()
+    try:
+        db = Database(os.path.join(temp_path, 'autotorrent.db'), [], [], True, True, True)
+        v1 = measure(keyify_v1, names, rounds)
+        v2 = measure(db.keyify, names, rounds)
+        db.close()
+    finally:
+        shutil.rmtree(temp_path)
+    
+    print('v1 (sha256 hex, 64 bytes): %10i keys/s' % v1)
+    print('v2 (%-15s 17 bytes): %10i keys/s' % ('blake2s,' if hasattr(hashlib, 'blake2s') else 'sha256,', v2))
+    print('speedup: %.2fx' % (v2 / v1))
+
+if __name__ == '__main__':
+    main()
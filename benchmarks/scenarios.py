@@ -0,0 +1,229 @@
+from __future__ import division, unicode_literals
+
+import hashlib
+import os
+import shutil
+
+from timeit import default_timer
+
+from autotorrent.at import AutoTorrent, status_names
+from autotorrent.bencode import bdecode, bencode
+from autotorrent.clients.rtorrent import RTorrentClient
+from autotorrent.db import Database
+
+__all__ = [
+    'run_scenarios',
+    'SCENARIOS',
+]
+
+SCENARIOS = ['rebuild', 'lookup', 'link', 'fast_resume', 'add']
+
+def get_info_hash(torrent):
+    return hashlib.sha1(bencode(torrent[b'info'])).hexdigest()
+
+class StubClient(object):
+    """
+    A client that accepts all torrents without doing anything.
+    """
+    def __init__(self):
+        self.hashes = set()
+    
+    def get_torrents(self):
+        return self.hashes
+    
+    def add_torrent(self, torrent, destination_path, files):
+        self.hashes.add(get_info_hash(torrent))
+        return True
+
+class StubRTorrentProxy(object):
+    """
+    Replaces the XMLRPC proxy of the rtorrent client, loads the torrents sent to it.
+    """
+    def __init__(self):
+        self.hashes = set()
+    
+    def load_start(self, torrent_file, *commands):
+        with open(torrent_file, 'rb') as f:
+            self.hashes.add(get_info_hash(bdecode(f.read())))
+    
+    def download_list(self):
+        return list(self.hashes)
+
+class QuietAutoTorrent(AutoTorrent):
+    def print_status(self, status, torrentfile, message):
+        pass
+
+def timed(f, *args, **kwargs):
+    start = default_timer()
+    result = f(*args, **kwargs)
+    return default_timer() - start, result
+
+def read_torrents(torrent_files):
+    torrents = []
+    for torrent_file in torrent_files:
+        with open(torrent_file, 'rb') as f:
+            torrents.append(bdecode(f.read()))
+    return torrents
+
+def create_database(work_path, disks, exact_mode=False):
+    """
+    Opens the benchmark database. Exact mode is only used when rebuilding,
+    otherwise every generated release would be found in exact mode and nothing linked.
+    """
+    return Database(os.path.join(work_path, 'autotorrent.db'), disks, ['*.nfo'], True, True, exact_mode)
+
+def create_autotorrent(db, store_path, client):
+    return QuietAutoTorrent(db, client, store_path, 1024**4, 100, False)
+
+def run_rebuild(work_path, disks, file_count, **kwargs):
+    db = create_database(work_path, disks, exact_mode=True)
+    seconds, _ = timed(db.rebuild)
+    database_bytes = db.get_size_on_disk()
+    payload_bytes = 0
+    for shelf in [db.db] + [shard.db for shard in db.shards.values()]:
+        raw = shelf.dict # the pickled values, without the padding some dbm backends add
+        payload_bytes += sum(len(key) + len(raw[key]) for key in raw.keys())
+    db.close()
+    return {
+        'seconds': seconds,
+        'database_bytes': database_bytes,
+        'database_payload_bytes': payload_bytes,
+        'files': file_count,
+        'files_per_second': file_count / seconds,
+    }
+
+def run_lookup(work_path, disks, torrents, **kwargs):
+    db = create_database(work_path, disks)
+    at = create_autotorrent(db, os.path.join(work_path, 'store'), StubClient())
+    
+    found = 0
+    seconds = 0
+    for torrent in torrents:
+        elapsed, (found_size, missing_size, files) = timed(at.parse_torrent, torrent)
+        seconds += elapsed
+        if not missing_size:
+            found += 1
+    db.close()
+    
+    file_count = sum(len(torrent[b'info'][b'files']) for torrent in torrents)
+    return {
+        'seconds': seconds,
+        'torrents': len(torrents),
+        'torrents_complete': found,
+        'files': file_count,
+        'files_per_second': file_count / seconds,
+    }
+
+def run_link(work_path, disks, torrents, link_workers=1, **kwargs):
+    store_path = os.path.join(work_path, 'store_link')
+    db = create_database(work_path, disks)
+    at = create_autotorrent(db, store_path, StubClient())
+    at.link_workers = link_workers
+    
+    seconds = 0
+    link_count = 0
+    for torrent in torrents:
+        files = at.match_torrent(torrent)
+        if files['mode'] != 'link':
+            continue
+        
+        destination_path = os.path.join(store_path, torrent[b'info'][b'name'].decode('utf-8'))
+        elapsed, _ = timed(at.link_files, destination_path, files['files'])
+        seconds += elapsed
+        link_count += sum(1 for f in files['files'] if f['completed'])
+    db.close()
+    
+    shutil.rmtree(store_path)
+    return {
+        'seconds': seconds,
+        'links': link_count,
+        'link_workers': link_workers,
+        'links_per_second': link_count / seconds if seconds else None,
+    }
+
+def run_fast_resume(work_path, disks, torrents, **kwargs):
+    store_path = os.path.join(work_path, 'store_resume')
+    db = create_database(work_path, disks)
+    at = create_autotorrent(db, store_path, StubClient())
+    at.link_type = 'hard' # rtorrent wants the mtime of the actual file
+    
+    client = RTorrentClient('http://127.0.0.1:1/RPC2', 'benchmark')
+    client.proxy = StubRTorrentProxy()
+    
+    seconds = 0
+    piece_count = 0
+    for torrent in torrents:
+        files = at.match_torrent(torrent)
+        if files['mode'] == 'link':
+            destination_path = os.path.join(store_path, torrent[b'info'][b'name'].decode('utf-8'))
+            at.link_files(destination_path, files['files'])
+        else:
+            destination_path = files['source_path']
+        
+        elapsed, _ = timed(client.add_torrent, torrent, destination_path, files['files'])
+        seconds += elapsed
+        piece_count += len(torrent[b'info'][b'pieces']) // 20
+    db.close()
+    
+    shutil.rmtree(store_path)
+    return {
+        'seconds': seconds,
+        'torrents': len(torrents),
+        'pieces': piece_count,
+        'torrents_per_second': len(torrents) / seconds,
+    }
+
+def run_add(work_path, disks, torrent_files, **kwargs):
+    store_path = os.path.join(work_path, 'store_add')
+    db = create_database(work_path, disks)
+    at = create_autotorrent(db, store_path, StubClient())
+    at.populate_torrents_seeded()
+    
+    statuses = {}
+    start = default_timer()
+    for torrent_file in torrent_files:
+        status = at.handle_torrentfile(torrent_file)
+        statuses[status] = statuses.get(status, 0) + 1
+    seconds = default_timer() - start
+    db.close()
+    
+    shutil.rmtree(store_path)
+    return {
+        'seconds': seconds,
+        'torrents': len(torrent_files),
+        'torrents_per_second': len(torrent_files) / seconds,
+        'statuses': dict((status_names[status], count) for status, count in statuses.items()),
+    }
+
+def run_scenarios(work_path, disks, file_count, torrent_files, scenarios=SCENARIOS, link_workers=1):
+    """
+    Runs the scenarios against a generated library. The database is
+    always rebuilt first as the other scenarios use it.
+    
+    Returns a dict with the results of each scenario.
+    """
+    torrents = read_torrents(torrent_files)
+    kwargs = {
+        'file_count': file_count,
+        'torrents': torrents,
+        'torrent_files': torrent_files,
+        'link_workers': link_workers,
+    }
+    
+    runners = {
+        'rebuild': run_rebuild,
+        'lookup': run_lookup,
+        'link': run_link,
+        'fast_resume': run_fast_resume,
+        'add': run_add,
+    }
+    
+    if 'rebuild' not in scenarios:
+        run_rebuild(work_path, disks, **kwargs)
+    
+    results = {}
+    for scenario in SCENARIOS:
+        if scenario in scenarios:
+            results[scenario] = runners[scenario](work_path, disks, **kwargs)
+    
+    return results